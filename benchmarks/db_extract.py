@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Database benchmark: fetch error columns into numpy arrays.
+#
+# Fills a fresh SQLite database with N errordata rows and times three ways of
+# getting run_id, trial and error out of it:
+#    per cell - the old getColumns loop: QSqlQuery.next(), a type check and a
+#               conversion for every value, numpy arrays built at the end
+#    qtsql    - data_extractor.getColumns without the sqlite3 module: rows in
+#               chunks, converted a column at a time into numpy buffers
+#    sqlite3  - data_extractor.getColumns as it runs on SQLite databases
+#
+# usage (from the MikeNetGUI directory):
+#    python benchmarks/db_extract.py [number of rows]
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+from PySide import QtCore,QtSql
+import numpy as np
+from lib import db_utils
+import data_extractor
+
+VARIABLES = ['run_id','trial','error']
+
+def fillDatabase(db,n):
+    q = QtSql.QSqlQuery(db)
+    q.exec_('create table errordata(id INTEGER,run_id INTEGER,run_trial INTEGER,' +
+            'trial INTEGER,error REAL);')
+    db.transaction()
+    inserter = db_utils.BatchInserter(db)
+    for i in range(n):
+        inserter.add('errordata',['id','run_id','run_trial','trial','error'],
+                     [i//1000+1,i//1000+1,1,(i % 1000)*50,1.0/(i % 1000+1)])
+    inserter.flush()
+    db.commit()
+
+def perCell(db,varDict,usrVars,queryString):
+    columns = [[] for v in usrVars]
+    q = QtSql.QSqlQuery(db)
+    q.setForwardOnly(True)
+    q.exec_(queryString)
+    while q.next():
+        for i,v in enumerate(usrVars):
+            if varDict[v][0] == "<type 'int'>":
+                columns[i].append(int(q.value(i)))
+            elif varDict[v][0] == "<type 'float'>":
+                columns[i].append(float(q.value(i)))
+    return [np.array(c,dtype=np.float64 if varDict[v][0] == "<type 'float'>" else np.int32)
+            for c,v in zip(columns,usrVars)]
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    work_dir = tempfile.mkdtemp()
+    try:
+        db = QtSql.QSqlDatabase.addDatabase('QSQLITE','bench')
+        db.setDatabaseName(os.path.join(work_dir,'bench.db'))
+        db.open()
+        fillDatabase(db,n)
+        print 'errordata rows:',n
+        print
+
+        varDict = {'run_id': ["<type 'int'>",['errordata']],
+                   'trial': ["<type 'int'>",['errordata']],
+                   'error': ["<type 'float'>",['errordata']]}
+        queryString = data_extractor.buildQueryString(varDict,VARIABLES,None,[],[])
+        sqlite3 = data_extractor.sqlite3
+        results = []
+        for label in ['per cell','qtsql','sqlite3']:
+            data_extractor.sqlite3 = sqlite3 if label == 'sqlite3' else None
+            tic = time.time()
+            if label == 'per cell':
+                cols = perCell(db,varDict,VARIABLES,queryString)
+            else:
+                cols = data_extractor.getColumns(db,varDict,VARIABLES,queryString)
+            seconds = time.time() - tic
+            print '%-9s %8d rows  %7.2f s  %10.0f rows/s' % (label,len(cols[0]),seconds,
+                                                              len(cols[0])/seconds)
+            results.append(cols)
+        data_extractor.sqlite3 = sqlite3
+        for cols in results[1:]:
+            if not all(np.array_equal(a,b) for a,b in zip(results[0],cols)):
+                print 'ERROR: Columns differ from the per cell fetch'
+        db.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
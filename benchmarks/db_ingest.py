@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Database benchmark: push a run with a large error log into SQLite.
+#
+# Writes a fake run directory (metadata plus a log with N avgError lines) and
+# times two ways of getting it into a fresh database:
+#    per row  - db_utils.pushRecord for every line, one implicit transaction
+#               (and fsync) per row, the way pushRunData used to work. this is
+#               timed over the first few thousand lines only and extrapolated
+#    batched  - db_utils.pushRunData: one transaction, one prepared statement
+#               per table, rows bound in batches with execBatch
+#
+# usage (from the MikeNetGUI directory):
+#    python benchmarks/db_ingest.py [number of error lines] [per row sample]
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,'lib'))
+from PySide import QtCore,QtSql
+import db_utils
+
+class Parameter():
+    def __init__(self,value,dropdown_options=None):
+        self.value = value
+        self.dropdown_options = dropdown_options
+
+class BenchmarkGUI():
+    # just the database preferences pushRunData reads
+    def __init__(self,db_path):
+        self.parameters = {'database_driver': Parameter(0,['SQLite version 3 or above']),
+                           'database_host_name': Parameter(''),
+                           'database_path': Parameter(db_path),
+                           'database_user_name': Parameter(''),
+                           'database_password': Parameter('')}
+
+def writeRun(run_dir,n):
+    with open(os.path.join(run_dir,'bench.metadata'),'w') as f:
+        f.write('run_name=bench\tseed=0\tphase_item=train event\tepsilon=0.1\n')
+        f.write('GROUP\tphase_item=train event\tgroup=Input\tunits=2\t'+
+                'activation_type=LOGISTIC_ACTIVATION\t'+
+                'error_computation_type=SUM_SQUARED_ERROR\t\n')
+    with open(os.path.join(run_dir,'bench.log'),'w') as f:
+        for i in range(n):
+            f.write('avgError:\ttrain event\t1\t%d\t%f\n' % (i+1,1.0/(i+1)))
+
+def countRows(db_path):
+    db = QtSql.QSqlDatabase.addDatabase('QSQLITE','count')
+    db.setDatabaseName(db_path)
+    db.open()
+    q = QtSql.QSqlQuery(db)
+    q.exec_('select count(*) from errordata;')
+    q.next()
+    count = int(q.value(0))
+    db.close()
+    return count
+
+def perRow(run_dir,db_path,sample):
+    # the old path, over the first sample lines of the log
+    db = QtSql.QSqlDatabase.addDatabase('QSQLITE','per_row')
+    db.setDatabaseName(db_path)
+    db.open()
+    db_utils.initializeTables(run_dir,db,'QSQLITE')
+    tic = time.time()
+    with open(os.path.join(run_dir,'bench.log'),'r') as f:
+        for i,line in enumerate(f):
+            if i == sample:
+                break
+            lsplit = line.replace('\n','').split('\t')
+            db_utils.pushRecord(db,'errordata',['run_id','id','run_trial','trial','error'],
+                                [1,1] + lsplit[2:])
+    seconds = time.time() - tic
+    db.close()
+    return seconds
+
+def report(label,rows,seconds):
+    print '%-9s %8d rows  %9.2f s  %10.0f rows/s' % (label,rows,seconds,rows/seconds)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    work_dir = tempfile.mkdtemp()
+    try:
+        run_dir = os.path.join(work_dir,'bench')
+        os.mkdir(run_dir)
+        writeRun(run_dir,n)
+        print 'Error log lines:',n
+        print
+
+        sample = min(sample,n)
+        seconds = perRow(run_dir,os.path.join(work_dir,'per_row.db'),sample)
+        report('per row',sample,seconds)
+        print '          (%d rows would take about %.0f s)' % (n,seconds*n/sample)
+
+        db_path = os.path.join(work_dir,'batched.db')
+        tic = time.time()
+        ret = db_utils.pushRunData(run_dir,BenchmarkGUI(db_path))
+        seconds = time.time() - tic
+        if ret:
+            print 'ERROR: Could not push',ret
+            return
+        report('batched',countRows(db_path),seconds)
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
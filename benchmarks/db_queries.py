@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Database benchmark: data_extractor style queries, before and after indexing.
+#
+# Fills a fresh SQLite database with N runs (two phase items each, a learning
+# curve of T points per phase item), times a few extraction queries built by
+# data_extractor.buildQueryString, then adds the indexes db_utils.createIndexes
+# gives every database on connect and times the same queries again.
+#
+# usage (from the MikeNetGUI directory):
+#    python benchmarks/db_queries.py [number of runs] [points per curve]
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+from PySide import QtCore,QtSql
+from lib import db_utils
+import data_extractor
+
+# (variables,constraints) as they would be typed into data_extractor
+QUERIES = [(['trial','error'],'run_name = "run_%d"'),
+           (['run_name','trial','error'],'epsilon = 0.2 and phase_item = "train" and trial <= 500'),
+           (['run_id','error'],'run_id = %d and trial = %d')]
+
+def fillDatabase(db,runs,points):
+    q = QtSql.QSqlQuery(db)
+    q.exec_('create table metadata(id INTEGER,run_id INTEGER,run_name TEXT,' +
+            'phase_item TEXT,epsilon REAL,seed INTEGER);')
+    q.exec_('create table errordata(id INTEGER,run_id INTEGER,run_trial INTEGER,' +
+            'trial INTEGER,error REAL);')
+    db.transaction()
+    inserter = db_utils.BatchInserter(db)
+    phase_item_id = 0
+    for run_id in range(1,runs+1):
+        for phase_item in ['train','test']:
+            phase_item_id += 1
+            inserter.add('metadata',['id','run_id','run_name','phase_item','epsilon','seed'],
+                         [phase_item_id,run_id,'run_'+str(run_id),phase_item,0.1*(run_id % 5),run_id])
+            for t in range(points):
+                inserter.add('errordata',['id','run_id','run_trial','trial','error'],
+                             [phase_item_id,run_id,1,t*50,1.0/(t+1)])
+    inserter.flush()
+    db.commit()
+
+def getQueries(runs,points):
+    varDict = {'id': ['',['metadata','errordata']],
+               'run_id': ['',['metadata','errordata']],
+               'run_name': ['',['metadata']],
+               'phase_item': ['',['metadata']],
+               'epsilon': ['',['metadata']],
+               'trial': ['',['errordata']],
+               'error': ['',['errordata']]}
+    constraints = [QUERIES[0][1] % (runs*4//7),
+                   QUERIES[1][1],
+                   QUERIES[2][1] % (runs-1,(points-1)*50)]
+    queries = []
+    for (usrVars,c),usrConst in zip(QUERIES,constraints):
+        queries.append(data_extractor.buildQueryString(varDict,usrVars,usrConst))
+    return queries
+
+def timeQueries(db,queries):
+    times = []
+    for queryString in queries:
+        q = QtSql.QSqlQuery(db)
+        q.setForwardOnly(True)
+        tic = time.time()
+        q.exec_(queryString)
+        rows = 0
+        while q.next():
+            rows += 1
+        times.append((time.time()-tic,rows))
+    return times
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    points = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    work_dir = tempfile.mkdtemp()
+    try:
+        db = QtSql.QSqlDatabase.addDatabase('QSQLITE','bench')
+        db.setDatabaseName(os.path.join(work_dir,'bench.db'))
+        db.open()
+        fillDatabase(db,runs,points)
+        print 'Runs:',runs,'  errordata rows:',runs*2*points
+        print
+
+        queries = getQueries(runs,points)
+        before = timeQueries(db,queries)
+        tic = time.time()
+        db_utils.createIndexes(db)
+        print 'createIndexes: %.2f s' % (time.time()-tic)
+        after = timeQueries(db,queries)
+        print
+        for queryString,(old,rows),(new,rows) in zip(queries,before,after):
+            print queryString
+            print '    %6d rows  %8.4f s -> %8.4f s' % (rows,old,new)
+        db.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+/*
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+*/
+/* Micro-benchmark: draws per second from get_random_example.
+
+   Compares the rejection sampler MikeNet used to ship (pick an example
+   uniformly, keep it with chance PROB, otherwise try again) against the
+   alias table that load_examples now builds.  Both samplers are run over
+   the same example set and their histograms are compared, so the output
+   also shows that the distribution did not change.
+
+   build (from the MikeNetGUI directory, after running the installer):
+      gcc -O3 -o sampling benchmarks/example_sampling.c \
+          -Iresources/Mikenet-v8.0/include \
+          resources/Mikenet-v8.0/lib/libmikenet.a -lm
+
+   usage:
+      ./sampling [example file] [number of draws]
+
+   the default example file is test_files/6k_treiman.ex.  its groups are
+   created with the sizes below; change them for other files. */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
+#include <mikenet/simulator.h>
+
+#define TIME 12
+#define ORTHO_UNITS 110
+#define PHONO_UNITS 250
+
+/* the sampler get_random_example used before the alias table */
+Example *rejection_example(ExampleSet *set)
+{
+  int idx;
+  Real dice,prob;
+  while(1)
+    {
+      idx=(int)((mikenet_random() * (Real)set->numExamples));
+      prob=set->examples[idx].prob;
+      dice=mikenet_random();
+      if (dice < prob)
+	{
+	  set->histogram[idx]++;
+	  return &set->examples[idx];
+	}
+    }
+}
+
+double timeSampler(ExampleSet *set,Example *(*sampler)(ExampleSet *),
+		   long draws,int *histogram)
+{
+  long i;
+  clock_t start;
+  double seconds;
+
+  memset(set->histogram,0,sizeof(int)*set->numExamples);
+  mikenet_set_seed(666);
+  start=clock();
+  for(i=0;i<draws;i++)
+    sampler(set);
+  seconds=(double)(clock()-start)/CLOCKS_PER_SEC;
+  memcpy(histogram,set->histogram,sizeof(int)*set->numExamples);
+  return seconds;
+}
+
+int main(int argc,char *argv[])
+{
+  Net *net;
+  ExampleSet *examples;
+  char *fn="test_files/6k_treiman.ex";
+  long draws=10000000;
+  int *old_hist,*new_hist,i;
+  double old_secs,new_secs,diff,worst=0.0;
+
+  if (argc > 1)
+    fn=argv[1];
+  if (argc > 2)
+    draws=atol(argv[2]);
+
+  net=create_net(TIME);
+  bind_group_to_net(net,init_group("Ortho",ORTHO_UNITS,TIME));
+  bind_group_to_net(net,init_group("Phono",PHONO_UNITS,TIME));
+  examples=load_examples(fn,TIME);
+
+  old_hist=(int *)mh_calloc(sizeof(int),examples->numExamples);
+  new_hist=(int *)mh_calloc(sizeof(int),examples->numExamples);
+
+  old_secs=timeSampler(examples,rejection_example,draws,old_hist);
+  new_secs=timeSampler(examples,get_random_example,draws,new_hist);
+
+  /* largest gap between the two empirical distributions */
+  for(i=0;i<examples->numExamples;i++)
+    {
+      diff=fabs((double)(old_hist[i]-new_hist[i])/(double)draws);
+      if (diff > worst)
+	worst=diff;
+    }
+
+  printf("Example file: %s (%d examples)\n",fn,examples->numExamples);
+  printf("%-10s %10ld draws  %8.3f s  %12.0f draws/s\n","rejection",
+	 draws,old_secs,draws/old_secs);
+  printf("%-10s %10ld draws  %8.3f s  %12.0f draws/s\n","alias",
+	 draws,new_secs,draws/new_secs);
+  printf("Speedup: %.1fx\n",old_secs/new_secs);
+  printf("Largest difference in example frequency: %f\n",worst);
+  return 0;
+}
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Memory benchmark: prepare a large sweep over the first run in a script.
+#
+# Measures two ways of preparing N runs:
+#    copies   - a full MikenetRun.getCopy() per run (how plain runs, and every
+#               iterated run before MikenetRunVariant, are prepared)
+#    variants - one MikenetRunVariant per run, with a single override each
+#
+# usage (from the MikeNetGUI directory):
+#    python benchmarks/sweep_memory.py [script] [number of runs]
+import os
+import sys
+import time
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+from PySide import QtCore
+from lib import io_utils as io
+from lib import data_structures
+
+class BenchmarkGUI():
+    # just enough of a gui to read a script without opening any windows
+    def __init__(self):
+        self.parameters = {}
+        self.script = None
+
+    def getScript(self):
+        return self.script
+
+def currentMemory():
+    # resident memory of this process, in bytes
+    try:
+        with open('/proc/self/statm','r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError,ValueError,OSError):
+        import resource
+        # ru_maxrss is a high-water mark, so run the cheaper case first
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def getParameters(run):
+    # every MikenetParameter that belongs to a run
+    params = run.parameters.values()
+    for phase in run.getChildren():
+        params += phase.parameters.values()
+        for phase_item in phase.getChildren():
+            params += phase_item.parameters.values()
+            params += phase_item.getOverrides()
+    return params
+
+def findRun(node):
+    for child in node.getChildren():
+        if child.getClassName() == 'MikenetRun':
+            return child
+        if child.getClassName() == 'MikenetIterator' and child.getMyRun():
+            return child.getMyRun()
+    return None
+
+def report(label,n,seconds,memory):
+    print '%-9s %6d runs  %7.3f s  %9.1f KB total  %8.1f bytes/run' % \
+        (label,n,seconds,memory/1024.0,float(memory)/n)
+
+def main():
+    if len(sys.argv) > 1:
+        script_path = sys.argv[1]
+    else:
+        script_path = os.path.join('scripts','xortest.mnscript')
+    if len(sys.argv) > 2:
+        n = int(sys.argv[2])
+    else:
+        n = 5000
+
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    gui = BenchmarkGUI()
+    gui.script = io.cli_readScript(gui,script_path)
+    run = findRun(gui.script)
+    if not run:
+        print 'ERROR: No run found in',script_path
+        return
+    run.clearRunOverrides()
+    params = getParameters(run)
+    print 'Script:',script_path
+    print 'Parameters per run:',len(params)
+    print 'Bytes per parameter object:',sys.getsizeof(params[0])
+    print
+
+    # variants first: if only the high-water mark is available, the cheap case
+    # has to be measured before the expensive one
+    base = run.getCopy()
+    start_mem = currentMemory()
+    tic = time.time()
+    variants = []
+    for i in range(n):
+        variant = data_structures.MikenetRunVariant(base,'sweep_'+str(i+1))
+        variant.overrideParameter('Random seed',i,'ALL')
+        variants.append(variant)
+    report('variants',n,time.time()-tic,currentMemory()-start_mem)
+    del variants
+
+    start_mem = currentMemory()
+    tic = time.time()
+    copies = [run.getCopy() for i in range(n)]
+    report('copies',n,time.time()-tic,currentMemory()-start_mem)
+    print
+    print 'Shared parameter specs:',len(data_structures.parameter_specs)
+    del copies
+
+if __name__ == '__main__':
+    main()
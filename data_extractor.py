@@ -3,8 +3,30 @@ import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 import getpass
+import itertools
+import json
 import sys
 import os
+from lib import db_utils,query_planner,result_cache
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# rows fetched from the database at a time
+FETCH_CHUNK = 65536
+# field type (as printed by getFields) -> (numpy dtype,conversion)
+COLUMN_TYPES = {"<type 'int'>": (np.int32,int),
+                "<type 'float'>": (np.float64,float),
+                "<type 'unicode'>": (np.object,str)}
+# plot types a query spec can ask for (see plotOutput)
+PLOT_TYPES = {'scatter': 0,'line': 1}
+# operators recognized in constraints
+OPERATORS = ['<>','!=','>=','<=','=','>','<','between','like','in']
+# numbers the connections opened by extractFrom
+connection_ids = itertools.count()
+# where the command line keeps extracted columns (see result_cache)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'extract_cache')
 
 def queryVariables():
     while True:
@@ -65,69 +87,279 @@ def getRecordCount(db,table):
     else:
         return '0'
 
-def buildQueryString(varDict,usrVars,usrConst,lhs,rhs):
-    # find all the tables that will need to be joined
-    tables = []
-    for x in usrVars:
-        tnames = varDict[x][1]
-        for t in tnames:
-            tables.append(t)
-    for x in lhs:
-        tnames = varDict[x][1]
-        for t in tnames:
-            tables.append(t)
-    for x in rhs:
-        if x in varDict:
-            tnames = varDict[x][1]
-            for t in tnames:
-                tables.append(t)
-                
-    tables = list(set(tables))
-    queryString = 'select ' +\
-                  ','.join(usrVars) +\
-                  ' from ' +\
-                  ' natural join '.join(tables)
-    
-    if usrConst:
-        queryString += ' where '
-        queryString += usrConst
-        
-    queryString += ' order by '
-    queryString += usrVars[0]
-        
-    queryString += ';'
-    
-    return queryString
-                  
+def getVariables(db):
+    # maps each variable (column) name to [type,tables that have it]
+    varDict = {}
+    for table in [str(x) for x in db.tables()]:
+        if table in db_utils.INTERNAL_TABLES:
+            continue
+        for fname,ftype in getFields(db,table):
+            if fname not in varDict:
+                varDict[fname] = ['',[]]
+            varDict[fname][0] = ftype
+            varDict[fname][1].append(table)
+    return varDict
 
-def getColumns(db,varDict,usrVars,queryString):
-    columns = []
+def parseConstraints(usrConst):
+    # returns the left and right hand sides of every comparison in usrConst
+    lhs = []
+    rhs = []
+    if not usrConst:
+        return lhs,rhs
+    # remove logicals and parens
+    const = usrConst
+    const = const.replace(' and ','@').replace(' AND ','@')
+    const = const.replace(' or ','@').replace(' OR ','@')
+    const = const.replace('(','@')
+    const = const.replace(')','@')
+    const = const.split('@')
+    const = [x.replace(' ','') for x in const if len(x)>0 and x != ' ']
+    # find references to variables
+    for x in const:
+        for op in OPERATORS:
+            if op in x:
+                l,r = x.split(op,1)
+                lhs.append(l)
+                rhs.append(r)
+                break
+    return lhs,rhs
+
+def buildQueryString(varDict,usrVars,usrConst,escape=None):
+    # see query_planner for which tables are joined, and how
+    return query_planner.planQuery(varDict,usrVars,usrConst).getQueryString(escape)
+
+def getColumnTypes(varDict,usrVars):
+    # (numpy dtype,conversion) for each requested variable. the conversion is
+    # only used on values numpy cannot take as they are
+    types = []
     for v in usrVars:
-        # make an empty list in 'columns' that will become this variable's numpy array
-        columns.append([])
+        column = query_planner.splitName(v)[1]
+        types.append(COLUMN_TYPES.get(varDict[column][0],(np.object,None)))
+    return types
+
+class ColumnBuffers():
+    # one preallocated numpy array per column. rows are copied in a chunk at
+    # a time, and the arrays double in size whenever they fill up
+    def __init__(self,types):
+        self.types = types
+        self.size = 0
+        self.columns = [np.empty(FETCH_CHUNK,dtype=dtype) for dtype,convert in types]
+        # a chunk of rows is turned into a record array with one field per column
+        self.record_type = np.dtype([('c'+str(i),dtype) for i,(dtype,convert) in enumerate(types)])
+
+    def reserve(self,n):
+        if not self.columns:
+            return
+        capacity = len(self.columns[0])
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for i,c in enumerate(self.columns):
+            grown = np.empty(capacity,dtype=c.dtype)
+            grown[:self.size] = c[:self.size]
+            self.columns[i] = grown
+
+    def addChunk(self,rows):
+        # rows is a list of tuples, one value per column
+        if not rows:
+            return
+        n = len(rows)
+        self.reserve(n)
+        try:
+            chunk = np.array(rows,dtype=self.record_type)
+            values = []
+            for (dtype,convert),name in zip(self.types,self.record_type.names):
+                if dtype is np.object and convert:
+                    values.append([convert(x) for x in chunk[name]])
+                else:
+                    values.append(chunk[name])
+        except (ValueError,TypeError):
+            # numpy would not take some value as it is, so convert them all
+            values = [[convert(x) for x in column] if convert else column
+                      for (dtype,convert),column in zip(self.types,zip(*rows))]
+        for i,v in enumerate(values):
+            self.columns[i][self.size:self.size+n] = v
+        self.size += n
+
+    def getColumns(self):
+        return [c[:self.size].copy() for c in self.columns]
+
+def getColumns(db,varDict,usrVars,queryString):
+    # raises IOError if the query fails, rather than hand back the rows read
+    # before it did
+    types = getColumnTypes(varDict,usrVars)
+    buffers = ColumnBuffers(types)
+    # sqlite databases are read straight through the sqlite3 module, which
+    # hands back whole chunks of rows at once
+    if sqlite3 and db.driverName() == 'QSQLITE' and os.path.isfile(db.databaseName()):
+        con = sqlite3.connect(db.databaseName())
+        try:
+            cur = con.cursor()
+            cur.execute(queryString)
+            while True:
+                rows = cur.fetchmany(FETCH_CHUNK)
+                if not rows:
+                    break
+                buffers.addChunk(rows)
+        except sqlite3.Error as e:
+            raise IOError('query failed: '+str(e))
+        finally:
+            con.close()
+        return buffers.getColumns()
 
     q = QtSql.QSqlQuery(db)
     q.setForwardOnly(True)
-    q.exec_(queryString)
+    if not q.exec_(queryString):
+        raise IOError('query failed: '+str(q.lastError().text()))
+    indices = range(len(usrVars))
+    rows = []
     while q.next():
-        for i,v in enumerate(usrVars):
-            if varDict[v][0] == "<type 'int'>":
-                columns[i].append(int(q.value(i)))
-            elif varDict[v][0] == "<type 'float'>":
-                columns[i].append(float(q.value(i)))
-            elif varDict[v][0] == "<type 'unicode'>":
-                columns[i].append(str(q.value(i)))
-                
-    # convert columns to numpy arrays, paying attention to type
-    for i,v in enumerate(usrVars):
-        if varDict[v][0] == "<type 'int'>":
-            columns[i] = np.array(columns[i],dtype=np.int32)
-        elif varDict[v][0] == "<type 'float'>":
-            columns[i] = np.array(columns[i],dtype=np.float64)
-        elif varDict[v][0] == "<type 'unicode'>":
-            columns[i] = np.array(columns[i],dtype=np.object)
-        
-    return columns
+        rows.append(tuple([q.value(i) for i in indices]))
+        if len(rows) == FETCH_CHUNK:
+            buffers.addChunk(rows)
+            rows = []
+    # next() also returns False when fetching a row fails
+    if q.lastError().isValid():
+        raise IOError('query failed: '+str(q.lastError().text()))
+    buffers.addChunk(rows)
+    return buffers.getColumns()
+
+def splitVariables(variables):
+    # a list of variable names, or a comma separated string of them. spaces
+    # are ignored
+    if isinstance(variables,basestring):
+        variables = variables.split(',')
+    variables = [str(x).replace(' ','') for x in variables]
+    return [x for x in variables if x]
+
+def getGeneration(db,tables):
+    # a marker that changes whenever runs are pushed to the database: the
+    # largest run id in each of tables, and its row count. on sqlite the
+    # largest rowid stands in for the count, which would read the whole table
+    if db.driverName() in ['QSQLITE','QSQLITE2']:
+        count = 'max(rowid)'
+    else:
+        count = 'count(*)'
+    q = QtSql.QSqlQuery(db)
+    marker = []
+    for t in sorted(tables):
+        # asked separately, so each can be answered from an index
+        for column in ['max(run_id)',count]:
+            q.exec_(str('select ' + column + ' from ' + t))
+            if q.next():
+                marker.append(q.value(0))
+            else:
+                marker.append(None)
+    return marker
+
+def getCacheKey(db,varDict,variables,tables,queryString):
+    # identifies the results of queryString on db as it is now
+    name = str(db.databaseName())
+    if db.driverName() in ['QSQLITE','QSQLITE2']:
+        name = os.path.abspath(name)
+    types = [varDict[query_planner.splitName(v)[1]][0] for v in variables]
+    return result_cache.makeKey(str(db.driverName()),str(db.hostName()),name,
+                                queryString,types,getGeneration(db,tables))
+
+def extract(db,variables,constraints=None,records=False,varDict=None,explain=False,cache=None):
+    # the library entry point: returns one numpy array per variable, in the
+    # order asked for, of the rows matching constraints (an sql condition,
+    # e.g. 'epsilon <= 0.5 and run_name = "xor"'). with records=True a numpy
+    # record array with one field per variable is returned instead. pass the
+    # varDict from getVariables when making several extractions from db.
+    # variables can be given as table.column. with explain=True the query
+    # plan is printed first. with a result_cache.ResultCache as cache, results
+    # are kept there, and read back until new runs are pushed to db. raises
+    # ValueError for a request db cannot answer, and IOError if the query fails
+    variables = splitVariables(variables)
+    if not variables:
+        raise ValueError('no variables to extract')
+    if varDict is None:
+        varDict = getVariables(db)
+    lhs,rhs = parseConstraints(constraints)
+    mistypes = query_planner.findUnknown(varDict,variables+lhs)
+    if mistypes:
+        raise ValueError(','.join(mistypes) + ' not found in database')
+    plan = query_planner.planQuery(varDict,variables,constraints)
+    escape = lambda x: db_utils.escapeField(db,x)
+    if explain:
+        print plan.explain(escape)
+    queryString = plan.getQueryString(escape)
+    cols = None
+    key = None
+    # columns of types numpy does not know are not cached
+    if cache and None not in [convert for dtype,convert in getColumnTypes(varDict,variables)]:
+        key = getCacheKey(db,varDict,variables,plan.tables,queryString)
+        cols = cache.get(key)
+    if cols is None:
+        # getColumns raises if the query fails (see getColumns), so a failed
+        # or cut short fetch never reaches the cache
+        cols = getColumns(db,varDict,variables,queryString)
+        if key:
+            cache.put(key,cols)
+    if records:
+        return np.rec.fromarrays(cols,names=variables)
+    return cols
+
+def extractFrom(database,variables,constraints=None,records=False,
+                driver='QSQLITE',host='localhost',user='',pw='',cache=None):
+    # extract from a database by name, over a connection of its own. several
+    # databases can be read at once this way, one thread each
+    name = 'extract_'+str(next(connection_ids))
+    db = connectToDB(driver,host,database,user,pw,name)
+    if not db:
+        QtSql.QSqlDatabase.removeDatabase(name)
+        raise IOError('could not connect to database '+str(database))
+    try:
+        return extract(db,variables,constraints,records,cache=cache)
+    finally:
+        db.close()
+        del db
+        QtSql.QSqlDatabase.removeDatabase(name)
+
+def readSpecFile(path):
+    # a query spec file is json: one query, or a list of them. each query is
+    # {"variables": ["trial","error"],                 (required)
+    #  "constraints": "run_name = \"xor\"",            (optional)
+    #  "output": "xor.txt",                            (optional, tab-delimited)
+    #  "plot": "line",                                 (optional, or "scatter")
+    #  "explain": true}                                (optional)
+    with open(path,'r') as f:
+        specs = json.load(f)
+    if isinstance(specs,dict):
+        specs = [specs]
+    if not isinstance(specs,list):
+        raise ValueError('expected a query or a list of queries')
+    for i,spec in enumerate(specs):
+        if not isinstance(spec,dict) or not spec.get('variables'):
+            raise ValueError('query '+str(i+1)+' has no variables')
+        if spec.get('plot') not in [None]+PLOT_TYPES.keys():
+            raise ValueError('query '+str(i+1)+' has unknown plot type '+str(spec['plot']))
+    return specs
+
+def runSpecFile(db,path,explain=False,cache=None):
+    try:
+        specs = readSpecFile(path)
+    except (IOError,ValueError) as e:
+        print 'Error, could not read query spec '+path+':',e
+        sys.exit(0)
+    # variables are looked up once for all the queries
+    varDict = getVariables(db)
+    for i,spec in enumerate(specs):
+        variables = splitVariables(spec['variables'])
+        constraints = spec.get('constraints')
+        try:
+            cols = extract(db,variables,str(constraints) if constraints else None,
+                           varDict=varDict,explain=explain or spec.get('explain'),cache=cache)
+        except (ValueError,IOError) as e:
+            print 'Error in query '+str(i+1)+':',e
+            continue
+        if spec.get('output'):
+            writeOutput(cols,str(spec['output']))
+            print 'query '+str(i+1)+':',len(cols[0]),'rows written to',spec['output']
+        if spec.get('plot'):
+            plotOutput(PLOT_TYPES[spec['plot']],cols,variables)
 
 def writeOutput(cols,outfile):
     with open(outfile,'w') as f:
@@ -200,8 +432,11 @@ def plotOutput(mode,cols,headers):
             sys.exit(0)
     plt.show()
 
-def connectToDB(driver,host,name,user,pw):
-    db = QtSql.QSqlDatabase.addDatabase(driver)
+def connectToDB(driver,host,name,user,pw,connection=None):
+    if connection:
+        db = QtSql.QSqlDatabase.addDatabase(driver,connection)
+    else:
+        db = QtSql.QSqlDatabase.addDatabase(driver)
     db.setHostName(host)
     db.setDatabaseName(name)
     db.setUserName(user)
@@ -210,6 +445,8 @@ def connectToDB(driver,host,name,user,pw):
     if not ok:
         return None
     else:
+        # databases written before the schema had indexes get them now
+        db_utils.createIndexes(db)
         return db
         
 def run(args):
@@ -224,6 +461,12 @@ def run(args):
     if not db:
         print 'Error, could not connect to database.'
         sys.exit(0)
+    cache = None
+    if not args.nocache:
+        cache = result_cache.ResultCache(args.cache,int(args.cache_size*1024*1024))
+    if args.spec:
+        runSpecFile(db,args.spec,args.explain,cache)
+        return
     print '''
 ---------------------------------------------------------------------------
                                                      
@@ -250,29 +493,20 @@ Press Ctrl+C to exit at any time.
     print ''
     gap = ' '*4
     tables = [str(x) for x in db.tables()]
-    varDict = {}
     for table in tables:
         print gap,'Name:',table
         print gap,'Records:',getRecordCount(db,table)
         print gap,'Variables:'
-        fields = getFields(db,table)
-        for fname,ftype in fields:
+        for fname,ftype in getFields(db,table):
             print 2*gap + fname + gap + ftype
-            if fname not in varDict:
-                varDict[fname] = ['',[]]
-            varDict[fname][0] = ftype
-            varDict[fname][1].append(table)
-
         print ''
-    # manually override tables for id and run_id to just metadata
-    varDict['id'] = [varDict['id'][0],['metadata']]
-    varDict['run_id'] = [varDict['run_id'][0],['metadata']]
+    varDict = getVariables(db)
     
     # query variables
     while True:
         usrVars = queryVariables().split(',')
         usrVars = [x.replace(' ','') for x in usrVars]
-        mistypes = [x for x in usrVars if x not in varDict]
+        mistypes = query_planner.findUnknown(varDict,usrVars)
         if not mistypes:
             print ''
             break
@@ -282,36 +516,16 @@ Press Ctrl+C to exit at any time.
             print ''
 
     # query constraints
-    lhs = []
-    rhs = []
     while True:
-        lhs = []
-        rhs = []
         usrConst = queryConstraints()
         if usrConst == '':
             usrConst = None
             print ''
             break
 
-        ops = ['<>','!=','>=','<=','=','>','<','between','like','in']
-        # remove logicals and parens
-        const = usrConst
-        const = const.replace(' and ','@')
-        const = const.replace(' or ','@')
-        const = const.replace('(','@')
-        const = const.replace(')','@')
-        const = const.split('@')
-        const = [x.replace(' ','') for x in const if len(x)>0 and x != ' ']
         # find references to variables and check that they exist
-        for x in const:
-            for op in ops:
-                if op in x:
-                    l,r = x.split(op)
-                    lhs.append(l)
-                    rhs.append(r)
-                    break
-                      
-        mistypes = [x for x in lhs if x not in varDict]
+        lhs,rhs = parseConstraints(usrConst)
+        mistypes = query_planner.findUnknown(varDict,lhs)
         if not mistypes:
             print ''
             break
@@ -363,8 +577,11 @@ Press Ctrl+C to exit at any time.
             
     # finally, build/execute query
     print 'fetching data...'
-    queryString = buildQueryString(varDict,usrVars,usrConst,lhs,rhs)
-    cols = getColumns(db,varDict,usrVars,queryString)
+    try:
+        cols = extract(db,usrVars,usrConst,varDict=varDict,explain=args.explain,cache=cache)
+    except IOError as e:
+        print 'Error fetching data:',e
+        sys.exit(0)
     if mode in [0,2]:
         print 'writing output...'
         writeOutput(cols,outfile)
@@ -386,6 +603,13 @@ def main():
                         default='QSQLITE')
     parser.add_argument('-host',help='database host',default='localhost')
     parser.add_argument('-user',help='database username',default='')
+    parser.add_argument('-spec',help='json file of queries to run instead of asking for one '+
+                        '(see readSpecFile)',default=None)
+    parser.add_argument('-explain',help='print the query plan before fetching',action='store_true')
+    parser.add_argument('-cache',help='directory to keep extracted columns in',default=CACHE_DIR)
+    parser.add_argument('-cache_size',help='most megabytes to keep in the cache',type=float,
+                        default=result_cache.DEFAULT_MAX_BYTES/(1024*1024))
+    parser.add_argument('-nocache',help='always read from the database',action='store_true')
     args = parser.parse_args()
     run(args)
 
@@ -93,20 +93,78 @@ class MikenetDataObject(object):
         return self.gui
         
 
-class MikenetParameter():
+class ParameterSpec(object):
+    '''The fixed part of a MikenetParameter: everything except its value.
+
+    Specs are shared. Every parameter built with the same settings points at the
+    same spec (see getParameterSpec), so a parameter only stores its value and a
+    couple of references. Treat a spec as read-only; assigning to one of these
+    fields through a MikenetParameter swaps in a different spec instead.
+    '''
+    __slots__ = ('variable_name','widget_type','form_name','override_flag',
+                 'password_flag','comment','minimum','maximum','step','decimals',
+                 'category','dropdown_options','extension')
+
+    def __init__(self,**fields):
+        for field in ParameterSpec.__slots__:
+            setattr(self,field,fields[field])
+
+    def getFields(self):
+        return dict([(field,getattr(self,field)) for field in ParameterSpec.__slots__])
+
+    def replace(self,**changes):
+        fields = self.getFields()
+        fields.update(changes)
+        return getParameterSpec(**fields)
+
+# all specs handed out so far, keyed by their fields
+parameter_specs = {}
+
+def getParameterSpec(**fields):
+    '''Returns the shared spec with these fields, creating it if needed.'''
+    key = []
+    for field in ParameterSpec.__slots__:
+        if type(fields[field]) == list:
+            key.append(tuple(fields[field]))
+        else:
+            key.append(fields[field])
+    try:
+        key = tuple(key)
+        spec = parameter_specs.get(key)
+    except TypeError:
+        # unhashable field, this one can't be shared
+        return ParameterSpec(**fields)
+    if spec is None:
+        spec = parameter_specs.setdefault(key,ParameterSpec(**fields))
+    return spec
+
+def specField(field):
+    # a MikenetParameter attribute that lives in the parameter's spec
+    def getField(self):
+        return getattr(self.spec,field)
+    def setField(self,value):
+        self.spec = self.spec.replace(**{field: value})
+    return property(getField,setField)
+
+class MikenetParameter(object):
     '''Doc here'''
+    # parameters are created for every phase item of every run, so they are kept
+    # small: only the value is stored here, the rest is in a shared ParameterSpec
+    __slots__ = ('gui','spec','value','recovery_value','foreign_label')
+
     def __init__(self,gui,**kargs):
         # REQUIRED
         self.gui = gui
+        fields = {}
         # variable name is exactly as Mikenet will expect it
-        self.variable_name = kargs['variable_name']
+        fields['variable_name'] = kargs['variable_name']
         
         # widget types: int_spinbox, dbl_spinbox, text_field,
         #               checkbox, dropdown, path
-        self.widget_type = kargs['widget_type']
+        fields['widget_type'] = kargs['widget_type']
 
         if 'value' in kargs:
-            if self.widget_type == 'text_field':
+            if fields['widget_type'] == 'text_field':
                 # for text, need to cast as string
                 self.value = str(kargs['value'])
             else:
@@ -119,60 +177,61 @@ class MikenetParameter():
         self.recovery_value = self.value
 
         if 'override_flag' in kargs:
-            self.override_flag = kargs['override_flag']
+            fields['override_flag'] = kargs['override_flag']
         else:
-            self.override_flag = 0
+            fields['override_flag'] = 0
 
         if 'password_flag' in kargs:
-            self.password_flag = kargs['password_flag']
+            fields['password_flag'] = kargs['password_flag']
         else:
-            self.password_flag = 0
+            fields['password_flag'] = 0
 
         # OPTIONAL
         # form name: if you want to display name differently in the GUI
         if 'form_name' in kargs:
-            self.form_name = kargs['form_name']
+            fields['form_name'] = kargs['form_name']
         else:
-            self.form_name = self.variable_name
+            fields['form_name'] = fields['variable_name']
         # comment: adds a comment to the form on the next row
         if 'comment' in kargs:
-            self.comment = kargs['comment']
+            fields['comment'] = kargs['comment']
         else:
-            self.comment = None
+            fields['comment'] = None
         # range, decimals, and step are optional for spinbox types
         if 'range' in kargs:
-            self.minimum = kargs['range'][0]
-            self.maximum = kargs['range'][1]
+            fields['minimum'] = kargs['range'][0]
+            fields['maximum'] = kargs['range'][1]
         else:
-            self.minimum = self.maximum = None
+            fields['minimum'] = fields['maximum'] = None
         if 'step' in kargs:
-            self.step = kargs['step']
+            fields['step'] = kargs['step']
         else:
-            self.step = None
+            fields['step'] = None
         if 'decimals' in kargs:
-            self.decimals = kargs['decimals']
+            fields['decimals'] = kargs['decimals']
         else:
-            self.decimals = None
+            fields['decimals'] = None
         # categories are 'General','Timing','Output','Noise'
         if 'category' in kargs:
-            self.category = kargs['category']
+            fields['category'] = kargs['category']
         else:
-            self.category = None
+            fields['category'] = None
         # dropdown_options: a list of option strings
         if 'dropdown_options' in kargs:
-            self.dropdown_options = kargs['dropdown_options']
+            fields['dropdown_options'] = kargs['dropdown_options']
         else:
-            self.dropdown_options = None
+            fields['dropdown_options'] = None
         # path object might have a label in another widget to update
         self.foreign_label = None # can be set later
         # path object needs to know an extension to look for
-        if self.widget_type == 'path':
+        if fields['widget_type'] == 'path':
             if 'extension' in kargs:
-                self.extension = kargs['extension']
+                fields['extension'] = kargs['extension']
             else:
-                self.extension = '*.*' # default is all files
+                fields['extension'] = '*.*' # default is all files
         else:
-            self.extension = None
+            fields['extension'] = None
+        self.spec = getParameterSpec(**fields)
 
     def getWidget(self):
         '''Returns a widget that is connected to this parameter'''
@@ -263,35 +322,21 @@ class MikenetParameter():
         self.foreign_label = qlabel
         
     def getCopy(self):
-        '''Constructs a duplicate of this parameter.'''
-        pDict = {'variable_name': self.variable_name,
-                 'widget_type': self.widget_type,
-                 'form_name': self.form_name}
-        if self.override_flag == 1:
-            pDict['override_flag'] = 1
-        if self.password_flag == 1:
-            pDict['password_flag'] = 1
-        if self.comment:
-            pDict['comment'] = self.comment
-        if self.minimum:
-            pDict['range'] = [self.minimum,self.maximum]
-        if self.category:
-            pDict['category'] = self.category
-        if self.decimals:
-            pDict['decimals'] = self.decimals
-        if self.step:
-            pDict['step'] = self.step
-        if self.dropdown_options:
-            # use deepcopy when copying compound objects like lists
-            pDict['dropdown_options'] = deepcopy(self.dropdown_options)
-        if self.extension:
-            pDict['extension'] = self.extension
-        
-        # finally, write value last, because properties above need to be set first
-        # (for spinboxs especially)
-        pDict['value'] = self.value
-            
-        return MikenetParameter(self.gui,**pDict)
+        '''Constructs a duplicate of this parameter.
+
+        The copy shares this parameter's spec, only the value is copied.
+        '''
+        p_copy = MikenetParameter.__new__(MikenetParameter)
+        p_copy.gui = self.gui
+        p_copy.spec = self.spec
+        p_copy.value = self.value
+        p_copy.recovery_value = self.value
+        p_copy.foreign_label = None
+        return p_copy
+
+# the spec fields read (and write) like plain attributes of the parameter
+for _field in ParameterSpec.__slots__:
+    setattr(MikenetParameter,_field,specField(_field))
         
             
 class MikenetPhaseItem(MikenetDataObject):
@@ -439,10 +484,14 @@ class MikenetPhaseItem(MikenetDataObject):
                 slices.append(group_slice_data)
         return slices
         
-    def getPrintableParameters(self,prefix,suffix):
-        # set decimal precision
-        decimal.getcontext().prec = 4
-        lines = []
+    def getParameterValues(self,run=None):
+        # returns (parameter,value) pairs for the profile parameters, with manual
+        # and iterator overrides already resolved. iterator overrides are read from
+        # run, which defaults to the run this item belongs to (pass a
+        # MikenetRunVariant to read through its overrides instead)
+        if run is None:
+            run = self.parent.parent
+        values = []
         # get the profile
         profile = self.gui.getScript().getProfileByName(self.my_profile)
         for p in profile.getAllParameters():
@@ -455,19 +504,28 @@ class MikenetPhaseItem(MikenetDataObject):
                 val = p.value
             # also check for automatic overrides created by an iterator
             # these will take precedence over overrides at the phase-item level
-            if p.form_name in self.parent.parent.getRunOverrides():
+            if p.form_name in run.getRunOverrides():
                 # make sure the parameter is overriden on THIS event
-                aps = self.parent.parent.override_paths[p.form_name]
+                aps = run.override_paths[p.form_name]
                 if aps == 'ALL':
-                	val = self.parent.parent.getRunOverrides()[p.form_name]
+                	val = run.getRunOverrides()[p.form_name]
                 	print 'overriding',p.form_name,val
                 else:
                     aps = [x for x in aps if (x.split(':')[0] == self.parent.getValueOf('phase_name'))\
                            and (x.split(':')[1] == self.getValueOf('item_name'))]
                     if aps:
-                        val = self.parent.parent.getRunOverrides()[p.form_name]
+                        val = run.getRunOverrides()[p.form_name]
                         print 'overriding',p.form_name,val
-                
+            values.append((p,val))
+        return values
+
+    def getPrintableParameters(self,prefix,suffix,run=None,example_sets=None):
+        # example_sets maps example paths to the build_model.c variables they are
+        # loaded into (see run_compiler.getExampleSets)
+        # set decimal precision
+        decimal.getcontext().prec = 4
+        lines = []
+        for p,val in self.getParameterValues(run):
             if p.variable_name == 'profile_name':
                 pass # skip this one
                 
@@ -476,8 +534,12 @@ class MikenetPhaseItem(MikenetDataObject):
                 if self.mode == 'TRAIN':
                     if suffix == ';\n':
                         # writing to build_model.c
-                        lines.append(prefix + 'train_examples=load_examples("' 
-                                     + str(val) + '",TIME)' + suffix)
+                        if example_sets and str(val) in example_sets:
+                            lines.append(prefix + 'train_examples=' +
+                                         example_sets[str(val)] + suffix)
+                        else:
+                            lines.append(prefix + 'train_examples=load_examples("' 
+                                         + str(val) + '",TIME)' + suffix)
                     else:
                         # writing to metadata
                         h,t = os.path.split(val)
@@ -1048,6 +1110,58 @@ class MikenetRun(MikenetDataObject):
         
         return display_lines
 
+class MikenetRunVariant(object):
+    '''One iteration of a run, as seen by the code generator.
+
+    Instead of copying the whole run (groups, matrix, phases, phase items and all of
+    their parameters) for every combination an iterator produces, a variant only
+    holds its own name and the values it overrides, and reads everything else
+    straight from the base run. The base run must not change while variants of it
+    are in use, so iterators pass in one private copy that all their variants share.
+
+    Phases and phase items still belong to the base run, so anything that resolves
+    overrides for them has to be handed the variant explicitly (see
+    MikenetPhaseItem.getParameterValues).
+    '''
+    def __init__(self,base,run_name):
+        self.base = base
+        self.gui = base.getGUI()
+        self.run_name = run_name
+        self.run_overrides = {}
+        self.override_paths = {}
+
+    def getValueOf(self,p):
+        if p == 'run_name':
+            return self.run_name
+        return self.base.getValueOf(p)
+
+    def getGUI(self):
+        return self.gui
+
+    def getClassName(self):
+        return self.base.getClassName()
+
+    def getChildren(self):
+        return self.base.getChildren()
+
+    def getGroups(self):
+        return self.base.getGroups()
+
+    def getMatrix(self):
+        return self.base.getMatrix()
+
+    def overrideParameter(self,param_name,v,applied_paths):
+        self.run_overrides[param_name] = v
+        self.override_paths[param_name] = applied_paths
+
+    def clearRunOverrides(self):
+        self.run_overrides = {}
+        self.override_paths = {}
+
+    def getRunOverrides(self):
+        return self.run_overrides
+
+            
 class MikenetIterator(MikenetDataObject):
     '''Doc here'''
     def __init__(self,gui,parent):
@@ -19,8 +19,32 @@ along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
 from PySide import QtSql
 import glob
 import os
+import threading
+import itertools
+import Queue
+import traceback
 import gen_utils as guts
 
+# indexes for the joins and filters data_extractor runs (see createIndexes).
+# table -> list of indexed column lists
+INDEXES = {'metadata': [['run_id','id'],['run_name'],['phase_item']],
+           'groupdata': [['run_id','id']],
+           'errordata': [['run_id','id','trial']],
+           'noisedata': [['run_id','id']]}
+# every per test table (anything else with run_id and run_trial) gets this one
+TEST_INDEX = ['run_id','run_trial']
+
+# the keys the tables join on (see query_planner). metadata has a row per
+# phase item (id), which groupdata, errordata and noisedata rows point back
+# to. per test tables only know the run and the run trial
+PHASE_ITEM_KEY = ['run_id','id']
+TRIAL_KEY = ['run_id','run_trial']
+RUN_KEY = ['run_id']
+# tables that hold bookkeeping rather than results
+INTERNAL_TABLES = ['id_sequences']
+# numbers the connections opened by RunIngesters
+ingester_ids = itertools.count()
+
 def decodeDriver(gui):
     driver_string = 'QSQLITE'
     if not gui:
@@ -58,8 +82,33 @@ def connectToDB(gui,driver,cname):
     if not ok:
         return None
     else:
+        createIndexes(db)
         return db
 
+def createIndexes(db):
+    # add any missing INDEXES to the tables that exist. older databases get
+    # them the first time they are connected to; new tables when they are made
+    for table in [str(x) for x in db.tables()]:
+        record = db.record(table)
+        fields = [str(record.fieldName(i)) for i in range(record.count())]
+        if table in INDEXES:
+            column_lists = INDEXES[table]
+        elif 'run_id' in fields and 'run_trial' in fields:
+            column_lists = [TEST_INDEX]
+        else:
+            continue
+        for columns in column_lists:
+            if [x for x in columns if x not in fields]:
+                continue
+            name = 'idx_' + table + '_' + '_'.join(columns)
+            if db.driverName() in ['QSQLITE','QSQLITE2']:
+                statement = 'create index if not exists '
+            else:
+                # fails harmlessly if the index is already there
+                statement = 'create index '
+            q = QtSql.QSqlQuery(db)
+            q.exec_(str(statement + name + ' on ' + table + '(' + ','.join(columns) + ');'))
+
 def testDB(driver):
     db = QtSql.QSqlDatabase.addDatabase(driver)
     db.setDatabaseName('testdb.db')
@@ -83,15 +132,36 @@ def pushRunData(path,gui):
     if not db:
         # return path if there was a problem so it can be reported
         return path
-    
+
+    ret = importRun(path,db,driver)
+    # close the connection and remove it, so connections don't pile up
+    name = db.connectionName()
+    db.close()
+    del db
+    QtSql.QSqlDatabase.removeDatabase(name)
+    return ret
+
+def importRun(path,db,driver):
+    # push everything in the run directory path into the (open) database db.
+    # returns None, or path if there was a problem so it can be reported
     ###############################################################
     # create tables (if a new database)
     initializeTables(path,db,driver)
     test_fields = initializeTestTables(path,db,driver)
+    createIndexes(db)
+
+    # get a unique index for this whole run, and one for each of its phase
+    # items. they are reserved up front, in one short transaction
+    run_index = reserveIds(db,'run_id',1)
+    phase_item_ids = IdBlock(db,'id',countPhaseItems(path))
+    if run_index is None or phase_item_ids.next_id is None:
+        return path
+
+    # everything below goes in as one transaction, through one prepared
+    # statement per table (see BatchInserter)
+    db.transaction()
+    inserter = BatchInserter(db)
 
-    # get a unique index for this whole run
-    run_index = getRunIndex(db)
-    
     # create a dict to map phase item names to unique indices
     phase_item_map = {}
     
@@ -117,7 +187,7 @@ def pushRunData(path,gui):
                         r = guts.smartEval(r)
                         if str(l) == 'phase_item':
                             if str(r) not in phase_item_map:
-                                assignUnusedIndex(db,str(r),phase_item_map)
+                                phase_item_map[str(r)] = phase_item_ids.take()
                             column_names.insert(0,'run_id')
                             values.insert(0,run_index)
                             column_names.insert(0,'id')
@@ -129,7 +199,7 @@ def pushRunData(path,gui):
                             column_names.append(str(l))
                             values.append(str(r))
                             
-                    pushRecord(db,'groupdata',column_names,values)
+                    inserter.add('groupdata',column_names,values)
                     
                 else:
                     # pushing metadata record
@@ -146,49 +216,37 @@ def pushRunData(path,gui):
                         if str(l) == 'phase_item':
                             # in metadata, each row needs to be unique
                             # and needs to include phase item and run names
-                            assignUnusedIndex(db,str(r),phase_item_map)
+                            phase_item_map[str(r)] = phase_item_ids.take()
                             column_names.insert(0,'run_id')
                             values.insert(0,run_index)
                             column_names.insert(0,'id')
                             values.insert(0,phase_item_map[str(r)])
                             
-                    pushRecord(db,'metadata',column_names,values)
+                    inserter.add('metadata',column_names,values)
 
 
     # same for error and noise (both are taken from the log file)
     f_list = glob.glob(os.path.join(path,'*.log'))
     for f in f_list:
         with open(f,'rU') as src:
-            srclines = src.readlines()
-            srclines = [x.replace('\n','') for x in srclines]
-            # error first
-            lines = [x for x in srclines if 'avgError:' in x]
-            for l in lines:
-                lsplit = l.split('\t')
-                # make sure the id is unique, get a new one if necessary
-                if lsplit[1] not in phase_item_map:
-                    assignUnusedIndex(db,str(lsplit[1]),phase_item_map)
-                lsplit[0] = phase_item_map[str(lsplit[1])]
-                lsplit.insert(0,run_index)
-                # don't need phase item name in the actual record
-                lsplit.pop(2)
-                pushRecord(db,'errordata',
-                           ['run_id','id','run_trial','trial','error'],
-                           lsplit)
-            # then noise
-            lines = [x for x in srclines if 'noiseData:' in x]
-            for l in lines:
-                lsplit = l.split('\t')
+            for l in src:
+                if 'avgError:' in l:
+                    table_name = 'errordata'
+                    column_names = ['run_id','id','run_trial','trial','error']
+                elif 'noiseData:' in l:
+                    table_name = 'noisedata'
+                    column_names = ['run_id','id','noise_type','noise_object','noise_amount']
+                else:
+                    continue
+                lsplit = l.replace('\n','').split('\t')
                 # make sure the id is unique, get a new one if necessary
                 if lsplit[1] not in phase_item_map:
-                    assignUnusedIndex(db,str(lsplit[1]),phase_item_map)
+                    phase_item_map[str(lsplit[1])] = phase_item_ids.take()
                 lsplit[0] = phase_item_map[str(lsplit[1])]
                 lsplit.insert(0,run_index)
                 # don't need phase item name in the actual record
                 lsplit.pop(2)
-                pushRecord(db,'noisedata',
-                           ['run_id','id','noise_type','noise_object','noise_amount'],
-                           lsplit)
+                inserter.add(table_name,column_names,lsplit)
 
     # same for activations
     
@@ -208,37 +266,171 @@ def pushRunData(path,gui):
                 data.insert(0,str(run_index))
                 if data[-1] == '\n':
                     data = data[:-1]
-                pushRecord(db,test_name,test_fields[:len(data)],data)
-                
-            
-    db.close()
+                inserter.add(test_name,test_fields[:len(data)],data)
+
+    if not inserter.flush():
+        # a run is pushed whole or not at all
+        db.rollback()
+        return path
+    if not db.commit():
+        print 'ERROR: Could not commit records for',path+':',db.lastError().text()
+        db.rollback()
+        return path
     return None
 
-def getRunIndex(db):
-    q = QtSql.QSqlQuery(db)
-    q.exec_('select MAX(run_id) as "my max" from metadata;')
-    if q.next():
-        fieldNo = q.record().indexOf("my max");
-        if q.value(fieldNo):
-            new_val = int(q.value(fieldNo)) + 1
-        else:
-            new_val = 1
-    else:
-        new_val = 1
-    return new_val
-    
-def assignUnusedIndex(db,phase_item_name,phase_item_map):
+class RunIngester(object):
+    '''Pushes finished run directories into the database, one at a time, on a
+    single thread with a single connection.
+
+    Training workers submit their run directory and move on, instead of each
+    opening a connection of their own and waiting for the database (with SQLite,
+    waiting for the file lock other workers hold). done(path), if given, is called
+    once a run has been pushed, whether or not that worked.
+    '''
+    def __init__(self,gui):
+        self.gui = gui
+        self.pending = Queue.Queue()
+        self.failed = []
+        # several scripts can run (and push runs) at once, each with an
+        # ingester, so each needs a connection name of its own
+        self.connection = 'ingestion_'+str(next(ingester_ids))
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self,path,done=None):
+        self.pending.put((path,done))
+
+    def shutdown(self):
+        # push whatever is queued, then close the connection.
+        # returns the paths that could not be pushed
+        self.pending.put(None)
+        self.thread.join()
+        return self.failed
+
+    def work(self):
+        # a connection can only be used on the thread that opened it
+        driver = decodeDriver(self.gui)
+        db = None
+        while True:
+            job = self.pending.get()
+            if job is None:
+                break
+            path,done = job
+            try:
+                if db is None:
+                    db = connectToDB(self.gui,driver,self.connection)
+                if db is None:
+                    print 'ERROR: Could not connect to the database.'
+                    ret = path
+                else:
+                    ret = importRun(path,db,driver)
+            except:
+                traceback.print_exc()
+                ret = path
+            if ret:
+                print 'WARNING: Could not update',os.path.basename(path),'records in database.'
+                self.failed.append(path)
+            if done:
+                try:
+                    done(path)
+                except:
+                    traceback.print_exc()
+        if db is not None:
+            db.close()
+            del db
+            QtSql.QSqlDatabase.removeDatabase(self.connection)
+
+def countPhaseItems(path):
+    # number of phase item records in a run's metadata (each gets its own id)
+    count = 0
+    for f in glob.glob(os.path.join(path,'*.metadata')):
+        with open(f,'rU') as src:
+            for line in src:
+                if 'GROUP\t' not in line and \
+                   [x for x in line.split('\t') if x.startswith('phase_item=')]:
+                    count += 1
+    return count
+
+def reserveIds(db,name,count,transaction=True):
+    # reserves count consecutive ids from the named sequence in id_sequences
+    # and returns the first one (None if that failed). the update locks the
+    # sequence row, so runs pushed at the same time never get the same ids.
+    # set transaction to False when already inside one
+    if transaction:
+        db.transaction()
     q = QtSql.QSqlQuery(db)
-    q.exec_('select MAX(id) as "my max" from metadata;')
-    if q.next():
-        fieldNo = q.record().indexOf("my max");
-        if q.value(fieldNo):
-            new_val = int(q.value(fieldNo)) + 1
-        else:
-            new_val = 1
-    else:
-        new_val = 1
-    phase_item_map[phase_item_name] = new_val
+    q.prepare('update id_sequences set next_id = next_id + ? where name = ?;')
+    q.addBindValue(count)
+    q.addBindValue(name)
+    ok = q.exec_()
+    if ok and q.numRowsAffected() < 1:
+        # first use of this sequence: seed it to start after any ids already
+        # in metadata (databases from before id_sequences existed), then
+        # reserve as above. another connection may be seeding it at the same
+        # time, so a row that is already there is left alone
+        q = QtSql.QSqlQuery(db)
+        q.exec_(str('select MAX(' + name + ') from metadata;'))
+        first = 1
+        if q.next() and q.value(0):
+            first = int(q.value(0)) + 1
+        q = QtSql.QSqlQuery(db)
+        q.prepare(getSeedQuery(db))
+        q.addBindValue(name)
+        q.addBindValue(first)
+        # with drivers that cannot skip the row, losing the race fails here,
+        # and the update below still finds the winner's row
+        q.exec_()
+        q = QtSql.QSqlQuery(db)
+        q.prepare('update id_sequences set next_id = next_id + ? where name = ?;')
+        q.addBindValue(count)
+        q.addBindValue(name)
+        ok = q.exec_() and q.numRowsAffected() > 0
+    if ok:
+        q = QtSql.QSqlQuery(db)
+        q.prepare('select next_id from id_sequences where name = ?;')
+        q.addBindValue(name)
+        ok = q.exec_() and q.next()
+    if not ok:
+        print 'ERROR: Could not reserve',name,'values:',q.lastError().text()
+        if transaction:
+            db.rollback()
+        return None
+    first = int(q.value(0)) - count
+    if transaction:
+        db.commit()
+    return first
+
+def getSeedQuery(db):
+    # inserts a sequence into id_sequences unless it is already there
+    driver = db.driverName()
+    if driver in ['QSQLITE','QSQLITE2']:
+        return 'insert or ignore into id_sequences(name,next_id) values (?,?);'
+    elif driver == 'QMYSQL':
+        return 'insert ignore into id_sequences(name,next_id) values (?,?);'
+    elif driver == 'QPSQL':
+        return 'insert into id_sequences(name,next_id) values (?,?) on conflict do nothing;'
+    return 'insert into id_sequences(name,next_id) values (?,?);'
+
+class IdBlock():
+    # ids reserved with reserveIds, handed out one at a time
+    def __init__(self,db,name,count):
+        self.db = db
+        self.name = name
+        self.next_id = reserveIds(db,name,count)
+        self.end = self.next_id + count if self.next_id is not None else None
+
+    def take(self):
+        if self.next_id >= self.end:
+            # more than were reserved (a phase item that only shows up in the
+            # log). by now this happens inside the run's transaction
+            self.next_id = reserveIds(self.db,self.name,1,False)
+            if self.next_id is None:
+                return None
+            self.end = self.next_id + 1
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
 
 def initializeTables(path,db,driver):
     # map python datatypes to sql datatypes
@@ -282,12 +474,19 @@ def initializeTables(path,db,driver):
     q.exec_(str('create table if not exists groupdata(' +
                 'id ' + type_map[int] +
                 ',run_id ' + type_map[int] +
-                ',group ' + type_map[str] +
+                ',' + escapeField(db,'group') + ' ' + type_map[str] +
                 ',units ' + type_map[int] +
                 ',activation_type ' + type_map[str] +
                 ',error_computation_type ' + type_map[str] +
                 ');'))
 
+    # id_sequences (see reserveIds)
+    q = QtSql.QSqlQuery(db)
+    q.exec_(str('create table if not exists id_sequences(' +
+                'name VARCHAR(32) primary key' +
+                ',next_id ' + type_map[int] +
+                ');'))
+
     # errordata
     q = QtSql.QSqlQuery(db)
     q.exec_(str('create table if not exists errordata(' +
@@ -350,6 +549,10 @@ def initializeTestTables(path,db,driver):
     return [x for x,y in split_fields] # returns only field names
 
 
+def escapeField(db,name):
+    # quotes a column name the way the driver wants it ("group" is an sql keyword)
+    return db.driver().escapeIdentifier(name,QtSql.QSqlDriver.FieldName)
+
 def pushRecord(db,table_name,column_names,values):
     q = QtSql.QSqlQuery(db)
     column_data = ','.join(column_names)
@@ -362,6 +565,60 @@ def pushRecord(db,table_name,column_names,values):
         q.addBindValue(v)
     q.exec_()
 
+class BatchInserter():
+    # buffers rows and writes them with one prepared INSERT per table (and set
+    # of columns), binding a whole batch of rows at once with execBatch,
+    # instead of preparing and executing a new query for every row
+    BATCH_SIZE = 10000
+
+    def __init__(self,db):
+        self.db = db
+        self.queries = {}   # (table,columns) -> prepared QSqlQuery
+        self.rows = {}      # (table,columns) -> rows waiting to be written
+        self.ok = True      # False once a batch could not be written
+
+    def add(self,table_name,column_names,values):
+        if len(values) != len(column_names):
+            # pushRecord could not insert these either
+            print 'ERROR: Skipping',table_name,'record with',len(values), \
+                  'values for',len(column_names),'columns'
+            return
+        key = (str(table_name),tuple(column_names))
+        rows = self.rows.setdefault(key,[])
+        rows.append(values)
+        if len(rows) >= self.BATCH_SIZE:
+            self.flushRows(key)
+
+    def flush(self):
+        # writes what is left. returns False if any batch, this time or an
+        # earlier one, could not be written
+        for key in self.rows.keys():
+            self.flushRows(key)
+        return self.ok
+
+    def flushRows(self,key):
+        # returns False if the rows could not be written
+        rows = self.rows.pop(key,None)
+        if not rows:
+            return True
+        table_name,column_names = key
+        if key not in self.queries:
+            q = QtSql.QSqlQuery(self.db)
+            columns = [escapeField(self.db,x) for x in column_names]
+            q.prepare(str('insert into ' + table_name + '(' + ','.join(columns) +
+                          ') values (' + ','.join(['?']*len(column_names)) + ');'))
+            self.queries[key] = q
+        q = self.queries[key]
+        # one list of values per column. the query is reused for every batch,
+        # so bind by position rather than appending with addBindValue
+        for i,column in enumerate(zip(*rows)):
+            q.bindValue(i,list(column))
+        if not q.execBatch():
+            print 'ERROR: Could not insert',len(rows),table_name,'records:',q.lastError().text()
+            self.ok = False
+            return False
+        return True
+
         
 ####TEST code
 from PySide import QtCore,QtGui
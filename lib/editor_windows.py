@@ -18,6 +18,11 @@ along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
 '''
 from PySide import QtGui,QtCore
 from math import floor
+import sys,traceback
+import os
+import time
+import dialogs
+import example_io
 
 class TrainingProfileEditor(QtGui.QDialog):
     def __init__(self,profile,gui):
@@ -368,6 +373,18 @@ class PreferencesEditor(QtGui.QDialog):
         app_layout.addRow(multi_lab,multi_box)
         maxcpu_lab,self.maxcpu_box = self.gui.parameters['max_cpus'].getWidget()
         app_layout.addRow(maxcpu_lab,self.maxcpu_box)
+        self.maxcompile_box = None
+        if 'max_compiles' in self.gui.parameters:
+            maxcompile_lab,self.maxcompile_box = self.gui.parameters['max_compiles'].getWidget()
+            app_layout.addRow(maxcompile_lab,self.maxcompile_box)
+        if 'runtime_parameters' in self.gui.parameters:
+            runtime_lab,runtime_box = self.gui.parameters['runtime_parameters'].getWidget()
+            app_layout.addRow(runtime_lab,runtime_box)
+        if 'in_process_backend' in self.gui.parameters:
+            inproc_lab,inproc_box = self.gui.parameters['in_process_backend'].getWidget()
+            app_layout.addRow(inproc_lab,inproc_box)
+            if self.gui.parameters['in_process_backend'].comment:
+                app_layout.addRow('',QtGui.QLabel(self.gui.parameters['in_process_backend'].comment))
         email_lab,email_box = self.gui.parameters['email_notification'].getWidget()
         app_layout.addRow(email_lab,email_box)
         address_lab,self.address_box = self.gui.parameters['email_address'].getWidget()
@@ -411,6 +428,8 @@ class PreferencesEditor(QtGui.QDialog):
             self.maxcpu_box.setEnabled(True)
         else:
             self.maxcpu_box.setEnabled(False)
+        if self.maxcompile_box:
+            self.maxcompile_box.setEnabled(self.maxcpu_box.isEnabled())
         
         #..............................................................
         # BUTTONS
@@ -453,6 +472,8 @@ class PreferencesEditor(QtGui.QDialog):
             self.maxcpu_box.setEnabled(True)
         else:
             self.maxcpu_box.setEnabled(False)
+        if self.maxcompile_box:
+            self.maxcompile_box.setEnabled(self.maxcpu_box.isEnabled())
 
     def okAction(self):
         self.gui.savePreferences()
@@ -571,6 +592,240 @@ class DefaultsEditor(QtGui.QDialog):
         self.reject()
         
 
+class ExampleTextSummary():
+    # the example previewer's reading of an example file, fed one line at a
+    # time so the file never has to be in memory all at once
+    def __init__(self):
+        self.ex_count = 0
+        self.tag_count = 0
+        self.prob_count = 0
+        self.clamp_data = []
+        self.target_data = []
+        self.tick_min = 1
+        self.flags = []
+        self.reading_type = None
+        self.cur_data = ['    ',None,None,None,' units']
+        # set once a formatting error stops the reading
+        self.done = False
+
+    def saveGroup(self):
+        # whatever group data you were previously working on, save it
+        if self.reading_type:
+            if 'CLAMP' in self.reading_type:
+                self.clamp_data.append(tuple(self.cur_data))
+            elif 'TARGET' in self.reading_type:
+                self.target_data.append(tuple(self.cur_data))
+
+    def improper(self,spec,i):
+        self.flags.append('- Improper '+spec+' specifier at line '+str(i+1)+
+                          '. See Help for proper formatting instructions.')
+        self.done = True
+
+    def feed(self,i,line):
+        # line i (counting from 0), with its newline
+        if self.done:
+            return
+        if 'TAG' in line:
+            self.reading_type = None
+            self.tag_count += 1
+
+        elif 'PROB' in line:
+            self.reading_type = None
+            self.prob_count += 1
+
+        elif 'CLAMP' in line or 'TARGET' in line:
+            spec = 'CLAMP' if 'CLAMP' in line else 'TARGET'
+            self.saveGroup()
+            # found a group that will be clamped or compared with a target...get the name
+            line_pieces = line.split()
+            if len(line_pieces) < 4 or line_pieces[3] not in ['FULL','SPARSE']:
+                self.improper(spec,i)
+                return
+            self.cur_data[1] = '"'+line_pieces[1]+'"'
+            # find out if there is a max tick time
+            if line_pieces[2] != 'ALL':
+                digits = line_pieces[2].split('-')
+                try:
+                    self.tick_min = int(digits[-1]) + 1
+                except ValueError:
+                    self.improper(spec,i)
+                    return
+            # get unit constraints to help user with number of units
+            if line_pieces[3] == 'FULL':
+                self.reading_type = spec+' FULL'
+                self.cur_data[2] = ', exactly '
+                self.cur_data[3] = len(line_pieces) - 4
+            else:
+                self.reading_type = spec+' SPARSE'
+                self.cur_data[2] = ', at least '
+                if not self.readSparse(spec,i,line_pieces[4:]):
+                    return
+            if ';' in line:
+                self.endExample()
+
+        elif ';\n' == line:
+            self.endExample()
+
+        elif line == '\n':
+            # skip blank lines
+            pass
+
+        else:
+            line_pieces = line.split()
+            if not line_pieces:
+                return
+            if not self.reading_type:
+                self.flags.append('- Unit values outside of a CLAMP or TARGET at line '+str(i+1)+
+                                  '. See Help for proper formatting instructions.')
+                self.done = True
+                return
+            # add to unit constraints to help user with number of units
+            # note that 4th value is a count for FULL and a max value for SPARSE
+            if 'FULL' in self.reading_type:
+                self.cur_data[3] += len(line_pieces)
+            elif not self.readSparse(self.reading_type.split()[0],i,line_pieces):
+                return
+            if ';' in line:
+                self.endExample()
+
+    def readSparse(self,spec,i,values):
+        # SPARSE data gives unit indices (up to an optional ","); keep the largest
+        values = [x.rstrip(';,') for x in values]
+        try:
+            values = [int(x) for x in values if x]
+        except ValueError:
+            self.improper(spec,i)
+            return False
+        if values:
+            self.cur_data[3] = max(values) + 1
+        return True
+
+    def endExample(self):
+        # case where ; is not on its own line, too
+        self.ex_count += 1
+        self.saveGroup()
+        self.reading_type = None
+
+    def getResults(self):
+        # (examples count,tick_min,clamp group lines,target group lines,flags)
+        # catch some errors
+        if self.tag_count > 0 and self.tag_count != self.ex_count:
+            self.flags.append('- Possible TAG mismatch. Counted '+str(self.tag_count)+
+                              ' TAGs and '+str(self.ex_count)+' semicolons.')
+        if self.prob_count > 0 and self.prob_count != self.ex_count:
+            self.flags.append('- Possible PROB mismatch. Counted '+str(self.prob_count)+
+                              '  PROBs and '+str(self.ex_count)+' semicolons.')
+
+        clamp_data = list(set(self.clamp_data))
+        target_data = list(set(self.target_data))
+
+        # find group unit mismatches
+        for spec,data in [('CLAMP',clamp_data),('TARGET',target_data)]:
+            unique_names = [x[1] for x in data if 'exactly' in x[2]]
+            if len(unique_names) != len(set(unique_names)):
+                self.flags.append('- Inconsistent group unit counts using '+spec+' FULL.')
+                for x in unique_names:
+                    self.flags.append('    '+x)
+
+        # convert tuples into strings
+        clamp_data = [''.join((x[0],x[1],x[2],str(x[3]),x[4])) for x in clamp_data]
+        target_data = [''.join((x[0],x[1],x[2],str(x[3]),x[4])) for x in target_data]
+        return self.ex_count,self.tick_min,clamp_data,target_data,self.flags
+
+
+class ExampleReadingThread(QtCore.QThread):
+    # reads an example file for the ExamplePreviewer without blocking the gui.
+    # custom signals are the only way to hand results back to the main thread
+    progressed = QtCore.Signal(int)
+    summarized = QtCore.Signal(object)  # summary dict from example_io.getStats
+    parsed = QtCore.Signal(object)      # results of ExampleTextSummary
+    failed = QtCore.Signal(str,str)   # message, details
+
+    CHUNK_SIZE = 1 << 20
+    PROGRESS_STEPS = 1000
+    # at most this often (seconds), so the progress bar does not repaint per line
+    PROGRESS_INTERVAL = 0.1
+    # readers that have not finished yet. they have no parent, so closing a
+    # previewer never destroys a thread that is still compiling; this keeps
+    # them alive until they are done
+    running = set()
+
+    def __init__(self,ex_path):
+        super(ExampleReadingThread,self).__init__()
+        self.ex_path = ex_path
+        self.cancelled = False
+        ExampleReadingThread.running.add(self)
+        self.finished.connect(self.forget)
+
+    def forget(self):
+        ExampleReadingThread.running.discard(self)
+        self.deleteLater()
+
+    def cancel(self):
+        # checked between chunks; the thread finishes on its own soon after
+        self.cancelled = True
+
+    def run(self):
+        try:
+            self.read()
+        except Exception:
+            self.failed.emit('Problem reading file '+self.ex_path,traceback.format_exc())
+
+    def read(self):
+        # the stats index (see example_io) already knows all of this
+        summary = example_io.readStats(self.ex_path)
+        if summary is not None:
+            self.summarized.emit(summary)
+            return
+
+        # otherwise stream the text, giving the previewer something to show
+        # (and the reasons, if the file is badly formatted)
+        try:
+            size = os.path.getsize(self.ex_path)
+            ex_file = open(self.ex_path,'r')
+        except (IOError,OSError):
+            self.failed.emit('Problem opening file '+self.ex_path,traceback.format_exc())
+            return
+        reader = ExampleTextSummary()
+        i = 0
+        bytes_read = 0
+        last_update = time.time()
+        tail = ''
+        with ex_file:
+            while not reader.done:
+                if self.cancelled:
+                    return
+                chunk = ex_file.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                bytes_read += len(chunk)
+                lines = (tail + chunk).split('\n')
+                tail = lines.pop()
+                for line in lines:
+                    reader.feed(i,line+'\n')
+                    i += 1
+                if time.time() - last_update >= self.PROGRESS_INTERVAL:
+                    last_update = time.time()
+                    self.progressed.emit(bytes_read*self.PROGRESS_STEPS // max(size,1))
+            if tail:
+                reader.feed(i,tail)
+        if self.cancelled:
+            return
+        self.progressed.emit(self.PROGRESS_STEPS)
+        self.parsed.emit(reader.getResults())
+
+        # compile (and index) the file in the background, so that next time the
+        # preview comes straight from the stats index. if it compiles, the index
+        # is also more exact than the reading above, so show that instead
+        if self.cancelled or example_io.isCompressed(self.ex_path):
+            return
+        if example_io.ensureCompiled(self.ex_path):
+            return
+        summary = example_io.readStats(self.ex_path)
+        if summary is not None and not self.cancelled:
+            self.summarized.emit(summary)
+
+
 class ExamplePreviewer(QtGui.QWidget):
     def __init__(self,parent):
         super(ExamplePreviewer, self).__init__(parent)
@@ -578,6 +833,8 @@ class ExamplePreviewer(QtGui.QWidget):
                      QtGui.QSizePolicy.Expanding)
 
         self.flags = []
+        # background thread reading the example file currently being previewed
+        self.reader = None
 
         # layouts
         main_layout = QtGui.QVBoxLayout()
@@ -630,220 +887,83 @@ class ExamplePreviewer(QtGui.QWidget):
     def readExample(self,ex_path):
         if not ex_path:
             return
+        # stop reading whatever file was picked before
+        self.cancelReading()
         # hide everything but progress
         self.empty.hide()
         self.info.hide()
         self.progress_label.show()
+        self.progress.setMaximum(ExampleReadingThread.PROGRESS_STEPS)
         self.progress.setValue(0)
         self.progress.show()
 
-        # read the file
-        try:
-            ex_file = open(ex_path,'r')
-        except:
-            dialogs.showError(self,('Problem opening file '+ex_path),
-                              traceback.print_exc(file=sys.stdout))
-            self.empty.show()
-            self.info.hide()
-            self.progress_label.hide()
-            self.progress.hide()
+        self.reader = ExampleReadingThread(ex_path)
+        self.reader.progressed.connect(self.updateProgress)
+        self.reader.summarized.connect(self.showSummary)
+        self.reader.parsed.connect(self.showParsed)
+        self.reader.failed.connect(self.showFailure)
+        self.reader.start()
+
+    def cancelReading(self):
+        if self.reader:
+            self.reader.cancel()
+            self.reader = None
+
+    def isCurrentReader(self):
+        # signals from a reader that was cancelled may still be queued
+        return self.reader is not None and self.sender() is self.reader
+
+    def updateProgress(self,value):
+        if self.isCurrentReader():
+            self.progress.setValue(value)
+
+    def showSummary(self,summary):
+        if self.isCurrentReader():
+            self.readSummary(summary)
+
+    def showParsed(self,results):
+        if self.isCurrentReader():
+            ex_count,tick_min,clamp_data,target_data,self.flags = results
+            self.showInfo(ex_count,tick_min,clamp_data,target_data)
+
+    def showFailure(self,message,details):
+        if not self.isCurrentReader():
             return
-        
-        ex_lines = ex_file.readlines()
-        ex_file.close()
-        self.progress.setMaximum(len(ex_lines))
-        
-        ex_count = 0
-        tag_count = 0
-        prob_count = 0
-        clamp_data = []
-        target_data = []
-        tick_min = 1
-        self.flags = []
-
-        reading_type = None
-        cur_data = ['    ',None,None,None,' units']
-
-        for i,line in enumerate(ex_lines):
-            self.progress.setValue(i+1)
-            if 'TAG' in line:
-                reading_type = None
-                tag_count += 1
-
-            elif 'PROB' in line:
-                reading_type = None
-                prob_count += 1
-            
-            elif 'CLAMP' in line:
-                # whatever group data you were previously working on, save it first
-                if reading_type:
-                    if 'CLAMP' in reading_type:
-                        clamp_data.append(tuple(cur_data))
-                    elif 'TARGET' in reading_type:
-                        target_data.append(tuple(cur_data))
-
-                # found a group that will be clamped...get the name
-                line_pieces = line.split()
-                if len(line_pieces) < 4:
-                    self.flags.append('- Improper CLAMP specifier at line '+str(i+1)+
-                                 '. See Help for proper formatting instructions.')
-                    break
-                if line_pieces[3] not in ['FULL','SPARSE']:
-                    self.flags.append('- Improper CLAMP specifier at line '+str(i+1)+
-                                 '. See Help for proper formatting instructions.')
-                    break
-                cur_data[1] = '"'+line_pieces[1]+'"'
-                # find out if there is a max tick time
-                if line_pieces[2] != 'ALL':
-                    digits = line_pieces[2].split('-')
-                    try:
-                        tick_min = int(digits[-1]) + 1
-                    except:
-                        self.flags.append('- Improper CLAMP specifier at line '+str(i+1)+
-                                 '. See Help for proper formatting instructions.')
-                        break
-                # get unit constraints to help user with number of units
-                if line_pieces[3] == 'FULL':
-                    reading_type = 'CLAMP FULL'
-                    cur_data[2] = ', exactly '
-                    cur_data[3] = len(line_pieces) - 4
-                else:
-                    reading_type = 'CLAMP SPARSE'
-                    cur_data[2] = ', at least '
-                    values = line_pieces[4:]
-                    values = [int(x) for x in values]
-                    cur_data[3] = max(values) + 1
-                    
-                if ';' in line:
-                    # case where ; is not on its own line
-                    ex_count += 1
-                    # whatever group data you were previously working on, save it first
-                    if reading_type:
-                        if 'CLAMP' in reading_type:
-                            clamp_data.append(tuple(cur_data))
-                        elif 'TARGET' in reading_type:
-                            target_data.append(tuple(cur_data))
-                        reading_type = None
-                
-            elif 'TARGET' in line:
-                # whatever group data you were previously working on, save it first
-                if reading_type:
-                    if 'CLAMP' in reading_type:
-                        clamp_data.append(tuple(cur_data))
-                    elif 'TARGET' in reading_type:
-                        target_data.append(tuple(cur_data))
-
-                # found a group that will be compared with a target...get the name
-                line_pieces = line.split()
-                if len(line_pieces) < 4:
-                    self.flags.append('- Improper TARGET specifier at line '+str(i+1)+
-                                 '. See Help for proper formatting instructions.')
-                    break
-                if line_pieces[3] not in ['FULL','SPARSE']:
-                    self.flags.append('- Improper TARGET specifier at line '+str(i+1)+
-                                 '. See Help for proper formatting instructions.')
-                    break
-                cur_data[1] = '"'+line_pieces[1]+'"'
-                # find out if there is a max tick time
-                if line_pieces[2] != 'ALL':
-                    digits = line_pieces[2].split('-')
-                    try:
-                        tick_min = int(digits[-1]) + 1
-                    except:
-                        self.flags.append('- Improper TARGET specifier at line '+str(i+1)+
-                                 '. See Help for proper formatting instructions.')
-                        break
-                # get unit constraints to help user with number of units
-                if line_pieces[3] == 'FULL':
-                    reading_type = 'TARGET FULL'
-                    cur_data[2] = ', exactly '
-                    cur_data[3] = len(line_pieces) - 4
-                else:
-                    reading_type = 'TARGET SPARSE'
-                    cur_data[2] = ', at least '
-                    values = line_pieces[4:]
-                    values = [int(x) for x in values]
-                    cur_data[3] = max(values) + 1
-                    
-                if ';' in line:
-                    # case where ; is not on its own line
-                    ex_count += 1
-                    # whatever group data you were previously working on, save it first
-                    if reading_type:
-                        if 'CLAMP' in reading_type:
-                            clamp_data.append(tuple(cur_data))
-                        elif 'TARGET' in reading_type:
-                            target_data.append(tuple(cur_data))
-                        reading_type = None
-                    
-            elif ';\n' == line:
-                ex_count += 1
-                # whatever group data you were previously working on, save it first
-                if reading_type:
-                    if 'CLAMP' in reading_type:
-                        clamp_data.append(tuple(cur_data))
-                    elif 'TARGET' in reading_type:
-                        target_data.append(tuple(cur_data))
-                    reading_type = None
-
-            elif line == '\n':
-                # skip blank lines
-                pass
-
-            else:
-                line_pieces = line.split()
-                # add to unit constraints to help user with number of units
-                # note that 4th value is a count for FULL and a max value for SPARSE
-                if 'FULL' in reading_type:
-                    cur_data[3] += len(line_pieces)
-                else:
-                    values = line_pieces[:]
-                    values = [int(x) for x in values]
-                    cur_data[3] = max(values) + 1
-
-                if ';' in line:
-                    # case where ; is not on its own line
-                    ex_count += 1
-                    # whatever group data you were previously working on, save it first
-                    if reading_type:
-                        if 'CLAMP' in reading_type:
-                            clamp_data.append(tuple(cur_data))
-                        elif 'TARGET' in reading_type:
-                            target_data.append(tuple(cur_data))
-                        reading_type = None
+        self.reader = None
+        dialogs.showError(self,message,details)
+        self.empty.show()
+        self.info.hide()
+        self.progress_label.hide()
+        self.progress.hide()
 
-        # catch some errors
-        if tag_count > 0 and tag_count != ex_count:
-            self.flags.append('- Possible TAG mismatch. Counted '+str(tag_count)+
+    def readSummary(self,summary):
+        # fill in the preview from an example file's summary (see example_io.getStats)
+        self.flags = []
+        ex_count = summary['examples']
+        if summary['tags'] > 0 and summary['tags'] != ex_count:
+            self.flags.append('- Possible TAG mismatch. Counted '+str(summary['tags'])+
                               ' TAGs and '+str(ex_count)+' semicolons.')
-        if prob_count > 0 and prob_count != ex_count:
-            self.flags.append('- Possible PROB mismatch. Counted '+str(prob_count)+
+        if summary['probs'] > 0 and summary['probs'] != ex_count:
+            self.flags.append('- Possible PROB mismatch. Counted '+str(summary['probs'])+
                               '  PROBs and '+str(ex_count)+' semicolons.')
-
-        clamp_data = list(set(clamp_data))
-        target_data = list(set(target_data))
-        
-        c_exactlies = [x for x in clamp_data if 'exactly' in x[2]]
-        t_exactlies = [x for x in target_data if 'exactly' in x[2]]
-
-        # find group unit mismatches
-        unique_names = [x[1] for x in c_exactlies]
-        if len(unique_names) != len(set(unique_names)):
-            self.flags.append('- Inconsistent group unit counts using CLAMP FULL.')
-            for x in unique_names:
-                self.flags.append('    '+x)
-        unique_names = [x[1] for x in t_exactlies]
-        if len(unique_names) != len(set(unique_names)):
-            self.flags.append('- Inconsistent group unit counts using TARGET FULL.')
-            for x in unique_names:
-                self.flags.append('    '+x)
-
-        # convert tuples into strings
-        clamp_data = [(x[0],x[1],x[2],str(x[3]),x[4]) for x in clamp_data]
-        target_data = [(x[0],x[1],x[2],str(x[3]),x[4]) for x in target_data]
-        clamp_data = [''.join(x) for x in clamp_data]
-        target_data = [''.join(x) for x in target_data]
-        
+        group_data = {}
+        for spec in ['CLAMP','TARGET']:
+            group_data[spec] = []
+            mismatches = []
+            for group,formats in sorted(summary[spec].items()):
+                for count in sorted(formats.get('FULL',[])):
+                    group_data[spec].append('    "'+group+'", exactly '+str(count)+' units')
+                if len(formats.get('FULL',[])) > 1:
+                    mismatches.append('    "'+group+'"')
+                if 'SPARSE' in formats:
+                    group_data[spec].append('    "'+group+'", at least '+
+                                            str(max(formats['SPARSE']))+' units')
+            if mismatches:
+                self.flags.append('- Inconsistent group unit counts using '+spec+' FULL.')
+                self.flags += mismatches
+        self.showInfo(ex_count,summary['ticks'],group_data['CLAMP'],group_data['TARGET'])
+
+    def showInfo(self,ex_count,tick_min,clamp_data,target_data):
         # update informative text labels
         if self.flags:
             self.proper.setText('errors')
@@ -0,0 +1,548 @@
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+..................................................................
+The example_io module compiles text example files (.ex) into a binary
+format that is cached next to the source ("foo.ex" -> "foo.ex.exb").
+
+The text file is parsed once, exactly the way mikenet's load_examples reads
+it. After that, load_examples (resources/Mikenet-v8.0/src/example.c) and the
+readers in this module memory-map the compiled copy instead: nothing is parsed
+or copied, and concurrent runs share the same pages.
+
+Layout (little endian, every field 4 byte aligned, and the blocks and data
+sections, whose records hold 8 byte fields, 8 byte aligned):
+    header    magic, version, counts, source size/mtime/sha1, section offsets
+    groups    per group: int name length, name, NUL, padded to 4 bytes
+    examples  per example: first block, block count, prob, tag offset, has PROB
+    blocks    per CLAMP/TARGET: group, spec, clamp type, start/end tick,
+              format, value count, on/off value, units, data offset
+    data      float32 unit values (FULL) or int32 unit indices (SPARSE)
+    tags      NUL terminated TAG lines
+
+A compiled copy is up to date when the size and mtime (to the fraction of a
+second os.stat gives) of the source match its header. If only the mtime
+changed, the source is hashed and compared with the sha1 in the header, so
+touching a file does not force a recompile. Neither is trusted when the source
+changed less than RACY_SECONDS before its copy was written: an mtime does not
+move for edits that close together (on some file systems, for a whole second
+or two), so the source is hashed then too. mikenet cannot hash, and reads the
+text instead.
+
+Compiling also writes a small JSON index next to the source ("foo.ex" ->
+"foo.ex.stats") with the facts the example previewer, the script scanner and
+the run compiler ask about: example, TAG and PROB counts, ticks used, and the
+unit counts of each CLAMP and TARGET group. getStats reads it back without
+touching the examples themselves.
+'''
+import os
+import re
+import json
+import mmap
+import struct
+import hashlib
+import threading
+from array import array
+
+EXB_SUFFIX = '.exb'
+STATS_SUFFIX = '.stats'
+STATS_VERSION = 2
+EXB_MAGIC = 'MNEXB\0\0\0'
+EXB_VERSION = 3
+HEADER = struct.Struct('<8s4iqd20si5q')
+# see above. must match RACY_SECONDS in example.c
+RACY_SECONDS = 1.0
+EXAMPLE = struct.Struct('<2if2i')
+BLOCK = struct.Struct('<7i2fiq')
+
+# same values as the enums in mikenet's example.h
+CLAMP, TARGET = 0, 1
+CLAMP_HARD, CLAMP_SOFT = 0, 1
+SPARSE_EXAMPLE, EXPANDED_EXAMPLE = 0, 1
+ALL_TICKS = -1
+# value mikenet stores for "NaN" and "d" (don't care) in FULL data
+DONT_CARE = -505.0
+# on/off value of a SPARSE block that uses mikenet's defaults
+DEFAULT_VALUE = float('nan')
+
+# runs are compiled on several threads, and they often share example files.
+# each file has a lock of its own (see getCompileLock), so compiling one file
+# does not hold up the runs that use others
+compile_locks = {}
+compile_locks_lock = threading.Lock()
+
+# the leading part of a word that sscanf("%f") would accept
+float_prefix = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+class FormatError(Exception):
+    # raised while parsing, turned into an error message by compileExamples
+    pass
+
+def align8(offset):
+    # mikenet reads 8 byte fields in place, through struct pointers into the map
+    return offset + (-offset % 8)
+
+def compiledPath(path):
+    return path + EXB_SUFFIX
+
+def statsPath(path):
+    return path + STATS_SUFFIX
+
+def isCompressed(path):
+    # mikenet uncompresses these through a temporary file, always read as text
+    return path.endswith('.gz') or path.endswith('.Z')
+
+def scanFloat(word):
+    # mimics sscanf(word,"%f",&v): returns None if word does not start with a number
+    try:
+        return float(word)
+    except ValueError:
+        m = float_prefix.match(word)
+        if m:
+            return float(m.group(0))
+        return None
+
+class ExampleTokens():
+    # a stream of whitespace separated words, as fscanf("%s") sees them
+    def __init__(self,text):
+        self.lines = text.splitlines(True)
+        self.line_index = -1
+        self.line = ''
+        self.words = []
+        self.word_index = 0
+
+    def lineNumber(self):
+        return self.line_index + 1
+
+    def next(self):
+        while self.word_index >= len(self.words):
+            self.line_index += 1
+            if self.line_index >= len(self.lines):
+                return None
+            self.line = self.lines[self.line_index]
+            self.words = self.line.split()
+            self.word_index = 0
+        word = self.words[self.word_index]
+        self.word_index += 1
+        return word
+
+    def peek(self):
+        word = self.next()
+        if word is not None:
+            self.word_index -= 1
+        return word
+
+    def restOfWords(self):
+        # the unread words on the current line
+        words = self.words[self.word_index:]
+        self.word_index = len(self.words)
+        return words
+
+    def restOfLine(self):
+        # what fgets would return after the last word read (TAG lines)
+        ends = [m.end() for m in re.finditer(r'\S+',self.line)]
+        rest = self.line[ends[self.word_index-1]:]
+        self.word_index = len(self.words)
+        return rest[:999]
+
+def parseTime(word):
+    # returns (start,end) ticks; end is ALL_TICKS for "ALL" and "n-ALL"
+    if word == 'ALL':
+        return 0,ALL_TICKS
+    m = re.match(r'([+-]?\d+)-([+-]?\d+)',word)
+    if m:
+        return int(m.group(1)),int(m.group(2))
+    m = re.match(r'([+-]?\d+)-ALL',word)
+    if m:
+        return int(m.group(1)),ALL_TICKS
+    m = re.match(r'[+-]?\d+',word)
+    if m:
+        return int(m.group(0)),int(m.group(0))
+    raise FormatError('invalid time specification '+word)
+
+def readFullData(tokens):
+    # unit values run until the next word that is not a number
+    values = array('f')
+    while True:
+        words = tokens.restOfWords()
+        if not words:
+            if tokens.peek() is None:
+                return values
+            continue
+        if 'NaN' not in words and 'd' not in words:
+            try:
+                values.extend(map(float,words))
+                continue
+            except ValueError:
+                pass
+        for i,w in enumerate(words):
+            if w in ['NaN','d']:
+                values.append(DONT_CARE)
+                continue
+            v = scanFloat(w)
+            if v is None:
+                # give the rest of the line back to the parser
+                tokens.word_index -= len(words) - i
+                return values
+            values.append(v)
+
+def readSparseData(tokens):
+    # unit indices, with optional ONVAL/OFFVAL, up to a lone ","
+    indices = array('i')
+    on = off = DEFAULT_VALUE
+    while True:
+        w = tokens.next()
+        if w is None:
+            raise FormatError('unexpected end of file in SPARSE data')
+        if w == ',':
+            return indices,on,off
+        if w in ['ONVAL','OFFVAL']:
+            v = scanFloat(tokens.next() or '')
+            if v is None:
+                raise FormatError('error reading '+w)
+            if w == 'ONVAL':
+                on = v
+            else:
+                off = v
+            continue
+        v = scanFloat(w)
+        if v is None:
+            raise FormatError('unknown argument '+w)
+        indices.append(int(v))
+
+def parseExamples(tokens):
+    # parses an example file (an ExampleTokens stream) the way load_examples
+    # does. returns (groups,examples,blocks,data,tags)
+    groups = []
+    group_index = {}
+    examples = []
+    blocks = []
+    data = []
+    tags = []
+    tag_size = 0
+
+    verb = tokens.next()
+    while verb is not None:
+        first_block = len(blocks)
+        prob = 1.0
+        has_prob = 0
+        tag_offset = -1
+        # munch until example is done (signaled by semicolon)
+        while verb != ';':
+            if verb is None:
+                raise FormatError('example '+str(len(examples)+1)+' is missing its ";"')
+            if verb == 'TAG':
+                tag = tokens.restOfLine()
+                tag_offset = tag_size
+                tags.append(tag + '\0')
+                tag_size += len(tag) + 1
+            elif verb == 'PROB':
+                w = tokens.next() or ''
+                prob = scanFloat(w)
+                if prob is None:
+                    raise FormatError('cannot read example prob from '+w)
+                has_prob = 1
+            else:
+                if verb[:5] in ['CLAMP','INPUT']:
+                    spec,clamp_type = CLAMP,CLAMP_HARD
+                elif verb[:9] == 'SOFTCLAMP' or verb[:10] == 'SOFT_CLAMP':
+                    spec,clamp_type = CLAMP,CLAMP_SOFT
+                elif verb[:6] == 'TARGET':
+                    spec,clamp_type = TARGET,CLAMP_HARD
+                else:
+                    raise FormatError('unknown argument in example file: '+verb)
+                group = tokens.next()
+                start,end = parseTime(tokens.next() or '')
+                if group not in group_index:
+                    group_index[group] = len(groups)
+                    groups.append(group)
+                fmt = tokens.next() or ''
+                if fmt == 'FULL' or fmt[:6] == 'EXPAND':
+                    values = readFullData(tokens)
+                    blocks.append([group_index[group],spec,clamp_type,start,end,
+                                   EXPANDED_EXAMPLE,len(values),DEFAULT_VALUE,
+                                   DEFAULT_VALUE,len(values)])
+                elif fmt == 'SPARSE':
+                    values,on,off = readSparseData(tokens)
+                    units = max(values) + 1 if values else 0
+                    blocks.append([group_index[group],spec,clamp_type,start,end,
+                                   SPARSE_EXAMPLE,len(values),on,off,units])
+                else:
+                    raise FormatError('illegal verb '+fmt)
+                data.append(values)
+            verb = tokens.next()
+        examples.append((first_block,len(blocks)-first_block,prob,tag_offset,has_prob))
+        verb = tokens.next()
+    return groups,examples,blocks,data,tags
+
+def compileExamples(path):
+    # compiles path into its .exb copy. returns None, or an error message
+    if isCompressed(path):
+        return 'compressed example files are not compiled'
+    try:
+        # stat first: if path changes while it is read, its mtime will not
+        # match the header
+        st = os.stat(path)
+        with open(path,'rb') as f:
+            text = f.read()
+    except (IOError,OSError):
+        return 'cannot open example path: '+path
+    tokens = ExampleTokens(text)
+    try:
+        groups,examples,blocks,data,tags = parseExamples(tokens)
+    except FormatError as e:
+        return 'line '+str(tokens.lineNumber())+': '+str(e)
+
+    # lay out the sections
+    group_bytes = ''
+    for g in groups:
+        name = g + '\0'
+        name += '\0' * (-len(name) % 4)
+        group_bytes += struct.pack('<i',len(g)) + name
+    groups_offset = HEADER.size
+    examples_offset = groups_offset + len(group_bytes)
+    blocks_offset = align8(examples_offset + EXAMPLE.size*len(examples))
+    data_offset = align8(blocks_offset + BLOCK.size*len(blocks))
+    tags_offset = data_offset + 4*sum(len(d) for d in data)
+
+    header = HEADER.pack(EXB_MAGIC,EXB_VERSION,len(examples),len(groups),
+                         len(blocks),st.st_size,st.st_mtime,
+                         hashlib.sha1(text).digest(),0,groups_offset,
+                         examples_offset,blocks_offset,data_offset,tags_offset)
+
+    exb_path = compiledPath(path)
+    tmp_path = exb_path + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident)
+    try:
+        with open(tmp_path,'wb') as f:
+            f.write(header)
+            f.write(group_bytes)
+            for e in examples:
+                f.write(EXAMPLE.pack(*e))
+            f.write('\0' * (blocks_offset - f.tell()))
+            offset = data_offset
+            for b,d in zip(blocks,data):
+                f.write(BLOCK.pack(*(b+[offset])))
+                offset += 4*len(d)
+            f.write('\0' * (data_offset - f.tell()))
+            for d in data:
+                f.write(d.tostring())
+            f.write(''.join(tags))
+        if os.name == 'nt' and os.path.exists(exb_path):
+            # rename does not replace files on windows
+            os.remove(exb_path)
+        os.rename(tmp_path,exb_path)
+    except (IOError,OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return 'cannot write compiled example file: '+exb_path
+    writeStats(path,st,summarize(groups,examples,blocks))
+    return None
+
+def isCompiled(path):
+    # is there an up to date compiled copy of path?
+    exb_path = compiledPath(path)
+    try:
+        st = os.stat(path)
+        exb_st = os.stat(exb_path)
+        with open(exb_path,'rb') as f:
+            fields = HEADER.unpack(f.read(HEADER.size))
+    except (IOError,OSError,struct.error):
+        return False
+    if fields[0] != EXB_MAGIC or fields[1] != EXB_VERSION or fields[5] != st.st_size:
+        return False
+    if fields[6] == st.st_mtime and exb_st.st_mtime - st.st_mtime >= RACY_SECONDS:
+        return True
+    # same size, but a different mtime, or one too close to when the copy was
+    # written to tell edits apart: still good if the contents did not change
+    try:
+        with open(path,'rb') as f:
+            if hashlib.sha1(f.read()).digest() != fields[7]:
+                return False
+        # remember the new mtime so the next check (and mikenet) is cheap.
+        # this also makes the copy newer than the source
+        with open(exb_path,'r+b') as f:
+            f.seek(struct.calcsize('<8s4i'))
+            f.write(struct.pack('<qd',st.st_size,st.st_mtime))
+    except (IOError,OSError):
+        return False
+    return True
+
+def getCompileLock(path):
+    # the same lock for every spelling of the same file
+    key = os.path.normcase(os.path.abspath(path))
+    with compile_locks_lock:
+        return compile_locks.setdefault(key,threading.Lock())
+
+def ensureCompiled(path):
+    # compiles path unless it already has an up to date copy.
+    # returns None, or an error message
+    with getCompileLock(path):
+        if isCompiled(path):
+            return None
+        return compileExamples(path)
+
+class CompiledExamples():
+    # read only view of a compiled example file
+    def __init__(self,path):
+        self.path = path
+        with open(compiledPath(path),'rb') as f:
+            self.map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.map,0)
+        self.num_examples = fields[2]
+        self.num_groups = fields[3]
+        self.num_blocks = fields[4]
+        self.groups_offset,self.examples_offset,self.blocks_offset, \
+            self.data_offset,self.tags_offset = fields[9:]
+        self.groups = []
+        offset = self.groups_offset
+        for i in range(self.num_groups):
+            length = struct.unpack_from('<i',self.map,offset)[0]
+            self.groups.append(self.map[offset+4:offset+4+length])
+            offset += 4 + (length + 4) // 4 * 4
+
+    def close(self):
+        self.map.close()
+
+    def getExample(self,i):
+        # (first block,block count,prob,tag offset,has PROB)
+        return EXAMPLE.unpack_from(self.map,self.examples_offset + i*EXAMPLE.size)
+
+    def getTag(self,i):
+        offset = self.getExample(i)[3]
+        if offset < 0:
+            return None
+        start = self.tags_offset + offset
+        return self.map[start:self.map.find('\0',start)]
+
+    def getBlocks(self):
+        # every CLAMP/TARGET block as (group name,spec,clamp type,start,end,
+        # format,count,onvalue,offvalue,units,data offset)
+        for i in range(self.num_blocks):
+            b = BLOCK.unpack_from(self.map,self.blocks_offset + i*BLOCK.size)
+            yield (self.groups[b[0]],) + b[1:]
+
+    def getValues(self,block):
+        # the unit values (FULL) or indices (SPARSE) of a block from getBlocks
+        values = array('f' if block[5] == EXPANDED_EXAMPLE else 'i')
+        values.fromstring(self.map[block[10]:block[10] + 4*block[6]])
+        return values
+
+    def getSummary(self):
+        # the same summary compileExamples stores in the stats index
+        examples = [self.getExample(i) for i in range(self.num_examples)]
+        blocks = [BLOCK.unpack_from(self.map,self.blocks_offset + i*BLOCK.size)
+                  for i in range(self.num_blocks)]
+        return summarize(self.groups,examples,blocks)
+
+def summarize(groups,examples,blocks):
+    # the facts the example previewer, the script scanner and the run compiler
+    # report, from parsed (or compiled) examples and blocks
+    summary = {'examples': len(examples),
+               'tags': 0,
+               'probs': 0,
+               'ticks': 1,
+               'CLAMP': {},     # group -> {format: sorted list of unit counts}
+               'TARGET': {}}
+    for e in examples:
+        if e[3] >= 0:
+            summary['tags'] += 1
+        summary['probs'] += e[4]
+    units = {}
+    for b in blocks:
+        spec = 'CLAMP' if b[1] == CLAMP else 'TARGET'
+        fmt = 'FULL' if b[5] == EXPANDED_EXAMPLE else 'SPARSE'
+        units.setdefault((spec,groups[b[0]],fmt),set()).add(b[9])
+        summary['ticks'] = max(summary['ticks'],b[3]+1,b[4]+1)
+    for (spec,group,fmt),counts in units.items():
+        summary[spec].setdefault(group,{})[fmt] = sorted(counts)
+    return summary
+
+def writeStats(path,st,summary):
+    # stores summary in the stats index of path (st is os.stat of the source).
+    # the index is only a cache, so failing to write it is not an error
+    stats_path = statsPath(path)
+    tmp_path = stats_path + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident)
+    try:
+        with open(tmp_path,'w') as f:
+            json.dump({'version': STATS_VERSION,
+                       'size': st.st_size,
+                       'mtime': st.st_mtime,
+                       'summary': summary},f)
+        if os.name == 'nt' and os.path.exists(stats_path):
+            os.remove(stats_path)
+        os.rename(tmp_path,stats_path)
+    except (IOError,OSError,ValueError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def readStats(path):
+    # the summary in the stats index of path, or None if there is no index or
+    # path changed since it was written
+    try:
+        st = os.stat(path)
+        stats_st = os.stat(statsPath(path))
+        with open(statsPath(path),'r') as f:
+            stats = json.load(f)
+    except (IOError,OSError,ValueError):
+        return None
+    if (stats.get('version') != STATS_VERSION or stats.get('size') != st.st_size or
+        stats.get('mtime') != st.st_mtime or
+        stats_st.st_mtime - st.st_mtime < RACY_SECONDS):
+        # getStats goes through the compiled copy, which hashes path if need be
+        return None
+    summary = stats['summary']
+    # json gives back unicode group names
+    for spec in ['CLAMP','TARGET']:
+        summary[spec] = dict((group.encode('utf-8'),dict((str(fmt),counts) for fmt,counts in formats.items()))
+                             for group,formats in summary[spec].items())
+    return summary
+
+def getStats(path):
+    # returns (summary,None) for path from its stats index, compiling path (and
+    # so indexing it) first if needed, or (None,error message)
+    summary = readStats(path)
+    if summary is not None:
+        return summary,None
+    examples,error = openExamples(path)
+    if error:
+        return None,error
+    # up to date compiled copy, but no index (or the file was only touched)
+    summary = examples.getSummary()
+    examples.close()
+    try:
+        writeStats(path,os.stat(path),summary)
+    except OSError:
+        pass
+    return summary,None
+
+def getUnitMismatches(summary):
+    # (spec,group,unit counts) for each group given different numbers of FULL
+    # values in different examples
+    return [(spec,group,sorted(formats['FULL'])) for spec in ['CLAMP','TARGET']
+            for group,formats in sorted(summary[spec].items())
+            if len(formats.get('FULL',[])) > 1]
+
+def openExamples(path):
+    # returns (CompiledExamples,None), compiling path first if needed, or
+    # (None,error message) if path cannot be compiled
+    error = ensureCompiled(path)
+    if error:
+        return None,error
+    try:
+        return CompiledExamples(path),None
+    except (IOError,OSError,ValueError,struct.error):
+        return None,'cannot read compiled example file: '+compiledPath(path)
@@ -0,0 +1,463 @@
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+..................................................................
+The mikenet_binding module is the in-process simulation backend.
+
+Instead of generating C code, compiling it and running an executable,
+the model is put together and trained through the shared mikenet library
+(libmikenet.so, built by resources/mikenet_installer.py), which also
+contains the training driver from resources/template_code/mikenet_master.c.
+
+The model is built in exactly the same order as the generated
+build_model.c, so a run gives the same results with either backend.
+'''
+from ctypes import *
+import multiprocessing
+import os
+import sys
+import run_compiler
+
+# mikenet is built with Real defined as float (see const.h)
+Real = c_float
+
+class PhaseItem(Structure):
+    # must match the PhaseItem struct in resources/template_code/build_model.h
+    _fields_ = [('net',c_void_p),
+                ('iter',c_int),
+                ('wcount',c_int),
+                ('ecount',c_int),
+                ('tcount',c_int),
+                ('ocount',c_int),
+                ('item_name',c_char_p),
+                ('which_phase',c_int),
+                ('test_only',c_int),
+                ('num_tests',c_int),
+                ('test_indices',POINTER(c_int)),
+                ('probability',Real),
+                ('total_group_readouts',c_int),
+                ('group_readout_names',POINTER(c_char_p)),
+                ('group_readout_times',POINTER(c_int)),
+                ('readout_table',POINTER(POINTER(c_int))),
+                ('total_weight_noise',c_int),
+                ('total_activation_noise',c_int),
+                ('total_input_noise',c_int),
+                ('weight_noise_types',POINTER(c_int)),
+                ('weight_noise_values',POINTER(Real)),
+                ('activation_noise_values',POINTER(Real)),
+                ('input_noise_values',POINTER(Real)),
+                ('weight_noise_connections',POINTER(c_void_p)),
+                ('activation_noise_groups',POINTER(c_void_p)),
+                ('input_noise_groups',POINTER(c_void_p)),
+                ('train_examples',c_void_p),
+                ('max_iterations',c_int),
+                ('stop_criterion',c_int),
+                ('error',Real),
+                ('epsilon',Real),
+                ('tolerance',Real),
+                ('momentum',Real),
+                ('error_radius',Real),
+                ('training_mode',c_int),
+                ('training_algorithm',c_int),
+                ('will_save_weights',c_int),
+                ('save_weights_interval',c_int),
+                ('will_save_error',c_int),
+                ('save_error_interval',c_int),
+                ('test_interval',c_int),
+                ('will_save_activations',c_int),
+                ('save_activations_interval',c_int),
+                ('readout_interval',c_int),
+                ('error_ramp',c_int),
+                ('tai',c_int),
+                ('dbd',c_int),
+                ('reset_activation',c_int),
+                ('seconds',Real),
+                ('tao',Real),
+                ('tao_decay',Real),
+                ('tao_max_mult',Real),
+                ('tao_min_mult',Real),
+                ('tao_epsilon',Real)]
+
+class Phase(Structure):
+    # must match the Phase struct in resources/template_code/build_model.h
+    _fields_ = [('phase_name',c_char_p),
+                ('phase_order',c_int),
+                ('num_phase_items',c_int),
+                ('max_iterations',c_int)]
+
+# void error_hook(char *item_name, int run_trial, int trial, Real error)
+ErrorHook = CFUNCTYPE(None,c_char_p,c_int,c_int,Real)
+
+# loaded libraries, by path. a library is only loaded once per process
+libraries = {}
+
+def getLibraryPath(gui):
+    if sys.platform == 'win32':
+        name = 'libmikenet.dll'
+    else:
+        name = 'libmikenet.so'
+    return os.path.join(gui.parameters['mikenet_path'].value,'lib',name)
+
+def loadLibrary(gui):
+    '''Returns the shared mikenet library, or None if it hasn't been built.'''
+    path = getLibraryPath(gui)
+    if path in libraries:
+        return libraries[path]
+    if not os.path.isfile(path):
+        return None
+    try:
+        lib = CDLL(path)
+    except OSError:
+        print 'ERROR: Could not load',path
+        return None
+    lib.create_net.argtypes = [c_int]
+    lib.create_net.restype = c_void_p
+    lib.init_group.argtypes = [c_char_p,c_int,c_int]
+    lib.init_group.restype = c_void_p
+    lib.init_bias.argtypes = [c_float,c_int]
+    lib.init_bias.restype = c_void_p
+    lib.connect_groups.argtypes = [c_void_p,c_void_p]
+    lib.connect_groups.restype = c_void_p
+    lib.bind_group_to_net.argtypes = [c_void_p,c_void_p]
+    lib.bind_group_to_net.restype = None
+    lib.bind_connection_to_net.argtypes = [c_void_p,c_void_p]
+    lib.bind_connection_to_net.restype = None
+    lib.randomize_connections.argtypes = [c_void_p,Real]
+    lib.randomize_connections.restype = None
+    lib.find_group_by_name.argtypes = [c_char_p]
+    lib.find_group_by_name.restype = c_void_p
+    lib.load_examples.argtypes = [c_char_p,c_int]
+    lib.load_examples.restype = c_void_p
+    lib.mikenet_set_seed.argtypes = [c_long]
+    lib.mikenet_set_seed.restype = None
+    lib.setGroupTypes.argtypes = [c_void_p,c_int,c_int]
+    lib.setGroupTypes.restype = None
+    lib.runPhases.argtypes = []
+    lib.runPhases.restype = None
+    libraries[path] = lib
+    return lib
+
+def readConstants(gui):
+    '''Activation and error types are #defines in mikenet's const.h.
+
+    Returns a dictionary of name: value for every integer constant.
+    '''
+    constants = {}
+    path = os.path.join(gui.parameters['mikenet_path'].value,'include','mikenet','const.h')
+    with open(path,'r') as f:
+        for line in f:
+            s = line.split()
+            if len(s) >= 3 and s[0] == '#define':
+                try:
+                    constants[s[1]] = int(s[2])
+                except ValueError:
+                    pass
+    return constants
+
+def canRunInProcess(run):
+    '''Can this run use the in-process backend?
+
+    Custom test functions are C code that has to be compiled in, so scripts
+    with test profiles still go through the compiler. Runs are trained in a
+    forked child process (see runInProcess), so platforms without fork do too.
+    '''
+    if not hasattr(os,'fork'):
+        return False
+    if run.getGUI().getScript().getTestProfiles().getChildren():
+        return False
+    return loadLibrary(run.getGUI()) is not None
+
+def runInProcess(run,runDir,log_path):
+    '''Builds and trains a run through the shared library, in a child process.
+
+    mikenet reports bad input (a group that is not in the network, an example
+    file that does not fit it) by calling exit(), and keeps the network and the
+    driver state in globals. Forking a child for every run keeps both away from
+    the gui, and lets several runs train at once. The child writes the log
+    (see writeLog) to log_path, and files (weights, activations) to runDir,
+    like the compiled backend does. Returns 1 if the run finished, 0 if not.
+    '''
+    child = multiprocessing.Process(target=trainRun,args=(run,runDir,log_path))
+    child.start()
+    child.join()
+    return 1 if child.exitcode == 0 else 0
+
+def trainRun(run,runDir,log_path):
+    # runs in the child process
+    results = buildAndTrain(run,runDir)
+    if results is None:
+        sys.exit(1)
+    writeLog(log_path,results)
+
+def buildAndTrain(run,runDir):
+    # returns a dictionary with the average error reports ('errors':
+    # (item_name,run_trial,trial,error) tuples) and the noise settings
+    # ('noise': (item_name,noise_type,noise_object,amount) tuples), or None if
+    # the run could not be built
+    gui = run.getGUI()
+    lib = loadLibrary(gui)
+    constants = readConstants(gui)
+    ticks = int(run.getValueOf('ticks'))
+    overrides = run.getRunOverrides()
+    if 'Random seed' in overrides:
+        seed = overrides['Random seed']
+    else:
+        seed = run.getValueOf('seed')
+    if 'Weight range' in overrides:
+        weight_range = overrides['Weight range']
+    else:
+        weight_range = run.getValueOf('weight_range')
+    if 'Bias value' in overrides:
+        bias_val = overrides['Bias value']
+    else:
+        bias_val = run.getValueOf('bias_value')
+
+    # everything the C side points into has to stay alive until the run is over
+    keep = []
+
+    # groups from a previous in-process run are still on mikenet's global group
+    # list, and find_group_by_name would find those first
+    c_int.in_dll(lib,'globalNumGroups').value = 0
+    lib.mikenet_set_seed(int(seed))
+    c_long.in_dll(lib,'run_seed').value = int(seed)
+    Real.in_dll(lib,'run_weight_range').value = float(weight_range)
+    Real.in_dll(lib,'run_bias_value').value = float(bias_val)
+    # the driver names its output files after run_name, so pointing it into the
+    # run directory keeps them out of the cwd
+    run_name = os.path.join(runDir,str(run.getValueOf('run_name')))
+    if len(run_name) > 511:
+        print 'ERROR: Run path is too long for the in-process backend:',run_name
+        return None
+    (c_char*512).in_dll(lib,'run_name').value = run_name
+
+    # the main network. same order as writeNetBuild
+    run_net = lib.create_net(ticks)
+    run_groups = [x['name'] for x in run.getGroups()]
+    group_ptrs = []
+    for g in run.getGroups():
+        units = g['units']
+        if ('Number of hidden units' in overrides) and \
+            (g['name'] == overrides['Number of hidden units'][0]):
+            units = overrides['Number of hidden units'][1]
+        gp = lib.init_group(str(g['name']),int(units),ticks)
+        lib.setGroupTypes(gp,constants[g['activation_type']],
+                          constants[g['error_computation_type']])
+        group_ptrs.append(gp)
+    bias = lib.init_bias(float(bias_val),ticks)
+    for gp in group_ptrs:
+        lib.bind_group_to_net(run_net,gp)
+    lib.bind_group_to_net(run_net,bias)
+
+    connection_map = {}
+    bias_connection_map = {}
+    connection_count = 0
+    matrix = run.getMatrix()
+    for i in range(len(run_groups)):
+        for j in range(len(run_groups)):
+            if matrix[i][j] == 1:
+                connection_count += 1
+                connection_map[(i,j)] = str('c'+str(connection_count))
+    for j in range(len(run_groups)):
+        if matrix[len(run_groups)][j] == 1:
+            connection_count += 1
+            bias_connection_map[j] = str('c'+str(connection_count))
+    conn_ptrs = {}
+    for k,v in connection_map.iteritems():
+        i,j = k
+        conn_ptrs[v] = lib.connect_groups(group_ptrs[i],group_ptrs[j])
+    for k,v in bias_connection_map.iteritems():
+        conn_ptrs[v] = lib.connect_groups(bias,group_ptrs[k])
+    for v in connection_map.values() + bias_connection_map.values():
+        lib.bind_connection_to_net(run_net,conn_ptrs[v])
+    for v in connection_map.values() + bias_connection_map.values():
+        lib.randomize_connections(conn_ptrs[v],float(weight_range))
+
+    # phases
+    phases = (POINTER(Phase)*max(len(run.getChildren()),1))()
+    for i,phase in enumerate(run.getChildren()):
+        ph = Phase()
+        ph.phase_name = str(phase.getValueOf('phase_name'))
+        ph.phase_order = int(phase.getValueOf('phase_order'))
+        ph.num_phase_items = len(phase.getChildren())
+        ph.max_iterations = int(phase.getValueOf('max_iterations'))
+        keep.append(ph)
+        phases[i] = pointer(ph)
+    keep.append(phases)
+
+    # phase items. same order as writePhaseItem. like build_model.c, every example
+    # file is loaded once and shared by the phase items that train on it
+    items = []
+    noise_rows = []
+    example_sets = {}
+    for phase_index,phase in enumerate(run.getChildren()):
+        for phase_item in phase.getChildren():
+            item = buildPhaseItem(lib,run,phase_item,phase_index,ticks,run_groups,bias,
+                                  connection_map,bias_connection_map,conn_ptrs,
+                                  example_sets,keep)
+            if item is None:
+                return None
+            items.append(item)
+            noise_rows += getNoiseRows(run,phase_item)
+    phase_items = (POINTER(PhaseItem)*max(len(items),1))(*[pointer(x) for x in items])
+    keep.append(phase_items)
+
+    # hand everything over to the driver
+    c_void_p.in_dll(lib,'phases').value = addressof(phases)
+    c_void_p.in_dll(lib,'phase_items').value = addressof(phase_items)
+    c_void_p.in_dll(lib,'test_sets').value = None
+    c_int.in_dll(lib,'num_phases').value = len(run.getChildren())
+    c_int.in_dll(lib,'num_phase_items').value = len(items)
+    c_int.in_dll(lib,'num_test_sets').value = 0
+    c_int.in_dll(lib,'num_ticks').value = ticks
+
+    errors = []
+    def collectError(item_name,run_trial,trial,error):
+        errors.append((item_name,run_trial,trial,error))
+    hook = ErrorHook(collectError)
+    c_void_p.in_dll(lib,'error_hook').value = cast(hook,c_void_p).value
+    try:
+        lib.runPhases()
+    finally:
+        c_void_p.in_dll(lib,'error_hook').value = None
+    return {'errors': errors, 'noise': noise_rows}
+
+def buildPhaseItem(lib,run,phase_item,phase_index,ticks,run_groups,bias,conn_map,
+                   bias_conn_map,conn_ptrs,example_sets,keep):
+    item = PhaseItem()
+    keep.append(item)
+    # subnetwork for this phase item
+    net = lib.create_net(ticks)
+    for group in phase_item.getComponentGroups():
+        if group in run_groups:
+            lib.bind_group_to_net(net,lib.find_group_by_name(str(group)))
+    lib.bind_group_to_net(net,bias)
+    for conn in phase_item.getComponentConnections():
+        g_from,g_to = conn.split('%')
+        if g_from in run_groups and g_to in run_groups:
+            c = conn_map[(run_groups.index(str(g_from)),run_groups.index(str(g_to)))]
+            lib.bind_connection_to_net(net,conn_ptrs[c])
+    for k,v in bias_conn_map.iteritems():
+        if run_groups[k] in phase_item.getComponentGroups():
+            lib.bind_connection_to_net(net,conn_ptrs[v])
+    item.net = net
+    item.item_name = str(phase_item.getValueOf('item_name'))
+    item.which_phase = phase_index
+    if phase_item.getMode() == 'TRAIN':
+        item.test_only = 0
+    else:
+        item.test_only = 1
+    item.num_tests = 0
+    item.probability = float(phase_item.getValueOf('probability'))
+
+    # activation readouts
+    g_readouts = [x for x in phase_item.getGroupReadouts()
+                  if x in phase_item.getComponentGroups()]
+    item.total_group_readouts = len(g_readouts)
+    if len(g_readouts) > 0:
+        names = (c_char_p*len(g_readouts))(*[str(x) for x in g_readouts])
+        slices = phase_item.getAllRecordingTimes()
+        times = (c_int*len(slices))(*slices)
+        ro_table = phase_item.getSlicesByGroup()
+        rows = [(c_int*ticks)(*ro_table[i]) for i in range(len(g_readouts))]
+        table = (POINTER(c_int)*len(rows))(*[cast(r,POINTER(c_int)) for r in rows])
+        keep.extend([names,times,rows,table])
+        item.group_readout_names = cast(names,POINTER(c_char_p))
+        item.group_readout_times = cast(times,POINTER(c_int))
+        item.readout_table = cast(table,POINTER(POINTER(c_int)))
+
+    # noise
+    noise_data = run_compiler.getActivationNoise(run,phase_item)
+    item.total_activation_noise = len(noise_data)
+    if len(noise_data) > 0:
+        groups = (c_void_p*len(noise_data))(*[lib.find_group_by_name(str(k))
+                                              for k,v in noise_data])
+        values = (Real*len(noise_data))(*[float(v) for k,v in noise_data])
+        keep.extend([groups,values])
+        item.activation_noise_groups = cast(groups,POINTER(c_void_p))
+        item.activation_noise_values = cast(values,POINTER(Real))
+    noise_data = run_compiler.getInputNoise(run,phase_item)
+    item.total_input_noise = len(noise_data)
+    if len(noise_data) > 0:
+        groups = (c_void_p*len(noise_data))(*[lib.find_group_by_name(str(k))
+                                              for k,v in noise_data])
+        values = (Real*len(noise_data))(*[float(v) for k,v in noise_data])
+        keep.extend([groups,values])
+        item.input_noise_groups = cast(groups,POINTER(c_void_p))
+        item.input_noise_values = cast(values,POINTER(Real))
+    noise_data = run_compiler.getWeightNoise(run,phase_item)
+    item.total_weight_noise = len(noise_data)
+    if len(noise_data) > 0:
+        conns = []
+        for k,v in noise_data:
+            g_from,g_to = k.split('%')
+            c = conn_map[(run_groups.index(str(g_from)),run_groups.index(str(g_to)))]
+            conns.append(conn_ptrs[c])
+        conns = (c_void_p*len(noise_data))(*conns)
+        types = (c_int*len(noise_data))(*[int(v[0]) for k,v in noise_data])
+        values = (Real*len(noise_data))(*[float(v[1]) for k,v in noise_data])
+        keep.extend([conns,types,values])
+        item.weight_noise_connections = cast(conns,POINTER(c_void_p))
+        item.weight_noise_types = cast(types,POINTER(c_int))
+        item.weight_noise_values = cast(values,POINTER(Real))
+
+    # training parameters
+    field_types = dict(PhaseItem._fields_)
+    for p,val in phase_item.getParameterValues(run):
+        if p.variable_name == 'profile_name':
+            pass
+        elif p.variable_name == 'example_path':
+            if phase_item.getMode() == 'TRAIN':
+                if not os.path.isfile(str(val)):
+                    print 'ERROR: Cannot resolve path to',val
+                    return None
+                if str(val) not in example_sets:
+                    example_sets[str(val)] = lib.load_examples(str(val),ticks)
+                item.train_examples = example_sets[str(val)]
+        elif p.variable_name not in field_types:
+            print 'ERROR: Unknown phase item parameter',p.variable_name
+            return None
+        elif field_types[p.variable_name] == Real:
+            setattr(item,p.variable_name,float(val))
+        else:
+            setattr(item,p.variable_name,int(float(val)))
+    return item
+
+def getNoiseRows(run,phase_item):
+    # the same information the compiled driver prints as noiseData lines
+    name = phase_item.getValueOf('item_name')
+    rows = []
+    for k,v in run_compiler.getActivationNoise(run,phase_item):
+        rows.append((name,'activation',k,float(v)))
+    for k,v in run_compiler.getInputNoise(run,phase_item):
+        rows.append((name,'input',k,float(v)))
+    for k,v in run_compiler.getWeightNoise(run,phase_item):
+        if int(v[0]) == 1:
+            rows.append((name,'weight_additive',k.replace('%','->'),float(v[1])))
+        else:
+            rows.append((name,'weight_multiplicative',k.replace('%','->'),float(v[1])))
+    return rows
+
+def writeLog(path,results):
+    '''Writes results in the same format the compiled driver logs them.
+
+    The database import reads avgError and noiseData lines from the log.
+    '''
+    with open(path,'w') as log:
+        for row in results['noise']:
+            log.write('noiseData:\t%s\t%s\t%s\t%f\n' % row)
+        for row in results['errors']:
+            log.write('avgError:\t%s\t%d\t%d\t%f\n' % row)
@@ -19,27 +19,74 @@ along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
 from PySide import QtGui,QtCore
 import multiprocessing as mp
 from itertools import product
-from run_compiler import compileRun
+from run_compiler import compileRun,prepareRun,executeRun
+from db_utils import RunIngester
+from functools import partial
 import subprocess
-from time import sleep
-from math import ceil
+import threading
+import Queue
+import traceback
 import re
 import os
 import random
 import decimal
 
-# ugly global variables to get around various threading issues
-prepared_runs = []
+# compileRun works on absolute paths under this directory
 main_directory = os.getcwd()
 
-def worker(args):
-    global prepared_runs
-    global main_directory
-    run_index,queue,lock = args
-    ret_code = compileRun(prepared_runs[run_index],main_directory)
-    with lock:
-    	queue.put(ret_code)
-    return ret_code
+def prepareWorker(run):
+    return prepareRun(run,main_directory)
+
+
+class RunExecutor(object):
+    '''Calls function(item) for every submitted item, on at most max_workers
+    threads at a time.
+
+    The threads only sit on blocking calls (gcc, mikenet_master), so a handful of
+    them cost next to nothing. Each finished job is put on a queue the moment it
+    is done, so the caller can block on nextCompleted() instead of polling.
+    Several executors can share one completed queue.
+    '''
+    def __init__(self,function,max_workers,completed=None):
+        self.function = function
+        self.pending = Queue.Queue()
+        if completed is None:
+            completed = Queue.Queue()
+        self.completed = completed
+        self.workers = []
+        for i in range(max(1,max_workers)):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def submit(self,key,item):
+        self.pending.put((key,item))
+
+    def nextCompleted(self):
+        # blocks until a job finishes. returns (key,result)
+        return self.completed.get()
+
+    def shutdown(self):
+        # let the workers finish whatever is queued, then stop them
+        for t in self.workers:
+            self.pending.put(None)
+        for t in self.workers:
+            t.join()
+
+    def work(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            key,item = job
+            try:
+                result = self.function(item)
+            except:
+                # one broken run shouldn't take the whole script down
+                traceback.print_exc()
+                result = 0
+            self.completed.put((key,result))
             
             
 
@@ -48,36 +95,33 @@ class ScriptThread(QtCore.QThread):
     # in the main thread...that's the only way to communicate
     cpus_counted = QtCore.Signal(int)
     total_progress = QtCore.Signal(int,int)
+    run_finished = QtCore.Signal(str,int)
     success_ratio = QtCore.Signal(int,int)
+    push_failed = QtCore.Signal(str)
     
     def __init__(self,script):
         super(ScriptThread,self).__init__(script.getGUI())
-        global prepared_runs
-        prepared_runs = []
-        
         self.script = script
         
         # connect custom signals
         self.cpus_counted.connect(script.getTabWidget().updateCores)
         self.total_progress.connect(script.getTabWidget().updateTotalProgress)
+        self.run_finished.connect(script.getTabWidget().updateLastRun)
         self.success_ratio.connect(script.getTabWidget().updateSuccessRatio)
+        self.push_failed.connect(script.getTabWidget().updatePushFailed)
         
     def run(self):
-        global prepared_runs
-        # go through the script and prepare runs.
-        # this step involves computing values in iterated runs
-        for child in self.script.getChildren():
-            if child.getClassName() == 'MikenetRun':
-                # flush previous overrides (if any exist)
-                child.clearRunOverrides()
-                # get a naked copy of the run (not the original)
-                prepared_runs.append(child.getCopy())
-            else:
-                prepared_runs += self.getIteratedRuns(child)
+        # runs are prepared lazily, as the schedulers ask for them, so only the
+        # runs that are actually in flight exist at any one time. the total is
+        # counted up front for the progress display
+        total = self.countRuns()
+        runs = self.generateRuns()
 
-        #DEBUG
-        for r in prepared_runs:
-            print 'run o',r.getRunOverrides()
+        # finished runs are pushed to the database (and packaged) by a single
+        # ingester thread, so training never waits on the database
+        ingester = None
+        if self.script.getGUI().parameters['use_database'].value == 1:
+            ingester = RunIngester(self.script.getGUI())
         
         # are we doing multiprocessing or not?
         if self.script.getGUI().parameters['multiprocessing'].value == 1:
@@ -93,55 +137,155 @@ class ScriptThread(QtCore.QThread):
                 actually_using = num_cores
             
             self.cpus_counted.emit(actually_using)
-            self.doMultiProcessing(actually_using)
+            hits = self.doMultiProcessing(actually_using,runs,total,ingester)
         else:
             self.cpus_counted.emit(-1)
-            self.doSerialProcessing()
+            hits = self.doSerialProcessing(runs,total,ingester)
+
+        if ingester:
+            # wait for the last runs to reach the database. a run whose data
+            # could not be pushed did not succeed, even though it trained
+            for path in ingester.shutdown():
+                hits -= 1
+                self.push_failed.emit(os.path.basename(path))
+        self.success_ratio.emit(hits,total)
+
+    def generateRuns(self):
+        # go through the script and prepare runs, one at a time.
+        # this step involves computing values in iterated runs
+        for child in self.script.getChildren():
+            if child.getClassName() == 'MikenetRun':
+                # flush previous overrides (if any exist)
+                child.clearRunOverrides()
+                # get a naked copy of the run (not the original)
+                yield child.getCopy()
+            else:
+                for run in self.getIteratedRuns(child):
+                    yield run
+
+    def countRuns(self):
+        total = 0
+        for child in self.script.getChildren():
+            if child.getClassName() == 'MikenetRun':
+                total += 1
+            else:
+                total += self.countIteratedRuns(child)
+        return total
         
             
-    def doMultiProcessing(self,cores):
-        global prepared_runs
-        indices = range(len(prepared_runs))
-        
-        pool = mp.Pool(processes=cores)
-        manager = mp.Manager()
-        queue = manager.Queue()
-        lock = manager.Lock()
-        
-        args = [(i,queue,lock) for i in indices]
+    def doMultiProcessing(self,cores,runs,total,ingester=None):
+        # the heavy lifting (gcc, mikenet_master, or the in-process backend's
+        # forked child, see mikenet_binding.runInProcess) happens in child
+        # processes, so threads are enough to keep the cores busy, and runs never
+        # have to be pickled. run_compiler never touches the cwd, so it is safe
+        # to use on several threads at once
+        #
+        # runs go through two stages: a small compile stage (prepareRun) and a
+        # run stage (executeRun). both draw from the same budget of cores, with
+        # training getting first pick, so compiles never oversubscribe cores that
+        # are busy training. compiles fill the remaining cores and stay just far
+        # enough ahead that a freed core finds a binary waiting for it
+        compiles = self.getCompileLimit(cores)
+        events = Queue.Queue()
+        compiler = RunExecutor(prepareWorker,compiles,events)
+        runner = RunExecutor(partial(executeRun,ingester=ingester),cores,events)
         
-        results = pool.map_async(worker, args)
-        pool.close()
+        # names of the runs in flight, by submission index
+        names = {}
+        exhausted = False
+        ready = []
+        compiling = 0
+        running = 0
+        results = []
         while True:
-            if results.ready():
+            while ready and compiling + running < cores:
+                i,job = ready.pop(0)
+                runner.submit(('run',i),job)
+                running += 1
+            while (not exhausted and compiling < compiles and compiling + running < cores
+                   and len(ready) + compiling < cores):
+                # only now is the next run actually put together
+                run = next(runs,None)
+                if run is None:
+                    exhausted = True
+                    break
+                i = len(names) + len(results)
+                names[i] = run.getValueOf('run_name')
+                compiler.submit(('compile',i),run)
+                compiling += 1
+            if compiling + running == 0:
+                # nothing left to build or run
                 break
+            
+            # block until either stage finishes something
+            (stage,i),ret = events.get()
+            if stage == 'compile':
+                compiling -= 1
+                if ret:
+                    ready.append((i,ret))
+                    continue
+                # didn't build, so it never makes it to the run stage
+                ret_code = 0
             else:
-                size = queue.qsize()
-                self.total_progress.emit(size,len(prepared_runs))
-                sleep(1)
+                running -= 1
+                ret_code = ret
+            # every completion is passed on to the gui as soon as it happens
+            results.append(ret_code)
+            self.run_finished.emit(names.pop(i),ret_code)
+            self.total_progress.emit(len(results),total)
+        compiler.shutdown()
+        runner.shutdown()
         
-        hits = [x for x in results.get() if x == 1]
-        self.success_ratio.emit(len(hits),len(prepared_runs))
+        # number of runs that succeeded
+        return len([x for x in results if x == 1])
         
         
-    def doSerialProcessing(self):
-        global prepared_runs
-        global main_directory
+    def doSerialProcessing(self,runs,total,ingester=None):
         results = []
-        for i,run in enumerate(prepared_runs):
-            ret_code = compileRun(run,main_directory)
+        for i,run in enumerate(runs):
+            ret_code = compileRun(run,main_directory,ingester)
             results.append(ret_code)
-            self.total_progress.emit(i+1,len(prepared_runs))
+            self.run_finished.emit(run.getValueOf('run_name'),ret_code)
+            self.total_progress.emit(i+1,total)
 
-        hits = [x for x in results if x == 1]
-        self.success_ratio.emit(len(hits),len(prepared_runs))
+        # number of runs that succeeded
+        return len([x for x in results if x == 1])
+            
+            
+    def getCompileLimit(self,cores):
+        # number of runs that may be compiling at once. defaults to 1
+        if 'max_compiles' not in self.script.getGUI().parameters:
+            return 1
+        cap = self.script.getGUI().parameters['max_compiles'].value
+        try:
+            return max(1,min([int(cap.strip()),cores]))
+        except:
+            return 1
             
+    def countIteratedRuns(self,iterator):
+        # the number of runs getIteratedRuns will generate, without generating them:
+        # the product of the 'repeat' variable at each (non-blank) level
+        if not iterator.getMyRun():
+            return 0
+        total = 1
+        level = iterator
+        while level.getClassName() == 'MikenetIterator':
+            var_index = level.getValueOf('varying')
+            var_name = level.getParameter('varying').dropdown_options[var_index]
+            if var_name != '':
+                total *= level.getValueOf('repeat')
+            level = level.getChildren()[0]
+        return total
             
     def getIteratedRuns(self,iterator):
+        # generator. each run is only put together when it is asked for
+        #
         # if this iterator has no run nested inside it,
         # then don't waste your time processing it
         if not iterator.getMyRun():
-            return []
+            return
+        # imported here, data_structures imports this module (through tabs)
+        from data_structures import MikenetRunVariant
         
         #random.seed(iterator.getMyRun().getValueOf('seed'))
         
@@ -203,26 +347,23 @@ class ScriptThread(QtCore.QThread):
         # of any override values
         iter_overrides = product(*all_values)
 
-        # create the data structure to be returned
-        iterated_runs = []
-
+        # every iteration reads through to one private copy of the run, and only
+        # keeps its own name and override values
+        base_run = iterator.getMyRun().getCopy()
+        base_name = base_run.getValueOf('run_name')
         for run_count,o in enumerate(iter_overrides):
             print 'overrides',o
-            # first, make a copy the original run
-            iterated_runs.append(iterator.getMyRun().getCopy())
-            # change name to reflect iterator count
-            base_name = iterated_runs[-1].getValueOf('run_name')
-            iterated_runs[-1].getParameter('run_name').value = str(base_name+'_'+str(run_count+1))
+            # name reflects iterator count
+            run = MikenetRunVariant(base_run,str(base_name+'_'+str(run_count+1)))
             # next, add overrides
             for i,v in enumerate(all_variables):
                 print 'iteratating over',v
                 if v == 'Number of hidden units':
-                    iterated_runs[-1].overrideParameter(v,(iterator.varying_parameter.value,o[i]),all_applied_paths[i])
+                    run.overrideParameter(v,(iterator.varying_parameter.value,o[i]),all_applied_paths[i])
                 else:
                     print o[i]
-                    iterated_runs[-1].overrideParameter(v,o[i],all_applied_paths[i])
-        
-        return iterated_runs
+                    run.overrideParameter(v,o[i],all_applied_paths[i])
+            yield run
 
         
     def available_cpu_count(self):
@@ -0,0 +1,268 @@
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+..................................................................
+The query_planner module turns a data_extractor request (variables and
+constraints) into one select over the tables db_utils creates.
+
+Only as few tables as it takes to cover the request are joined. Each is
+joined on its keys (db_utils.PHASE_ITEM_KEY and friends), not on every
+column name it happens to share with the others. Each constraint term is
+attached to the table whose columns it tests. A variable can be written
+as table.column to say which table it should come from.
+'''
+import re
+import itertools
+import db_utils
+
+# preferred tables for a column found in several, best first. per test
+# tables come after these, in name order
+TABLE_ORDER = ['metadata','errordata','noisedata','groupdata']
+# keys to join a table on, tried in this order
+JOIN_KEYS = [db_utils.PHASE_ITEM_KEY,db_utils.TRIAL_KEY,db_utils.RUN_KEY]
+
+# constraint tokens: quoted strings, names (maybe table.column), blanks, and
+# anything else a character at a time
+TOKEN = re.compile(r'"[^"]*"|\'[^\']*\'|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?|\s+|.')
+NAME = re.compile(r'[A-Za-z_]')
+
+def splitName(name):
+    # 'table.column' -> ('table','column'), 'column' -> (None,'column')
+    if '.' in name:
+        table,column = name.split('.',1)
+        return table,column
+    return None,name
+
+def findUnknown(varDict,names):
+    # the names (column or table.column) that are not in the database
+    unknown = []
+    for name in names:
+        table,column = splitName(name)
+        if column not in varDict or (table and table not in varDict[column][1]):
+            unknown.append(name)
+    return unknown
+
+def getTables(varDict):
+    # table -> set of its columns, for the tables that hold results
+    tables = {}
+    for column,(ftype,tnames) in varDict.items():
+        for t in tnames:
+            if t not in db_utils.INTERNAL_TABLES:
+                tables.setdefault(t,set()).add(column)
+    return tables
+
+def tableRank(table):
+    if table in TABLE_ORDER:
+        return (TABLE_ORDER.index(table),table)
+    return (len(TABLE_ORDER),table)
+
+def splitConstraints(usrConst):
+    # the terms of usrConst that are and-ed together at the top level, as
+    # lists of tokens. with an "or" at the top level it is all one term
+    tokens = TOKEN.findall(usrConst)
+    terms = [[]]
+    depth = 0
+    between = False
+    for tok in tokens:
+        word = tok.lower()
+        if tok == '(':
+            depth += 1
+        elif tok == ')':
+            depth -= 1
+        elif depth == 0 and word == 'or':
+            return [tokens]
+        elif depth == 0 and word == 'between':
+            between = True
+        elif depth == 0 and word == 'and':
+            # the "and" in "between x and y" does not end a term
+            if between:
+                between = False
+            else:
+                terms.append([])
+                continue
+        terms[-1].append(tok)
+    return [t for t in terms if ''.join(t).strip()]
+
+def termNames(varDict,term):
+    # the column references in a term
+    return [tok for tok in term if NAME.match(tok) and splitName(tok)[1] in varDict]
+
+def planQuery(varDict,usrVars,usrConst):
+    # returns a QueryPlan, or raises ValueError if the request cannot be
+    # answered from the tables in varDict
+    tables = getTables(varDict)
+    terms = splitConstraints(usrConst) if usrConst else []
+    names = list(usrVars)
+    for term in terms:
+        names += termNames(varDict,term)
+    unknown = findUnknown(varDict,names)
+    if unknown:
+        raise ValueError(','.join(unknown) + ' not found in database')
+
+    # tables named outright, and columns any table may provide
+    forced = set()
+    needed = set()
+    for name in names:
+        table,column = splitName(name)
+        if table:
+            forced.add(table)
+        else:
+            needed.add(column)
+    missing = [t for t in forced if t not in tables]
+    if missing:
+        raise ValueError(','.join(missing) + ' not found in database')
+
+    # the fewest tables that have every column. combinations come out in
+    # TABLE_ORDER, so ties go to the preferred tables
+    candidates = sorted([t for t in tables if t in forced or tables[t] & needed],key=tableRank)
+    chosen = None
+    for size in range(1,len(candidates)+1):
+        for combo in itertools.combinations(candidates,size):
+            covered = set()
+            for t in combo:
+                covered |= tables[t]
+            if forced.issubset(combo) and needed.issubset(covered):
+                chosen = list(combo)
+                break
+        if chosen:
+            break
+    if not chosen:
+        raise ValueError('no tables cover ' + ','.join(sorted(needed)))
+
+    plan = QueryPlan(usrVars)
+    plan.tables = chosen
+    for name in names:
+        table,column = splitName(name)
+        if not table:
+            table = [t for t in chosen if column in tables[t]][0]
+        plan.columns[name] = (table,column)
+        plan.others[name] = [t for t in candidates if t != table and column in tables[t]]
+
+    # join every table after the first to one before it, on the most
+    # specific key they share
+    for i,t in enumerate(chosen[1:]):
+        for key in JOIN_KEYS:
+            to = [p for p in chosen[:i+1] if set(key).issubset(tables[t] & tables[p])]
+            if to:
+                plan.joins[t] = (to[0],key)
+                break
+        else:
+            raise ValueError('cannot join ' + t + ' to ' + ','.join(chosen[:i+1]))
+    # without a phase item table, metadata is cut down to one row per run, or
+    # each run's rows would be repeated for every one of its phase items
+    plan.distinct = ('metadata' in chosen and len(chosen) > 1 and
+                     not [t for t in chosen if t != 'metadata' and 'id' in tables[t]])
+
+    # terms on one table's columns go with that table
+    for term in terms:
+        term_tables = set([plan.columns[name][0] for name in termNames(varDict,term)])
+        if len(term_tables) == 1:
+            plan.filters.setdefault(term_tables.pop(),[]).append(term)
+        else:
+            plan.where.append(term)
+    return plan
+
+class QueryPlan():
+    def __init__(self,variables):
+        self.variables = list(variables)
+        self.tables = []        # tables joined, in join order
+        self.columns = {}       # name -> (table,column) it is read from
+        self.others = {}        # name -> other tables that have it
+        self.joins = {}         # table -> (table it joins to,key columns)
+        self.filters = {}       # table -> terms on that table's columns only
+        self.where = []         # terms across tables
+        self.distinct = False   # metadata cut down to one row per run
+
+    def qualify(self,name,escape):
+        table,column = self.columns[name]
+        return table + '.' + escape(column)
+
+    def renderTerm(self,term,escape):
+        # runs of blanks become one space, so the same constraint typed two
+        # ways gives the same sql
+        text = ''.join([self.qualify(tok,escape) if tok in self.columns else
+                        ' ' if tok.isspace() else tok for tok in term]).strip()
+        if [tok for tok in term if tok.lower() == 'or']:
+            return '(' + text + ')'
+        return text
+
+    def renderTable(self,table,escape):
+        if table != 'metadata' or not self.distinct:
+            return table
+        columns = set(db_utils.RUN_KEY)
+        for name,(t,column) in self.columns.items():
+            if t == 'metadata':
+                columns.add(column)
+        sql = 'select distinct ' + ','.join([escape(c) for c in sorted(columns)]) + ' from metadata'
+        if table in self.filters:
+            sql += ' where ' + ' and '.join([self.renderTerm(x,escape) for x in self.filters[table]])
+        return '(' + sql + ') metadata'
+
+    def tableFilters(self,table,escape):
+        # filters on the distinct metadata are applied inside it
+        if table == 'metadata' and self.distinct:
+            return []
+        return [self.renderTerm(x,escape) for x in self.filters.get(table,[])]
+
+    def getQueryString(self,escape=None):
+        # escape(column) quotes column names for the driver (db_utils.escapeField)
+        if not escape:
+            escape = lambda x: x
+        first = self.tables[0]
+        queryString = 'select ' +\
+                      ','.join([self.qualify(v,escape) for v in self.variables]) +\
+                      ' from ' + self.renderTable(first,escape)
+        for t in self.tables[1:]:
+            to,key = self.joins[t]
+            on = [t + '.' + escape(k) + ' = ' + to + '.' + escape(k) for k in key]
+            queryString += ' join ' + self.renderTable(t,escape) +\
+                           ' on ' + ' and '.join(on + self.tableFilters(t,escape))
+        where = self.tableFilters(first,escape) + [self.renderTerm(x,escape) for x in self.where]
+        if where:
+            queryString += ' where ' + ' and '.join(where)
+        queryString += ' order by ' + self.qualify(self.variables[0],escape)
+        queryString += ';'
+        return queryString
+
+    def explain(self,escape=None):
+        # a readable account of the plan, ending with the sql it makes
+        gap = ' '*4
+        lines = ['QUERY PLAN:','',gap + 'Tables:']
+        for t in self.tables:
+            if t in self.joins:
+                to,key = self.joins[t]
+                line = t + ' joined to ' + to + ' on ' + ','.join(key)
+            else:
+                line = t
+            if t == 'metadata' and self.distinct:
+                line += ' (one row per run)'
+            lines.append(2*gap + line)
+        lines += ['',gap + 'Variables:']
+        for name in self.variables + [x for x in sorted(self.columns) if x not in self.variables]:
+            line = name + ' from ' + self.columns[name][0]
+            if self.others[name]:
+                line += ' (also in ' + ','.join(self.others[name]) + ')'
+            lines.append(2*gap + line)
+        if self.filters or self.where:
+            lines += ['',gap + 'Constraints:']
+            for t in self.tables:
+                for term in self.filters.get(t,[]):
+                    lines.append(2*gap + 'on ' + t + ': ' + ''.join(term).strip())
+            for term in self.where:
+                lines.append(2*gap + 'after joining: ' + ''.join(term).strip())
+        lines += ['',gap + 'SQL:',2*gap + self.getQueryString(escape),'']
+        return '\n'.join(lines)
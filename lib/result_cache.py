@@ -0,0 +1,116 @@
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+..................................................................
+The result_cache module keeps columns extracted by data_extractor on disk,
+so the same extraction run again does not go back to the database.
+'''
+import os
+import glob
+import hashlib
+import threading
+import zipfile
+import numpy as np
+
+CACHE_SUFFIX = '.npz'
+# bump when the way columns are stored changes, so old files are not read
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 512*1024*1024
+
+def makeKey(*parts):
+    # a file name sized key for anything with a stable repr
+    return hashlib.sha1(repr((CACHE_VERSION,) + parts)).hexdigest()
+
+class ResultCache():
+    '''Extracted columns kept as .npz files, one per key, in directory.
+
+    Keys (see makeKey) should change whenever the results would, e.g. with
+    the query and a marker of what the database holds. Reading a file marks
+    it as recently used, and once the files add up to more than max_bytes
+    the least recently used ones are deleted.
+    '''
+    def __init__(self,directory,max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def getPath(self,key):
+        return os.path.join(self.directory,key+CACHE_SUFFIX)
+
+    def get(self,key):
+        # the list of columns stored under key, or None
+        path = self.getPath(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            data = np.load(path)
+            try:
+                names = sorted(data.files,key=lambda x: int(x[1:]))
+                columns = [data[x] for x in names]
+            finally:
+                data.close()
+            # mark as recently used
+            os.utime(path,None)
+        except (IOError,OSError,ValueError,KeyError,zipfile.BadZipfile):
+            return None
+        # text columns are stored as fixed width strings (see put)
+        return [c.astype(np.object) if c.dtype.kind == 'S' else c for c in columns]
+
+    def put(self,key,columns):
+        # stores columns under key. the cache is only a cache, so failing to
+        # write it is not an error
+        try:
+            columns = [c.astype(str) if c.dtype == np.object else c for c in columns]
+        except ValueError:
+            # text numpy cannot store as plain strings
+            return
+        if sum([c.nbytes for c in columns]) > self.max_bytes:
+            return
+        path = self.getPath(key)
+        tmp_path = path + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp_path,'wb') as f:
+                np.savez(f,**dict([('c'+str(i),c) for i,c in enumerate(columns)]))
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path,path)
+        except (IOError,OSError,ValueError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        # deletes the least recently used files until the rest fit in max_bytes
+        files = []
+        for path in glob.glob(os.path.join(self.directory,'*'+CACHE_SUFFIX)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime,st.st_size,path))
+        files.sort()
+        total = sum([size for mtime,size,path in files])
+        for mtime,size,path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
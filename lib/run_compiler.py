@@ -8,41 +8,57 @@ import sys, traceback
 import time
 import dialogs
 import glob
+import hashlib
+import mikenet_binding
+import example_io
 
-def compileRun(run,mainDir):
+def compileRun(run,mainDir,ingester=None):
+    # generate, build and execute a run in one go
+    job = prepareRun(run,mainDir)
+    if not job:
+        return 0
+    return executeRun(job,ingester)
+
+def prepareRun(run,mainDir):
+    # first half of compileRun: generate the code for a run and build it. returns
+    # a job (dict) to hand to executeRun, or None if the run could not be built.
+    # keeping the two halves apart lets the script thread compile upcoming runs
+    # while others are still training
     script_name = run.getGUI().getScript().getValueOf('script_name')
     run_name = run.getValueOf('run_name')
 
-    # run path
+    # run path. everything below works on absolute paths and never changes the
+    # cwd, so several runs can be compiled and executed at once on threads
     runPath = os.path.join(script_name,run_name)
+    runDir = os.path.abspath(os.path.join(mainDir,"data",runPath))
     
     # try to make a new directory. returns an error if dir already exists
     # so if error is raised, delete the old and remake it
     try:
-        os.makedirs(os.path.join(mainDir,"data",runPath))
+        os.makedirs(runDir)
     except:
-        rmtree(os.path.join(mainDir,"data",runPath))
-        os.mkdir(os.path.join(mainDir,"data",runPath))
+        rmtree(runDir)
+        os.mkdir(runDir)
             
     # before building run, copy templates into the new directory. don't modify originals
-    copy(os.path.join(mainDir,"resources","template_code","mikenet_master.c"),
-         os.path.join(mainDir,"data",runPath))
-    copy(os.path.join(mainDir,"resources","template_code","build_model.c"),
-         os.path.join(mainDir,"data",runPath))
-    copy(os.path.join(mainDir,"resources","template_code","build_model.h"),
-         os.path.join(mainDir,"data",runPath))
+    copy(os.path.join(mainDir,"resources","template_code","mikenet_master.c"),runDir)
+    copy(os.path.join(mainDir,"resources","template_code","build_model.c"),runDir)
+    copy(os.path.join(mainDir,"resources","template_code","build_model.h"),runDir)
     # using make or scons?
     if run.getGUI().parameters['build_method'].value == 0:
         # scons
-        copy(os.path.join(mainDir,"resources","template_code","SConstruct"),
-             os.path.join(mainDir,"data",runPath))
+        copy(os.path.join(mainDir,"resources","template_code","SConstruct"),runDir)
     else:
         # make
-        copy(os.path.join(mainDir,"resources","template_code","Makefile"),
-             os.path.join(mainDir,"data",runPath))
-            
-    # switch to the newly created directory
-    os.chdir(os.path.join(mainDir,'data',runPath))
+        copy(os.path.join(mainDir,"resources","template_code","Makefile"),runDir)
+
+
+    # in runtime parameter mode, values that iterators sweep over are collected here
+    # and written to a parameter file instead of being compiled into the binary
+    if useRuntimeParameters(run.getGUI()):
+        params = []
+    else:
+        params = None
 
     # scan through our copy of the build_model.c
     #
@@ -50,46 +66,43 @@ def compileRun(run,mainDir):
     # each flag with a block of code. the code will define the following:
     #    includes, network architecture, phase structure, training and test set parameters
     
-    with open('build_model.c','r') as build_file:
+    with open(os.path.join(runDir,'build_model.c'),'r') as build_file:
         build_lines = build_file.readlines()
         build_lines = [x.replace('\r','') for x in build_lines]
         # add test file path as an include at INCLUDE marker
         # this function also automatically copies the test file and all its includes
         # into the cwd
-        build_lines = handleIncludes(run,build_lines)
+        build_lines = handleIncludes(run,build_lines,runDir)
         if not build_lines:
             # there was a fatal error, quit
-            backToHomeDir()
-            return 0
+            return None
         
         # replace CONSTANTS marker with actual code
-        build_lines = writeConstants(run,build_lines)
+        build_lines = writeConstants(run,build_lines,params)
         if not build_lines:
             # there was a fatal error, quit
-            backToHomeDir()
-            return 0
+            return None
         
-        # replace BUILD_TESTS marker with actual code
-        build_lines = writeTests(run,build_lines)
+        # replace BUILD_TESTS marker with actual code. this also loads every example
+        # file the run uses, once, for the test sets and phase items to share
+        example_sets = getExampleSets(run)
+        build_lines = writeTests(run,build_lines,example_sets)
         if not build_lines:
             # there was a fatal error, quit
-            backToHomeDir()
-            return 0
+            return None
         
         # replace BUILD_MAIN_NET marker with actual code
         # also get connection maps for building phase item nets
-        build_lines, conn_map, bias_conn_map = writeNetBuild(run,build_lines)
+        build_lines, conn_map, bias_conn_map = writeNetBuild(run,build_lines,params)
         if not build_lines:
             # there was a fatal error, quit
-            backToHomeDir()
-            return 0
+            return None
 
         # replace BUILD_PHASES marker with actual code
         build_lines = writePhases(run,build_lines)
         if not build_lines:
             # there was a fatal error, quit
-            backToHomeDir()
-            return 0
+            return None
             
         # now for the training parameters...
         # replace the BUILD_PHASE_ITEMS flag...
@@ -98,16 +111,16 @@ def compileRun(run,mainDir):
                   if 'INSERT_FLAG_BUILD_PHASE_ITEMS' in x]
         if not marker:
             print 'ERROR: No BUILD_PHASE_ITEMS flag found in template build_model.c file. Aborting run.'
-            return 0
+            return None
         # create the text_block to be inserted at build_lines[marker[0]]
         text_block = ''
         phase_count = 0
         phase_item_count = 0
         for phase in run.getChildren():
             for phase_item in phase.getChildren():
-                text_block += writePhaseItem(phase_item,phase_count,
+                text_block += writePhaseItem(run,phase_item,phase_count,
                                                      phase_item_count,conn_map,
-                                                     bias_conn_map)
+                                                     bias_conn_map,example_sets,params)
                 phase_item_count += 1
                 text_block += '\n'
             phase_count += 1
@@ -119,9 +132,16 @@ def compileRun(run,mainDir):
         # replace marker line with actual variables
         build_lines[marker[0]] = text_block
         
-    with open('build_model.c','w') as build_file:
+    with open(os.path.join(runDir,'build_model.c'),'w') as build_file:
         for line in build_lines:
             build_file.write(line)
+
+    run_args = [run_name]
+    if params is not None:
+        with open(os.path.join(runDir,run_name + '.params'),'w') as param_file:
+            for line in params:
+                param_file.write(line + '\n')
+        run_args.append(run_name + '.params')
             
     # before compiling, create a metadata file and put the top header info there
     # we're going to fill this file up with all parameters involved...it will go into
@@ -129,7 +149,7 @@ def compileRun(run,mainDir):
     # the metadata file for clues
     t_struct = time.localtime(time.time())
     start_date_str = str(t_struct[1])+'-'+str(t_struct[2])+'-'+str(t_struct[0])
-    with open(run_name + '.metadata','w') as meta:
+    with open(os.path.join(runDir,run_name + '.metadata'),'w') as meta:
         # write parameters in a table format that will be loaded into the database later
         for ph in run.getChildren():
             for ph_item in ph.getChildren():
@@ -149,7 +169,7 @@ def compileRun(run,mainDir):
                     meta.write('weight_range=' + str(run.getValueOf('weight_range')) + '\t')
                 
                 meta.write('phase_item=' + ph_item.getValueOf('item_name') + '\t')
-                for pip in ph_item.getPrintableParameters('','\t'):
+                for pip in ph_item.getPrintableParameters('','\t',run):
                     meta.write(pip)
                 meta.write('\n')
                 # start a new line and write network components
@@ -169,28 +189,108 @@ def compileRun(run,mainDir):
                                 g['error_computation_type'] + '\t')
                     meta.write('\n')
     
-    # build it
-    # using make or scons?
-    if run.getGUI().parameters['build_method'].value == 0:
-        # scons
-        subprocess.call('scons',shell=True)
+    # compile the example files (once per file, see example_io) so that mikenet
+    # can map them into memory instead of parsing the text in every run
+    compileExampleSets(run,runDir)
+
+    job = {'run':run,'run_name':run_name,'run_args':run_args,
+           'runDir':runDir,'mainDir':mainDir,'in_process':False}
+    if useInProcessBackend(run.getGUI()) and mikenet_binding.canRunInProcess(run):
+        # nothing to build. the model is put together and trained in executeRun,
+        # through the shared mikenet library
+        job['in_process'] = True
+    elif not buildRun(run,runDir,mainDir):
+        return None
+    return job
+
+def executeRun(job,ingester=None):
+    # second half of compileRun: train a prepared run, push its data and package it.
+    # with an ingester (db_utils.RunIngester) the data is pushed, and the run
+    # packaged, on the ingester's thread, so this returns as soon as training is done
+    run = job['run']
+    run_name = job['run_name']
+    runDir = job['runDir']
+    if job['in_process']:
+        if not mikenet_binding.runInProcess(run,runDir,os.path.join(runDir,run_name + '.log')):
+            print 'ERROR: Run failed in the in-process backend.'
+            return 0
+        # mark the run as finished, like the compiled driver does
+        open(os.path.join(runDir,'db_flag'),'w').close()
     else:
-        # make
-        subprocess.call('make mikenet_master',shell=True)
-    
-    # see if the build was successful
-    if not os.path.isfile('mikenet_master.exe') and not os.path.isfile('mikenet_master'):
-        print 'ERROR: Compiler encountered errors. Run was not built successfully.'
-        return 0
+        runExecutable(run_name,job['run_args'],runDir)
+
+    # update database if one is specified
+    if run.getGUI().parameters['use_database'].value == 1:
+        if ingester:
+            ingester.submit(runDir,lambda path: packageRun(path,run_name))
+            return 1
+        db_utils.pushRunData(runDir,run.getGUI())
+
+    packageRun(runDir,run_name)
+    return 1
+
+def packageRun(runDir,run_name):
+    # finally, zip all big files 
+    for ex in ['*.activations','*.test','*.weights']:
+    	for zipthis in glob.iglob(os.path.join(runDir,ex)):
+        	f_in = open(zipthis,'rb')
+        	f_out = gzip.open((zipthis+'.gz'),'wb')
+        	f_out.writelines(f_in)
+        	f_out.close()
+        	f_in.close()
+        	# remove the old one
+        	os.remove(zipthis)
+        
+    # AND tar/gzip the run directory
+    with tarfile.open(runDir + '.tar.gz','w:gz') as tar:
+        tar.add(runDir,arcname=run_name)
+    rmtree(runDir)
+
+###################################################################################
+# The following functions are helper functions for the compileRun method
+
+def buildRun(run,runDir,mainDir):
+    # compile the generated code in runDir, unless an identical build is already
+    # sitting in the build cache. returns 1 if there is an executable to run
+    build_key = getBuildKey(run,runDir)
+    if not fetchCachedBuild(build_key,runDir,mainDir):
+        # the driver (mikenet_master.c) is the same for every run, so it is only compiled
+        # the first time and then linked from the build cache. that leaves just the
+        # generated build_model.c to compile for each run
+        driver_key = getDriverKey(run,runDir)
+        driver = fetchCachedDriver(driver_key,runDir,mainDir)
+        # using make or scons?
+        if run.getGUI().parameters['build_method'].value == 0:
+            # scons
+            if driver:
+                subprocess.call('scons driver=' + driver,shell=True,cwd=runDir)
+            else:
+                subprocess.call('scons',shell=True,cwd=runDir)
+        else:
+            # make
+            if driver:
+                subprocess.call('make mikenet_master DRIVER=' + driver,shell=True,cwd=runDir)
+            else:
+                subprocess.call('make mikenet_master',shell=True,cwd=runDir)
     
-    # run it
+        # see if the build was successful
+        if not getExecutableName(runDir):
+            print 'ERROR: Compiler encountered errors. Run was not built successfully.'
+            return 0
+        if not driver:
+            storeCachedDriver(driver_key,runDir,mainDir)
+        storeCachedBuild(build_key,runDir,mainDir)
+    return 1
+
+def runExecutable(run_name,run_args,runDir):
+    # run the built executable, logging its output to <run_name>.log
     if sys.platform == 'win32':
         # windows
-        process = subprocess.Popen(['mikenet_master'],
-                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process = subprocess.Popen([os.path.join(runDir,'mikenet_master.exe')] + run_args,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=runDir)
         stdout,stderr = process.communicate()
         
-        with open(str(run_name+'.log'),'w') as logFile:
+        with open(os.path.join(runDir,run_name + '.log'),'w') as logFile:
             logFile.writelines(stdout)
             if stderr:
                 logFile.write('*'*15+' stderr '+'*'*15+'\n')
@@ -198,52 +298,198 @@ def compileRun(run,mainDir):
     else:
         # unix flavored
         #subprocess.check_call(str("nohup nice -n9 ./mikenet_master > "+run_name+".log"),shell=True)
-        process = subprocess.Popen(['nohup','nice','-n9','time','./mikenet_master','&'],
-                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process = subprocess.Popen(['nohup','nice','-n9','time','./mikenet_master'] + run_args,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=runDir)
         stdout,stderr = process.communicate()
         
-        with open(str(run_name+'.log'),'w') as logFile:
+        with open(os.path.join(runDir,run_name + '.log'),'w') as logFile:
             logFile.writelines(stdout)
             if stderr:
                 logFile.write('*'*15+' stderr '+'*'*15+'\n')
                 logFile.writelines(stderr)
-                
-    # update database if one is specified
-    if run.getGUI().parameters['use_database'] == 1:
-        print 'Database gonna get made'
-        db_utils.pushRunData(os.path.join(mainDir,'data',runPath),run.getGUI())
-    
-    # finally, zip all big files 
-    for ex in ['*.activations','*.test','*.weights']:
-    	for zipthis in glob.iglob(ex):
-        	f_in = open(zipthis,'rb')
-        	f_out = gzip.open((zipthis+'.gz'),'wb')
-        	f_out.writelines(f_in)
-        	f_out.close()
-        	f_in.close()
-        	# remove the old one
-        	os.remove(zipthis)
-        
-    # AND tar/gzip the run directory
-    os.chdir(os.pardir)
-    with tarfile.open((run_name + '.tar.gz'),'w:gz') as tar:
-        tar.add(run_name)
-    rmtree(os.path.join(mainDir,"data",runPath))
-    os.chdir(os.pardir)
-    os.chdir(os.pardir)
-   
     return 1
 
-###################################################################################
-# The following functions are helper functions for the compileRun method
+def useInProcessBackend(gui):
+    # older preference files may not have this setting
+    if 'in_process_backend' not in gui.parameters:
+        return False
+    return gui.parameters['in_process_backend'].value == 1
+
+def useRuntimeParameters(gui):
+    # older preference files may not have this setting
+    if 'runtime_parameters' not in gui.parameters:
+        return False
+    return gui.parameters['runtime_parameters'].value == 1
+
+def getExamplePaths(run):
+    # every distinct example file a run loads, in the order build_model.c loads them
+    paths = [str(p.getValueOf('example_path')) for p in
+             run.getGUI().getScript().getTestProfiles().getChildren()]
+    for phase in run.getChildren():
+        for phase_item in phase.getChildren():
+            if phase_item.getMode() != 'TRAIN':
+                continue
+            paths += [str(val) for p,val in phase_item.getParameterValues(run)
+                      if p.variable_name == 'example_path']
+    unique = []
+    for path in paths:
+        if path not in unique:
+            unique.append(path)
+    return unique
+
+def getExampleSets(run):
+    # maps each example file of a run to the build_model.c variable holding it
+    return dict((path,'example_sets[' + str(i) + ']')
+                for i,path in enumerate(getExamplePaths(run)))
+
+def compileExampleSets(run,runDir):
+    units = dict((g['name'],int(g['units'])) for g in run.getGroups())
+    for path in getExamplePaths(run):
+        # the run executes in runDir, so that is where mikenet looks for
+        # relative paths (and their compiled copies)
+        path = os.path.join(runDir,path)
+        if not os.path.isfile(path) or example_io.isCompressed(path):
+            continue
+        summary,error = example_io.getStats(path)
+        if error:
+            # mikenet reads the text file instead, and reports the problem itself
+            print 'WARNING: Could not compile example file',path+':',error
+            continue
+        # catch examples that do not fit this run's groups before mikenet does
+        for spec in ['CLAMP','TARGET']:
+            for group,formats in sorted(summary[spec].items()):
+                if group not in units:
+                    print 'WARNING: Example file',path,'uses group "'+group+'", which run', \
+                          run.getValueOf('run_name'),'does not have'
+                    continue
+                counts = [x for x in formats.get('FULL',[]) if x != units[group]]
+                if counts:
+                    print 'WARNING: Example file',path,'has',spec,'FULL data for group "'+group+'"', \
+                          'with',counts,'units, but the group has',units[group]
 
-def backToHomeDir():
-    # these three lines get you back to the original working directory
-    os.chdir(os.pardir) 
-    os.chdir(os.pardir) 
-    os.chdir(os.pardir)
+def getExecutableName(runDir):
+    # returns the name of the built executable in runDir, or None if there isn't one
+    for name in ['mikenet_master.exe','mikenet_master']:
+        if os.path.isfile(os.path.join(runDir,name)):
+            return name
+    return None
+
+def getBuildCacheDir(mainDir):
+    return os.path.join(mainDir,'data','.build_cache')
+
+def getLocalIncludes(path,visited=None):
+    # collect a source file along with every local (quoted) include it pulls in,
+    # following includes recursively. system includes (<...>) are ignored
+    if visited is None:
+        visited = []
+    path = os.path.abspath(path)
+    if path in visited or not os.path.isfile(path):
+        return visited
+    visited.append(path)
+    with open(path,'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#include') and '"' in line:
+                inc = line.split('"')[1]
+                getLocalIncludes(os.path.join(os.path.dirname(path),inc),visited)
+    return visited
+
+def getBuildKey(run,runDir):
+    # hash everything that goes into the compiled binary: the generated model code,
+    # the driver, the test include (and whatever it includes), the build file (which
+    # holds the compiler flags), the build method and the mikenet library itself.
+    # two runs with the same key produce byte-identical executables
+    sha = hashlib.sha1()
+    sha.update(sys.platform + '\0')
+    sha.update(str(run.getGUI().parameters['build_method'].value) + '\0')
+    sources = [os.path.join(runDir,x) for x in
+               ['build_model.c','build_model.h','mikenet_master.c','SConstruct','Makefile']]
+    sources += getLocalIncludes(os.path.join(runDir,'build_model.c'))
+    for src in sources:
+        if os.path.isfile(src):
+            with open(src,'rb') as f:
+                sha.update(os.path.basename(src) + '\0')
+                sha.update(f.read())
+    lib_path = os.path.join(run.getGUI().parameters['mikenet_path'].value,'lib','libmikenet.a')
+    if os.path.isfile(lib_path):
+        lib_stat = os.stat(lib_path)
+        sha.update(str(lib_stat.st_size) + '\0' + str(lib_stat.st_mtime) + '\0')
+    return sha.hexdigest()
+
+def getDriverKey(run,runDir):
+    # like getBuildKey, but only covers what goes into the driver object
+    sha = hashlib.sha1()
+    sha.update('driver\0' + sys.platform + '\0')
+    sha.update(str(run.getGUI().parameters['build_method'].value) + '\0')
+    for src in ['build_model.h','mikenet_master.c','SConstruct','Makefile']:
+        if os.path.isfile(os.path.join(runDir,src)):
+            with open(os.path.join(runDir,src),'rb') as f:
+                sha.update(src + '\0')
+                sha.update(f.read())
+    lib_path = os.path.join(run.getGUI().parameters['mikenet_path'].value,'lib','libmikenet.a')
+    if os.path.isfile(lib_path):
+        lib_stat = os.stat(lib_path)
+        sha.update(str(lib_stat.st_size) + '\0' + str(lib_stat.st_mtime) + '\0')
+    return sha.hexdigest()
+
+def fetchCachedDriver(driver_key,runDir,mainDir):
+    # copy a cached driver object into runDir. returns its file name, or None if
+    # the driver still has to be compiled
+    for ext in ['.o','.obj']:
+        cached = os.path.join(getBuildCacheDir(mainDir),'driver_' + driver_key + ext)
+        if os.path.isfile(cached):
+            try:
+                copy(cached,os.path.join(runDir,'mikenet_driver' + ext))
+            except (IOError,OSError):
+                return None
+            return 'mikenet_driver' + ext
+    return None
+
+def storeCachedDriver(driver_key,runDir,mainDir):
+    # add the freshly compiled driver object in runDir to the build cache
+    for ext in ['.o','.obj']:
+        if os.path.isfile(os.path.join(runDir,'mikenet_master' + ext)):
+            storeCacheFile(os.path.join(runDir,'mikenet_master' + ext),
+                           os.path.join(getBuildCacheDir(mainDir),'driver_' + driver_key + ext))
+            return
+
+def storeCacheFile(src,cached):
+    # the copy goes to a temp file first and is then renamed, so concurrent
+    # workers never see half a file
+    if os.path.isfile(cached):
+        return
+    try:
+        if not os.path.isdir(os.path.dirname(cached)):
+            os.makedirs(os.path.dirname(cached))
+        tmp = cached + '.' + str(os.getpid()) + '.tmp'
+        copy(src,tmp)
+        os.rename(tmp,cached)
+    except (IOError,OSError):
+        # the cache is only an optimization, never fail a run because of it
+        print 'WARNING: Could not add',src,'to the build cache.'
+
+def fetchCachedBuild(build_key,runDir,mainDir):
+    # copy a cached executable into runDir. returns 1 on a cache hit
+    cached = os.path.join(getBuildCacheDir(mainDir),build_key)
+    if not os.path.isfile(cached):
+        return 0
+    if sys.platform == 'win32':
+        exe_name = 'mikenet_master.exe'
+    else:
+        exe_name = 'mikenet_master'
+    try:
+        copy(cached,os.path.join(runDir,exe_name))
+    except (IOError,OSError):
+        return 0
+    print 'Reusing cached build',build_key
+    return 1
+
+def storeCachedBuild(build_key,runDir,mainDir):
+    # add the executable in runDir to the build cache
+    storeCacheFile(os.path.join(runDir,getExecutableName(runDir)),
+                   os.path.join(getBuildCacheDir(mainDir),build_key))
     
-def handleIncludes(run,build_lines):
+def handleIncludes(run,build_lines,runDir):
     marker = [i for i,x in enumerate(build_lines) 
               if 'INSERT_FLAG_INCLUDES' in x]
     if not marker:
@@ -266,7 +512,8 @@ def handleIncludes(run,build_lines):
     if len(func_path) > 1:
         print 'ERROR: Function path unresolvable. Use only one test path per script.'
         return None
-    if not os.path.isfile(func_path[0]):
+    # relative paths are resolved from the run directory, like the compiler does
+    if not os.path.isfile(os.path.join(runDir,func_path[0])):
         print 'ERROR: Cannot resolve path to',func_path[0]
         return None
     # we're all good...
@@ -277,7 +524,7 @@ def handleIncludes(run,build_lines):
     build_lines[marker[0]] = text_block
     return build_lines
     
-def writeConstants(run,build_lines):
+def writeConstants(run,build_lines,params=None):
     marker = [i for i,x in enumerate(build_lines) 
               if 'INSERT_FLAG_CONSTANTS' in x]
     if not marker:
@@ -306,23 +553,31 @@ def writeConstants(run,build_lines):
         seed_const = run.getRunOverrides()['Random seed']
     else:
         seed_const = run.getValueOf('seed')
-    text_block += ("#define SEED " +
-                         str(seed_const) + "\n")
+    if params is None:
+        text_block += ("#define SEED " +
+                             str(seed_const) + "\n")
+    else:
+        params.append('seed ' + str(seed_const))
     # is weight range overriden by iterator?
     if 'Weight range' in run.getRunOverrides():
         range_const = run.getRunOverrides()['Weight range']
     else:
         range_const = run.getValueOf('weight_range')
-    text_block += ("#define WEIGHT_RANGE " +
-                         str(range_const) + "\n")
-    text_block += ('char run_name[]="' + run.getValueOf('run_name') + '";\n')
+    if params is None:
+        text_block += ("#define WEIGHT_RANGE " +
+                             str(range_const) + "\n")
+    else:
+        params.append('weight_range ' + str(range_const))
+        # the driver fills these in from the parameter file before construct() is called
+        text_block += "#define RUNTIME_PARAMETERS 1\n"
+        text_block += "#define WEIGHT_RANGE run_weight_range\n"
 
     ##########################################################################   
     # replace marker line with actual variables
     build_lines[marker[0]] = text_block
     return build_lines
     
-def writeTests(run,build_lines):
+def writeTests(run,build_lines,example_sets):
     marker = [i for i,x in enumerate(build_lines) 
               if 'INSERT_FLAG_BUILD_TESTS' in x]
     if not marker:
@@ -330,6 +585,13 @@ def writeTests(run,build_lines):
         return None
     # create the text_block to be inserted at build_lines[marker[0]]
     text_block = ''
+    # load each example file once. staged training often reuses the same
+    # corpus in several phase items, and tests may use it too
+    if example_sets:
+        text_block += str('ExampleSet *example_sets[' + str(len(example_sets)) + '];\n')
+        for path in getExamplePaths(run):
+            text_block += str(example_sets[path] + '=load_examples("' + path + '",TIME);\n')
+        text_block += '\n'
     ##########################################################################
     for i,profile in enumerate(run.getGUI().getScript().getTestProfiles().getChildren()):
         # initialize and allocate memory
@@ -341,8 +603,8 @@ def writeTests(run,build_lines):
                                      str(len(name) + 1) + ');\n')
         text_block += str('test_sets[' + str(i) + ']->test_name="' + name + '";\n')
         # example set
-        text_block += str('test_sets[' + str(i) + ']->test_examples=load_examples("' +
-                          profile.getValueOf('example_path') + '",TIME);\n')
+        text_block += str('test_sets[' + str(i) + ']->test_examples=' +
+                          example_sets[str(profile.getValueOf('example_path'))] + ';\n')
         # args
         # have to split apart the args
         arg_list = profile.getValueOf('args').split()
@@ -364,7 +626,7 @@ def writeTests(run,build_lines):
     build_lines[marker[0]] = text_block
     return build_lines
 
-def writeNetBuild(run,build_lines):
+def writeNetBuild(run,build_lines,params=None):
     marker = [i for i,x in enumerate(build_lines) 
               if 'INSERT_FLAG_BUILD_MAIN_NET' in x]
     if not marker:
@@ -439,7 +701,11 @@ def writeNetBuild(run,build_lines):
         bias_val = run.getRunOverrides()['Bias value']
     else:
         bias_val = run.getValueOf('bias_value')
-    text_block += str('bias=init_bias(' + str(bias_val) + ',TIME);\n')
+    if params is None:
+        text_block += str('bias=init_bias(' + str(bias_val) + ',TIME);\n')
+    else:
+        params.append('bias_value ' + str(bias_val))
+        text_block += 'bias=init_bias(run_bias_value,TIME);\n'
     # bind groups to net
     text_block += '\n/* now add our groups to the run network object */ \n' 
     for i,g in enumerate(run.getGroups()):
@@ -478,12 +744,13 @@ def writeNetBuild(run,build_lines):
     build_lines[marker[0]] = text_block
     return build_lines, connection_map, bias_connection_map
 
-def writePhaseItem(phase_item,phase_index,item_index,conn_map,bias_conn_map):
+def writePhaseItem(run,phase_item,phase_index,item_index,conn_map,bias_conn_map,
+                   example_sets,params=None):
     text_block = ''
     text_block += str('/* phase item ' + str(item_index+1) + ': */ \n')
     # build subnetwork for this phase item
     # run groups for referencing group indices:
-    run_groups = [x['name'] for x in phase_item.parent.parent.getGroups()]
+    run_groups = [x['name'] for x in run.getGroups()]
     net_name = str('net' + str(item_index+1))
     
     text_block += str('Net *' + net_name + ';\n')
@@ -601,16 +868,134 @@ def writePhaseItem(phase_item,phase_index,item_index,conn_map,bias_conn_map):
     
     # noise parameters....
     #  first, activation noise
+    noise_data = getActivationNoise(run,phase_item)
+    text_block += str('phase_items[' + str(item_index) + ']->total_activation_noise=' + 
+                      str(len(noise_data)) + ';\n')
+    if len(noise_data) > 0:
+        # allocate memory for one array of values, and one of Groups
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->activation_noise_values=(Real *)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(Real));\n')
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->activation_noise_groups=(Group **)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(Group*));\n')
+        # activation noise will be applied somewhere
+        for counter,(k,v) in enumerate(noise_data):
+            text_block += str('phase_items[' + str(item_index) +
+                          ']->activation_noise_groups[' + str(counter) +
+                          ']=find_group_by_name("' + str(k) + '");\n')
+            if params is None:
+                text_block += str('phase_items[' + str(item_index) +
+                              ']->activation_noise_values[' + str(counter) +
+                              ']=' + str(v) + ';\n')
+            else:
+                params.append('activation_noise ' + str(item_index) + ' ' +
+                              str(counter) + ' ' + str(v))
+
+    # then input noise
+    noise_data = getInputNoise(run,phase_item)
+    text_block += str('phase_items[' + str(item_index) + ']->total_input_noise=' + 
+                      str(len(noise_data)) + ';\n')
+    if len(noise_data) > 0:
+        # allocate memory for one array of values, and one of Groups
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->input_noise_values=(Real *)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(Real));\n')
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->input_noise_groups=(Group **)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(Group*));\n')
+        # input noise will be applied somewhere
+        for counter,(k,v) in enumerate(noise_data):
+            text_block += str('phase_items[' + str(item_index) +
+                          ']->input_noise_groups[' + str(counter) +
+                          ']=find_group_by_name("' + str(k) + '");\n')
+            if params is None:
+                text_block += str('phase_items[' + str(item_index) +
+                              ']->input_noise_values[' + str(counter) +
+                              ']=' + str(v) + ';\n')
+            else:
+                params.append('input_noise ' + str(item_index) + ' ' +
+                              str(counter) + ' ' + str(v))
+                          
+    # finally, weight noise
+    noise_data = getWeightNoise(run,phase_item)
+    text_block += str('phase_items[' + str(item_index) + ']->total_weight_noise=' + 
+                      str(len(noise_data)) + ';\n')
+    if len(noise_data) > 0:
+        # allocate memory for one array of values, one of types, and one of Connections
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->weight_noise_values=(Real *)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(Real));\n')
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->weight_noise_connections=(Connections **)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(Connections*));\n')
+        text_block += str('phase_items[' + str(item_index) +
+                          ']->weight_noise_types=(int *)mh_calloc(' +
+                    str(len(noise_data)) + ',sizeof(int));\n')
+        # weight noise will be applied somewhere
+        for counter,(k,v) in enumerate(noise_data):
+            g_from,g_to = k.split('%')
+            from_i = run_groups.index(str(g_from))
+            to_i = run_groups.index(str(g_to))
+            c = conn_map[(from_i,to_i)]
+            text_block += str('phase_items[' + str(item_index) +
+                          ']->weight_noise_connections[' + str(counter) +
+                          ']=' + c + ';\n')
+            text_block += str('phase_items[' + str(item_index) +
+                          ']->weight_noise_types[' + str(counter) +
+                          ']=' + str(int(v[0])) + ';\n')
+            if params is None:
+                text_block += str('phase_items[' + str(item_index) +
+                              ']->weight_noise_values[' + str(counter) +
+                              ']=' + str(v[1]) + ';\n')
+            else:
+                params.append('weight_noise ' + str(item_index) + ' ' +
+                              str(counter) + ' ' + str(v[1]))
+    
+    # counters and error
+    text_block += str('phase_items[' + str(item_index) + ']->iter=0;\n')
+    text_block += str('phase_items[' + str(item_index) + ']->wcount=0;\n')
+    text_block += str('phase_items[' + str(item_index) + ']->ecount=0;\n')
+    text_block += str('phase_items[' + str(item_index) + ']->tcount=0;\n')
+    text_block += str('phase_items[' + str(item_index) + ']->ocount=0;\n')
+    text_block += str('phase_items[' + str(item_index) + ']->error=0.0;\n\n')
+    
+    
+    # now use the phase_item's 'get printable parameters' method to get the rest
+    prefix = 'phase_items[' + str(item_index) + ']->'
+    if params is None:
+        for processed_line in phase_item.getPrintableParameters(prefix,';\n',run,
+                                                                example_sets):
+            text_block += processed_line
+    else:
+        # only the training set is compiled in, the rest go to the parameter file
+        for p,val in phase_item.getParameterValues(run):
+            if p.variable_name == 'profile_name':
+                pass
+            elif p.variable_name == 'example_path':
+                if phase_item.getMode() == 'TRAIN':
+                    text_block += str(prefix + 'train_examples=' +
+                                      example_sets[str(val)] + ';\n')
+            else:
+                params.append('item ' + str(item_index) + ' ' +
+                              p.variable_name + ' ' + str(val))
+    
+    return text_block
+
+def getActivationNoise(run,phase_item):
+    # returns (group,value) pairs for every group that gets activation noise in this
+    # phase item. iterator overrides (read from run, which may be a MikenetRunVariant)
+    # take precedence over manually set values
     noise_data = [(k,v) for (k,v) in phase_item.getActivationNoiseData().iteritems() if
                   k in phase_item.getComponentGroups()]
     # also look in run overrides to see if you are iterating over noise values...these
     # take precendence over manually set noise values
-    iter_noise_data = [(x,y) for (x,y) in phase_item.parent.parent.getRunOverrides().iteritems()
+    iter_noise_data = [(x,y) for (x,y) in run.getRunOverrides().iteritems()
                        if 'Activation noise on' in x]
     iter_noise_data = [(x,y) for (x,y) in iter_noise_data if x[20:] in phase_item.getComponentGroups()]
     # make sure noise is actually overriden on THIS event
     for k,v in iter_noise_data:
-        aps = phase_item.parent.parent.override_paths[k]
+        aps = run.override_paths[k]
         if aps == 'ALL':
             # is this group already in noise_data?
             y = [i for i,x in enumerate(noise_data) if x[0] == k[20:]]
@@ -629,37 +1014,20 @@ def writePhaseItem(phase_item,phase_index,item_index,conn_map,bias_conn_map):
                     noise_data[y[0]] = (k[20:],v)
                 else:
                     noise_data.append((k[20:],v))
+    return noise_data
 
-    text_block += str('phase_items[' + str(item_index) + ']->total_activation_noise=' + 
-                      str(len(noise_data)) + ';\n')
-    if len(noise_data) > 0:
-        # allocate memory for one array of values, and one of Groups
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->activation_noise_values=(Real *)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(Real));\n')
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->activation_noise_groups=(Group **)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(Group*));\n')
-        # activation noise will be applied somewhere
-        for counter,(k,v) in enumerate(noise_data):
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->activation_noise_groups[' + str(counter) +
-                          ']=find_group_by_name("' + str(k) + '");\n')
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->activation_noise_values[' + str(counter) +
-                          ']=' + str(v) + ';\n')
-
-    # then input noise
+def getInputNoise(run,phase_item):
+    # same as getActivationNoise, for input noise
     noise_data = [(k,v) for (k,v) in phase_item.getInputNoiseData().iteritems() if
                   k in phase_item.getComponentGroups()]
     # also look in run overrides to see if you are iterating over noise values...these
     # take precendence over manually set noise values
-    iter_noise_data = [(x,y) for (x,y) in phase_item.parent.parent.getRunOverrides().iteritems()
+    iter_noise_data = [(x,y) for (x,y) in run.getRunOverrides().iteritems()
                        if 'Input noise on' in x]
     iter_noise_data = [(x,y) for (x,y) in iter_noise_data if x[15:] in phase_item.getComponentGroups()]
     # make sure noise is actually overriden on THIS event
     for k,v in iter_noise_data:
-        aps = phase_item.parent.parent.override_paths[k]
+        aps = run.override_paths[k]
         if aps == 'ALL':
             # is this group already in noise_data?
             y = [i for i,x in enumerate(noise_data) if x[0] == k[15:]]
@@ -678,41 +1046,25 @@ def writePhaseItem(phase_item,phase_index,item_index,conn_map,bias_conn_map):
                     noise_data[y[0]] = (k[15:],v)
                 else:
                     noise_data.append((k[15:],v))
-                    
-    text_block += str('phase_items[' + str(item_index) + ']->total_input_noise=' + 
-                      str(len(noise_data)) + ';\n')
-    if len(noise_data) > 0:
-        # allocate memory for one array of values, and one of Groups
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->input_noise_values=(Real *)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(Real));\n')
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->input_noise_groups=(Group **)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(Group*));\n')
-        # input noise will be applied somewhere
-        for counter,(k,v) in enumerate(noise_data):
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->input_noise_groups[' + str(counter) +
-                          ']=find_group_by_name("' + str(k) + '");\n')
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->input_noise_values[' + str(counter) +
-                          ']=' + str(v) + ';\n')
-                          
-    # finally, weight noise
+    return noise_data
+
+def getWeightNoise(run,phase_item):
+    # returns (connection,[type,value]) pairs, where type is 1 for additive and
+    # 2 for multiplicative noise
     noise_data = [(k,v) for (k,v) in phase_item.getWeightNoiseData().iteritems() if
                   k in phase_item.getComponentConnections()]
     # also look in run overrides to see if you are iterating over noise values...these
     # take precendence over manually set noise values
     
     # additive iterated noise
-    iter_noise_data = [(x,y) for (x,y) in phase_item.parent.parent.getRunOverrides().iteritems()
+    iter_noise_data = [(x,y) for (x,y) in run.getRunOverrides().iteritems()
                        if 'Weight noise (additive) on' in x]
     iter_noise_data = [(x,y) for (x,y) in iter_noise_data 
                        if x[27:].replace('->','%') in phase_item.getComponentConnections()]
 
     # make sure noise is actually overriden on THIS event
     for k,v in iter_noise_data:
-        aps = phase_item.parent.parent.override_paths[k]
+        aps = run.override_paths[k]
         if aps == 'ALL':
             # is this connection already in noise_data?
             y = [i for i,x in enumerate(noise_data) if x[0] == k[27:].replace('->','%')]
@@ -733,14 +1085,14 @@ def writePhaseItem(phase_item,phase_index,item_index,conn_map,bias_conn_map):
                     noise_data.append((k[27:].replace('->','%'),[1,v]))
                     
     # multiplicative iterated noise
-    iter_noise_data = [(x,y) for (x,y) in phase_item.parent.parent.getRunOverrides().iteritems()
+    iter_noise_data = [(x,y) for (x,y) in run.getRunOverrides().iteritems()
                        if 'Weight noise (multiplicative) on' in x]
     iter_noise_data = [(x,y) for (x,y) in iter_noise_data 
                        if x[33:].replace('->','%') in phase_item.getComponentConnections()]
 
     # make sure noise is actually overriden on THIS event
     for k,v in iter_noise_data:
-        aps = phase_item.parent.parent.override_paths[k]
+        aps = run.override_paths[k]
         if aps == 'ALL':
             # is this connection already in noise_data?
             y = [i for i,x in enumerate(noise_data) if x[0] == k[33:].replace('->','%')]
@@ -758,52 +1110,8 @@ def writePhaseItem(phase_item,phase_index,item_index,conn_map,bias_conn_map):
                 if y:
                     noise_data[y[0]] = (k[33:].replace('->','%'),[2,v])
                 else:
-                    noise_data.append((k[33:].replace('->','%'),[2,v]))                       
-                
-    text_block += str('phase_items[' + str(item_index) + ']->total_weight_noise=' + 
-                      str(len(noise_data)) + ';\n')
-    if len(noise_data) > 0:
-        # allocate memory for one array of values, one of types, and one of Connections
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->weight_noise_values=(Real *)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(Real));\n')
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->weight_noise_connections=(Connections **)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(Connections*));\n')
-        text_block += str('phase_items[' + str(item_index) +
-                          ']->weight_noise_types=(int *)mh_calloc(' +
-                    str(len(noise_data)) + ',sizeof(int));\n')
-        # weight noise will be applied somewhere
-        for counter,(k,v) in enumerate(noise_data):
-            g_from,g_to = k.split('%')
-            from_i = run_groups.index(str(g_from))
-            to_i = run_groups.index(str(g_to))
-            c = conn_map[(from_i,to_i)]
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->weight_noise_connections[' + str(counter) +
-                          ']=' + c + ';\n')
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->weight_noise_types[' + str(counter) +
-                          ']=' + str(int(v[0])) + ';\n')
-            text_block += str('phase_items[' + str(item_index) +
-                          ']->weight_noise_values[' + str(counter) +
-                          ']=' + str(v[1]) + ';\n')
-    
-    # counters and error
-    text_block += str('phase_items[' + str(item_index) + ']->iter=0;\n')
-    text_block += str('phase_items[' + str(item_index) + ']->wcount=0;\n')
-    text_block += str('phase_items[' + str(item_index) + ']->ecount=0;\n')
-    text_block += str('phase_items[' + str(item_index) + ']->tcount=0;\n')
-    text_block += str('phase_items[' + str(item_index) + ']->ocount=0;\n')
-    text_block += str('phase_items[' + str(item_index) + ']->error=0.0;\n\n')
-    
-    
-    # now use the phase_item's 'get printable parameters' method to get the rest
-    prefix = 'phase_items[' + str(item_index) + ']->'
-    for processed_line in phase_item.getPrintableParameters(prefix,';\n'):
-        text_block += processed_line
-    
-    return text_block
+                    noise_data.append((k[33:].replace('->','%'),[2,v]))
+    return noise_data
 
 def writePhases(run,build_lines):
     marker = [i for i,x in enumerate(build_lines) 
@@ -195,10 +195,18 @@ class ScriptTab(QtGui.QWidget):
         toc = time()
         self.prog.updateTotalProgress(complete,total,toc-self.tic)
         
+    @QtCore.Slot(str,int)
+    def updateLastRun(self,run_name,ret_code):
+        self.prog.updateLastRun(run_name,ret_code)
+
     @QtCore.Slot(int,int)
     def updateSuccessRatio(self,good,total):
         self.prog.updateSuccessRatio(good,total)        
 
+    @QtCore.Slot(str)
+    def updatePushFailed(self,run_name):
+        self.prog.updatePushFailed(run_name)
+
     def notifyScriptEnded(self):
         # gets activated after script runs and database is finished updating
         toc = time()
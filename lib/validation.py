@@ -0,0 +1,271 @@
+'''
+Copyright (C) 2013-2014 Robert Powers
+
+This file is part of MikeNetGUI.
+
+MikeNetGUI is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MikeNetGUI is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MikeNetGUI.  If not, see <http://www.gnu.org/licenses/>.
+..................................................................
+The validation module checks a script for problems before it is run.
+
+It is shared by the GUI (dialogs.ScanningThread) and the command line
+(cli.py). The script tree is walked once. Example files are scanned at
+most once per path and modification time, even when many phase items
+point at the same file. Different files are scanned in parallel, by a
+pool of at most one worker per cpu.
+'''
+import os
+import threading
+import multiprocessing
+import multiprocessing.pool
+import example_io
+
+# path -> (mtime,size,issues) of every example file scanned so far
+scan_cache = {}
+scan_lock = threading.Lock()
+
+def validateScript(script,mikenet_dir):
+    # returns a list of issues (strings), without duplicates, in the order found
+    issues = []
+    # (prefix,path) for every example file that has to be scanned
+    example_checks = []
+
+    # check to make sure Mikenet is built and exists
+    if not os.path.isdir(mikenet_dir):
+        issues.append('-ERROR: Mikenet directory does not exist. Try running resources/mikenet_installer.py.')
+    if not os.path.isfile(os.path.join(mikenet_dir,'lib','libmikenet.a')):
+        issues.append('-ERROR: Mikenet does not appear to be built. Run resources/mikenet_installer.py to rebuild.')
+
+    scanNode(script,issues,example_checks)
+    # also check the training and test profiles
+    for p in script.getTrainingProfiles().getChildren():
+        example_checks.append((str('-In training set '+p.getValueOf('profile_name')+', '),
+                               p.getValueOf('example_path')))
+    for p in script.getTestProfiles().getChildren():
+        example_checks.append((str('-In test set '+p.getValueOf('profile_name')+', '),
+                               p.getValueOf('example_path')))
+
+    scans = scanExampleFiles([path for prefix,path in example_checks])
+    for prefix,path in example_checks:
+        issues += [prefix+x for x in scans[path]]
+
+    unique = []
+    seen = set()
+    for x in issues:
+        if x not in seen:
+            seen.add(x)
+            unique.append(x)
+    return unique
+
+def scanNode(node,issues,example_checks):
+    # checks the children of node (and everything below them). issues are
+    # appended to issues, example files to scan to example_checks
+    for child in node.getChildren():
+        # go through the different cases
+        if child.getClassName() == 'MikenetIterator':
+            name = child.getValueOf('iterator_name')
+            # does the iterator have a run?
+            if not child.getMyRun():
+                issues.append('-ERROR: Iterator '+name+' has not been associated with a run object.')
+            # does it have a valid parameter?
+            if child.getParameter('varying').dropdown_options[child.getValueOf('varying')] in ['','None']:
+                issues.append('-ERROR: Iterator '+name+' does not seem to be defined on a valid parameter.')
+
+        elif child.getClassName() == 'MikenetRun':
+            name = child.getValueOf('run_name')
+            # do any group names contain restricted characters?
+            gnames = [x['name'] for x in child.getGroups()]
+            y = [x for x in gnames if '%' in x]
+            if y:
+                issues.append('-ERROR: At least one group in run '+name+' contains a restricted character ("%").')
+            # are there any duplicate group names?
+            if len(gnames) != len(set(gnames)):
+                issues.append('-ERROR: Run '+name+' contains duplicate group names. Group names must be unique.')
+
+        elif child.getClassName() == 'MikenetPhase':
+            name = child.getValueOf('phase_name')
+            # if probabilistic, do phase items p values add up to 1?
+            if child.getValueOf('phase_order') == 1:
+                pValues = [float(x.getValueOf('probability')) for x in child.getChildren()]
+                pSum = sum(pValues)
+                tol = 0.001
+                if pSum < (1 - tol) or pSum > (1 + tol):
+                    issues.append('-ERROR: In run '+child.parent.getValueOf('run_name')+', phase '+name+
+                                  ', p values need to add to 1 for probabilistic interleaving.')
+            # is phase empty?
+            if not child.getChildren():
+                issues.append('-ERROR: Run '+child.parent.getValueOf('run_name')+', phase '+name+
+                              ' has no training or test items defined.')
+
+        elif child.getClassName() == 'MikenetPhaseItem':
+            name = child.getValueOf('item_name')
+            # are the network componenets empty?
+            if len(child.net_components['groups']) == 0 and len(child.net_components['connections']) == 0:
+                issues.append('-ERROR: Phase item '+name+' includes no network components.')
+            # check path only if this phase item overrides the training set path
+            path = [x.value for x in child.overrides if x.variable_name == 'example_path']
+            if path:
+                if not os.path.isfile(path[0]):
+                    # path does not exist
+                    issues.append('-ERROR: Phase item '+name+' attempts to override example set with unresolvable path: '+
+                                  str(path[0]))
+                    issues.append('        ')
+                else:
+                    # path exists, so scan file and attempt to find issues
+                    example_checks.append((str('-In path override for item '+name+', '),path[0]))
+
+        # run one level deeper
+        scanNode(child,issues,example_checks)
+
+def scanExampleFiles(paths):
+    # returns {path: issues} for every distinct path. files that have not been
+    # scanned since they last changed are scanned in parallel. the pool is of
+    # threads: scanning compiles files (see example_io.ensureCompiled), which
+    # has to happen under this process's compile locks, and a forked worker
+    # could inherit a lock another thread (e.g. the previewer's) was holding
+    results = {}
+    stale = []
+    for path in set(paths):
+        issues = getCachedScan(path)
+        if issues is None:
+            stale.append(path)
+        else:
+            results[path] = issues
+    if len(stale) == 1:
+        results[stale[0]] = scanExampleFile(stale[0])
+    elif stale:
+        try:
+            workers = min(len(stale),multiprocessing.cpu_count())
+        except NotImplementedError:
+            workers = 1
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            scanned = pool.map(scanExampleFile,stale)
+        finally:
+            pool.close()
+            pool.join()
+        results.update(zip(stale,scanned))
+    return results
+
+def getCachedScan(path):
+    # issues from an earlier scan of path, or None if it changed since then
+    try:
+        st = os.stat(path)
+    except (IOError,OSError):
+        return None
+    with scan_lock:
+        if path in scan_cache and scan_cache[path][:2] == (st.st_mtime,st.st_size):
+            return scan_cache[path][2]
+    return None
+
+def rememberScan(path,st,issues):
+    # st is (mtime,size) of path when it was scanned, or None if it could not be
+    if st:
+        with scan_lock:
+            scan_cache[path] = (st[0],st[1],issues)
+
+def scanExampleFile(path):
+    # issues (without the "-In ..., " prefix) for one example file. remembered
+    # until the file changes
+    issues = getCachedScan(path)
+    if issues is not None:
+        return issues
+    st,issues = readExampleFile(path)
+    rememberScan(path,st,issues)
+    return issues
+
+def readExampleFile(path):
+    # scans path. returns ((mtime,size) of path,issues), or (None,issues) if
+    # it cannot be opened
+    try:
+        st = os.stat(path)
+    except (IOError,OSError):
+        return None,['cannot open example path: '+path]
+    # a file that compiles (see example_io) can only have unit mismatches, and
+    # its stats index lists them without reading the examples again
+    summary,error = example_io.getStats(path)
+    if summary:
+        issues = ['unit mismatch for '+spec+' FULL (group "'+str(group)+'": '+str(counts)+')'
+                  for spec,group,counts in example_io.getUnitMismatches(summary)]
+    else:
+        issues = scanExampleText(path)
+    return (st.st_mtime,st.st_size),issues
+
+def scanExampleText(path):
+    # reads the text of an example file that does not compile, to report what
+    # is wrong with it
+    issues = []
+    try:
+        with open(path,'r') as f:
+            lines = f.readlines()
+            # remove empty lines, ; lines, TAG and PROB lines
+            lines = [x for x in lines if x not in ['\n',';\n',';']]
+            lines = [x for x in lines if x[:3] != 'TAG']
+            lines = [x for x in lines if x[:4] != 'PROB']
+            # now there should only be CLAMP and TARGET data lines
+            # but not all lines will have 'CLAMP' or 'TARGET' explicitly, so
+            # find those (calling them pivot lines here)
+            pivots = [(i,x) for i,x in enumerate(lines)
+                      if 'CLAMP' in x or 'TARGET' in x]
+            # collect data about each clamp and each target
+            fullclamp_data = {} # key-group, value-num_units
+            fulltarget_data = {}
+
+            for pindex,(i,pline) in enumerate(pivots):
+                split_line = pline.split()
+                # check line formatting
+                # each pivot line should have 'CLAMP/TARGET group_name time_data FULL/SPARSE'
+                if len(split_line) < 4:
+                    issues.append('line format error in example file: '+path)
+                    # don't go any further
+                    return issues
+                # is time formatted correctly?
+                if split_line[2] != 'ALL':
+                    try:
+                        int(split_line[2])
+                    except ValueError:
+                        try:
+                            l,r = split_line[2].split('-')
+                            int(l)
+                            int(r)
+                        except ValueError:
+                            issues.append('incorrect time ticks format in example file: '+path)
+                # correctly uses FULL or SPARSE?
+                if split_line[3] not in ['FULL','SPARSE']:
+                    issues.append('line format error in example file: '+path)
+                    # don't go any further
+                    return issues
+                # now count units: the rest of the pivot line, and any lines up
+                # to the next pivot line
+                ucount = len(split_line[4:])
+                end = pivots[pindex+1][0] if (pindex+1) < len(pivots) else len(lines)
+                for line in lines[i+1:end]:
+                    ucount += len(line.split())
+
+                if split_line[3] == 'FULL':
+                    if 'CLAMP' == split_line[0]:
+                        fullclamp_data.setdefault(split_line[1],[]).append(ucount)
+                    elif 'TARGET' == split_line[0]:
+                        fulltarget_data.setdefault(split_line[1],[]).append(ucount)
+
+            for k in fullclamp_data:
+                if len(set(fullclamp_data[k])) > 1:
+                    issues.append('unit mismatch for CLAMP FULL (group "'+str(k)+
+                                  '": '+str(list(set(fullclamp_data[k])))+')')
+            for k in fulltarget_data:
+                if len(set(fulltarget_data[k])) > 1:
+                    issues.append('unit mismatch for TARGET FULL (group "'+str(k)+
+                                  '": '+str(list(set(fulltarget_data[k])))+')')
+    except IOError:
+        issues.append('cannot open example path: '+path)
+    return issues
@@ -4,4 +4,8 @@ typedef struct {
   int *histogram;
   char *name;
   int currentExample;
+  /* alias table for get_random_example, built by build_example_sampler.
+     kept at the end so older objects still agree on the layout above. */
+  Real *alias_prob;
+  int *alias_index;
 } ExampleSet;
@@ -44,6 +44,7 @@ typedef enum { CLAMP, TARGET} SpecificationType;
 ExampleSet * load_examples(char *fn,int maxtime);
 Example * get_sequential_example(ExampleSet *set);
 Example * get_random_example(ExampleSet *set);
+void build_example_sampler(ExampleSet *set);
 Example * create_example(int time);
 void free_example(Example *ex);
 
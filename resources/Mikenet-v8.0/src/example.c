@@ -33,6 +33,13 @@
 #include <string.h>
 #include <math.h>
 #include <stdlib.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#ifdef unix
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#endif
 #include "const.h"
 #include "net.h"
 #include "random.h"
@@ -133,22 +140,93 @@ Real get_value(ExampleData ***array,int group,int time,int unit)
 
 
 
+/* build the alias table (Vose's method) that get_random_example draws
+   from.  each example is picked with weight prob, clipped to [0,1], which
+   is the same distribution the old rejection loop produced, but a draw
+   now costs two random numbers no matter how small the probabilities are.
+   call this again after changing any example's prob by hand. */
+void build_example_sampler(ExampleSet *set)
+{
+  int i,s,l,n=set->numExamples;
+  int nsmall=0,nlarge=0;
+  int *small,*large;
+  double total=0.0,*scaled;
+
+  if (set->alias_prob)
+    free(set->alias_prob);
+  if (set->alias_index)
+    free(set->alias_index);
+  set->alias_prob=NULL;
+  set->alias_index=NULL;
+
+  scaled=(double *)mh_malloc(sizeof(double)*(n+1));
+  for(i=0;i<n;i++)
+    {
+      scaled[i]=set->examples[i].prob;
+      if (scaled[i] < 0.0)
+	scaled[i]=0.0;
+      else if (scaled[i] > 1.0)
+	scaled[i]=1.0;
+      total += scaled[i];
+    }
+  if (total <= 0.0)
+    {
+      /* nothing can be drawn; get_random_example complains if asked */
+      free(scaled);
+      return;
+    }
+
+  set->alias_prob=(Real *)mh_malloc(sizeof(Real)*n);
+  set->alias_index=(int *)mh_malloc(sizeof(int)*n);
+  small=(int *)mh_malloc(sizeof(int)*n);
+  large=(int *)mh_malloc(sizeof(int)*n);
+
+  for(i=0;i<n;i++)
+    {
+      scaled[i] = scaled[i] * (double)n / total;
+      set->alias_index[i]=i;
+      if (scaled[i] < 1.0)
+	small[nsmall++]=i;
+      else
+	large[nlarge++]=i;
+    }
+
+  while(nsmall > 0 && nlarge > 0)
+    {
+      s=small[--nsmall];
+      l=large[--nlarge];
+      set->alias_prob[s]=scaled[s];
+      set->alias_index[s]=l;
+      scaled[l] = (scaled[l] + scaled[s]) - 1.0;
+      if (scaled[l] < 1.0)
+	small[nsmall++]=l;
+      else
+	large[nlarge++]=l;
+    }
+  /* whatever is left over is 1 up to rounding */
+  while(nlarge > 0)
+    set->alias_prob[large[--nlarge]]=1.0;
+  while(nsmall > 0)
+    set->alias_prob[small[--nsmall]]=1.0;
+
+  free(small);
+  free(large);
+  free(scaled);
+}
+
 Example* get_random_example(set)
 ExampleSet *set;
 {
   int idx;
-  Real dice,prob;
-  while(1)
-    {
-      idx=(int)((mikenet_random() * (Real)set->numExamples));
-      prob=set->examples[idx].prob;
-      dice=mikenet_random();
-      if (dice < prob) 
-        {
-	  set->histogram[idx]++;
-	  return &set->examples[idx];
-        }
-    }
+  if (set->alias_prob==NULL)
+    Error1("No example in %s has a nonzero probability",set->name);
+  idx=(int)((mikenet_random() * (Real)set->numExamples));
+  if (idx >= set->numExamples)
+    idx=set->numExamples-1;
+  if (mikenet_random() >= set->alias_prob[idx])
+    idx=set->alias_index[idx];
+  set->histogram[idx]++;
+  return &set->examples[idx];
 }
 
 
@@ -336,6 +414,263 @@ void ex_read_spec(Example *ex,FILE *f,SpecificationType type,
 }
 
 
+/* compiled example sets.  MikeNetGUI (lib/example_io.py) compiles a text
+   example file "foo.ex" into "foo.ex.exb" next to it: a header, the group
+   names, one record per example and per CLAMP/TARGET block, then the raw
+   values.  load_examples uses it whenever it is newer than the text (same
+   size and mtime as recorded in its header, and written at least
+   RACY_SECONDS after that mtime, since edits closer together than that may
+   not move it), and maps it into memory so
+   unit values are never parsed or copied, and the pages are shared by every
+   run using the same file.  all fields are 4 byte aligned, and the block and
+   data sections 8 byte aligned (blocks hold a long long), little endian. */
+
+#define EXB_SUFFIX ".exb"
+#define EXB_VERSION 3
+#define RACY_SECONDS 1.0
+
+/* mtimes in seconds, with the fraction where stat has one, worked out the
+   way Python's os.stat does so they compare equal to the header's */
+#if defined(__APPLE__)
+#define MTIME_OF(s) ((double)(s).st_mtimespec.tv_sec + 1e-9*(s).st_mtimespec.tv_nsec)
+#elif defined(st_mtime)
+/* st_mtime is short for st_mtim.tv_sec where there is an st_mtim */
+#define MTIME_OF(s) ((double)(s).st_mtim.tv_sec + 1e-9*(s).st_mtim.tv_nsec)
+#else
+#define WHOLE_SECOND_MTIME
+#define MTIME_OF(s) ((double)(s).st_mtime)
+#endif
+
+typedef struct {
+  char magic[8];        /* "MNEXB" */
+  int version;
+  int numExamples;
+  int numGroups;
+  int numBlocks;
+  long long sourceSize;
+  double sourceMtime;
+  unsigned char sourceHash[20];
+  int pad;
+  long long groupsOffset;  /* int length, name, padded to 4 bytes */
+  long long examplesOffset;
+  long long blocksOffset;
+  long long dataOffset;
+  long long tagsOffset;
+} ExbHeader;
+
+typedef struct {
+  int firstBlock;
+  int numBlocks;
+  float prob;
+  int tagOffset;        /* into the tags, or -1 */
+  int hasProb;          /* only used by MikeNetGUI */
+} ExbExample;
+
+typedef struct {
+  int group;            /* index into the group names */
+  int spec;             /* CLAMP or TARGET */
+  int clampType;
+  int start;
+  int end;              /* -1 means the last tick */
+  int format;           /* EXPANDED_EXAMPLE or SPARSE_EXAMPLE */
+  int count;            /* values (full) or indices (sparse) */
+  float onvalue;         /* NaN: use default_exampleOnValue */
+  float offvalue;        /* NaN: use default_exampleOffValue */
+  int units;             /* only used by MikeNetGUI */
+  long long dataOffset;
+} ExbBlock;
+
+static int same_mtime(double recorded,struct stat *src)
+{
+#ifdef WHOLE_SECOND_MTIME
+  /* the header has the fraction, stat does not */
+  return floor(recorded)==MTIME_OF(*src);
+#else
+  return recorded==MTIME_OF(*src);
+#endif
+}
+
+static char *map_compiled_examples(char *fn,long long *size)
+{
+  char *exb_fn,*base=NULL;
+  struct stat src,exb;
+  ExbHeader *h;
+#ifdef unix
+  int fd;
+#else
+  FILE *f;
+#endif
+
+  if (stat(fn,&src)!=0)
+    return NULL;
+  exb_fn=(char *)mh_malloc(strlen(fn)+strlen(EXB_SUFFIX)+1);
+  sprintf(exb_fn,"%s%s",fn,EXB_SUFFIX);
+  if (stat(exb_fn,&exb)!=0 || exb.st_size < (long long)sizeof(ExbHeader))
+    {
+      free(exb_fn);
+      return NULL;
+    }
+  *size=exb.st_size;
+
+#ifdef unix
+  fd=open(exb_fn,O_RDONLY);
+  free(exb_fn);
+  if (fd < 0)
+    return NULL;
+  base=(char *)mmap(NULL,*size,PROT_READ,MAP_SHARED,fd,0);
+  close(fd);
+  if (base==(char *)MAP_FAILED)
+    return NULL;
+#else
+  f=fopen(exb_fn,"rb");
+  free(exb_fn);
+  if (f==NULL)
+    return NULL;
+  base=(char *)mh_malloc(*size);
+  if (fread(base,1,*size,f)!=*size)
+    {
+      fclose(f);
+      free(base);
+      return NULL;
+    }
+  fclose(f);
+#endif
+
+  h=(ExbHeader *)base;
+  if (memcmp(h->magic,"MNEXB",5)!=0 || h->version!=EXB_VERSION ||
+      h->sourceSize!=(long long)src.st_size ||
+      !same_mtime(h->sourceMtime,&src) ||
+      MTIME_OF(exb) - MTIME_OF(src) < RACY_SECONDS ||
+      h->tagsOffset > *size ||
+      h->examplesOffset + (long long)h->numExamples*sizeof(ExbExample) > *size ||
+      h->blocksOffset % 8 != 0 ||
+      h->blocksOffset + (long long)h->numBlocks*sizeof(ExbBlock) > *size)
+    {
+      /* stale or foreign: fall back to the text file */
+#ifdef unix
+      munmap(base,*size);
+#else
+      free(base);
+#endif
+      return NULL;
+    }
+  return base;
+}
+
+static ExampleSet *load_compiled_examples(char *fn,int maxt)
+{
+  char *base,*p;
+  long long size;
+  ExbHeader *h;
+  ExbExample *rec;
+  ExbBlock *blocks,*b;
+  Group **groups;
+  Example *examples,*ex;
+  ExampleData *edata,**times;
+  ExampleData ***pointers,***table;
+  ExampleSet *set;
+  int i,j,t,len,end_t;
+
+  if (sizeof(Real)!=sizeof(float))
+    return NULL;
+  base=map_compiled_examples(fn,&size);
+  if (base==NULL)
+    return NULL;
+  h=(ExbHeader *)base;
+
+  /* look up the groups once, not once per block */
+  groups=(Group **)mh_calloc(h->numGroups+1,sizeof(Group *));
+  p=base+h->groupsOffset;
+  for(i=0;i<h->numGroups;i++)
+    {
+      len=*(int *)p;
+      groups[i]=find_group_by_name(p+sizeof(int));
+      if (groups[i]==NULL)
+	Error1("load_examples: group %s not found\n",p+sizeof(int));
+      p += sizeof(int) + ((len+1+3) & ~3);
+    }
+
+  examples=(Example *)mh_calloc(sizeof(Example),h->numExamples+1);
+  edata=(ExampleData *)mh_calloc(sizeof(ExampleData),h->numBlocks+1);
+  /* every block starts at most one new row of time slices */
+  pointers=(ExampleData ***)mh_calloc(sizeof(ExampleData **),
+				      2*h->numExamples*globalNumGroups+1);
+  times=(ExampleData **)mh_calloc(sizeof(ExampleData *),
+				  h->numBlocks*maxt+1);
+  rec=(ExbExample *)(base+h->examplesOffset);
+  blocks=(ExbBlock *)(base+h->blocksOffset);
+
+  for(count=0;count<h->numExamples;count++)
+    {
+      ex=&examples[count];
+      ex->time=maxt;
+      ex->userData=NULL;
+      ex->prob=rec[count].prob;
+      ex->index=count;
+      ex->name=NULL;
+      if (rec[count].tagOffset >= 0)
+	ex->name=base+h->tagsOffset+rec[count].tagOffset;
+      ex->inputs=pointers;
+      pointers += globalNumGroups;
+      ex->targets=pointers;
+      pointers += globalNumGroups;
+
+      for(j=0;j<rec[count].numBlocks;j++)
+	{
+	  i=rec[count].firstBlock+j;
+	  b=&blocks[i];
+	  end_t = b->end < 0 ? maxt-1 : b->end;
+	  if (b->start >= maxt)
+	    Error1("load_examples: Example has invalid start time (%d)",b->start);
+	  if (end_t >= maxt)
+	    Error1("load_examples: Example has invalid end time (%d)",end_t);
+
+	  edata[i].type=b->format;
+	  edata[i].clampType=b->clampType;
+	  if (b->format==EXPANDED_EXAMPLE)
+	    {
+	      if (b->count!=groups[b->group]->numUnits)
+		Error3("load_examples: group %s has %d units, example gives %d values",
+		       groups[b->group]->name,groups[b->group]->numUnits,b->count);
+	      edata[i].values.expanded.value=(Real *)(base+b->dataOffset);
+	    }
+	  else
+	    {
+	      edata[i].values.sparse.onvalue=
+		b->onvalue==b->onvalue ? b->onvalue : default_exampleOnValue;
+	      edata[i].values.sparse.offvalue=
+		b->offvalue==b->offvalue ? b->offvalue : default_exampleOffValue;
+	      edata[i].values.sparse.numIndices=b->count;
+	      edata[i].values.sparse.indices=
+		b->count > 0 ? (int *)(base+b->dataOffset) : NULL;
+	    }
+
+	  table = b->spec==CLAMP ? ex->inputs : ex->targets;
+	  if (table[groups[b->group]->index]==NULL)
+	    {
+	      table[groups[b->group]->index]=times;
+	      times += maxt;
+	    }
+	  for(t=b->start;t<=end_t;t++)
+	    table[groups[b->group]->index][t]=&edata[i];
+	}
+    }
+  free(groups);
+
+  set=(ExampleSet *)mh_malloc(sizeof(ExampleSet));
+  set->numExamples=h->numExamples;
+  set->examples=examples;
+  set->name=(char *)mh_malloc(strlen(fn)+1);
+  strcpy(set->name,fn);
+  set->histogram=(int *)mh_calloc(sizeof(int),h->numExamples+1);
+  set->currentExample=0;
+  set->alias_prob=NULL;
+  set->alias_index=NULL;
+  build_example_sampler(set);
+  return set;
+}
+
+
 ExampleSet *
 load_examples(char *fn,int maxt)
 {
@@ -349,6 +684,15 @@ load_examples(char *fn,int maxt)
   int is_tmpfile=0;
   char newfn[255];
 
+  /* a compiled copy, if it is up to date.  compressed files are always
+     read as text, since opening them draws a random number */
+  if (strstr(fn,".gz")==NULL && strstr(fn,".Z")==NULL)
+    {
+      set=load_compiled_examples(fn,maxt);
+      if (set)
+	return set;
+    }
+
   f=mikenet_open_for_reading(fn,newfn,&is_tmpfile);
 
   if (f==NULL) 
@@ -424,6 +768,9 @@ load_examples(char *fn,int maxt)
   strcpy(set->name,fn);
   set->histogram=(int *)mh_calloc(sizeof(int),count);
   set->currentExample=0;
+  set->alias_prob=NULL;
+  set->alias_index=NULL;
+  build_example_sampler(set);
 
   return set; /* ok */
 }
@@ -148,6 +148,28 @@ def build_with_make():
         sys.exit(0)
 
     print "Make build successful..."
+
+def build_shared_library():
+    # the in-process backend loads the library (plus the training driver) with ctypes,
+    # so it needs a position independent, shared build of the same sources
+    if sys.platform == 'win32':
+        lib_name = "libmikenet.dll"
+    else:
+        lib_name = "libmikenet.so"
+    sources = ['example.c','net.c','tools.c','crbp.c','random.c','token.c',
+               'parallel.c','bptt.c','linesearch.c','weights.c','error.c',
+               'stats.c','apply.c','analyze.c','dbm.c','elman.c','benchmark.c',
+               'dotprod.c','matrix.c','fastexp.c',
+               os.path.join('..','..','template_code','mikenet_master.c')]
+    print "Building '"+lib_name+"' with gcc..."
+    subprocess.call(['gcc','-shared','-fPIC','-O3','-DMIKENET_SHARED','-I../include',
+                     '-o',lib_name] + sources + ['-lm'])
+    if not os.path.isfile(lib_name):
+        print "Error - Shared library build was not successful."
+        print "MikeNetGUI will still work, but only through compiled runs."
+        return
+    print "Copying '"+lib_name+"' to resources/Mikenet-v8.0/lib..."
+    copyfile(lib_name,os.path.join("..","lib",lib_name))
     
 
 print '''---------------------------------------------------------------------------
@@ -245,6 +267,10 @@ else:
 print "Copying 'libmikenet.a' to resources/Mikenet-v8.0/lib..."
 copyfile("libmikenet.a",os.path.join("..","lib","libmikenet.a"))
 
+# optionally build the shared library too
+if query_yes_no("Also build the shared library for the in-process backend?", "no"):
+    build_shared_library()
+
 # chdir back to the resources folder
 os.chdir(os.pardir)
 os.chdir(os.pardir)
@@ -15,9 +15,25 @@
 //INSERT_FLAG_CONSTANTS
 
 int p,q;
-Phase *phases[NUM_PHASES];
-PhaseItem *phase_items[NUM_PHASE_ITEMS];
-TestSet *test_sets[NUM_TEST_SETS];
+
+void define_constants() {
+	/* hand the model dimensions over to the driver and allocate its arrays */
+	num_phases=NUM_PHASES;
+	num_phase_items=NUM_PHASE_ITEMS;
+	num_test_sets=NUM_TEST_SETS;
+	num_ticks=TIME;
+#ifndef RUNTIME_PARAMETERS
+	run_seed=SEED;
+	run_weight_range=WEIGHT_RANGE;
+#endif
+	phases=(Phase **)mh_calloc(NUM_PHASES,sizeof(Phase *));
+	phase_items=(PhaseItem **)mh_calloc(NUM_PHASE_ITEMS,sizeof(PhaseItem *));
+	/* calloc(0) may return NULL, which mh_calloc treats as out of memory */
+	test_sets=(TestSet **)mh_calloc(NUM_TEST_SETS > 0 ? NUM_TEST_SETS : 1,sizeof(TestSet *));
+#ifdef USE_TESTING
+	test_function=myTestFunction;
+#endif
+}
 
 void construct(Net *run_net) {
 	/* create runNet which is a net struct containing all groups and connections.*/
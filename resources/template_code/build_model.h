@@ -89,6 +89,21 @@ typedef struct {
 	int max_iterations;
 } Phase;
 
-void construct();
+/* defined by the driver (mikenet_master.c), filled in by build_model.c */
+extern Phase **phases;
+extern PhaseItem **phase_items;
+extern TestSet **test_sets;
+extern int num_phases;
+extern int num_phase_items;
+extern int num_test_sets;
+extern int num_ticks;
+extern long run_seed;
+extern Real run_weight_range;
+extern Real run_bias_value;
+extern void (*test_function)(char *fname, Net *n, ExampleSet *x, char **args);
+
+/* defined in the generated build_model.c */
+void define_constants();
+void construct(Net *run_net);
 
 #endif
\ No newline at end of file
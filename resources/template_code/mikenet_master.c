@@ -2,28 +2,188 @@
 #include <math.h>
 #include <stdlib.h>
 #include <string.h>
+#include <stddef.h>
 
 #ifdef unix
 #include <unistd.h>
 #endif
 
-#include "build_model.h"
-#include "build_model.c"
 #include <mikenet/simulator.h>
+#include "build_model.h"
+
+//this driver is compiled once and linked against a small generated build_model.c
+//for each run. everything the driver needs to know about the model is filled in
+//at startup by define_constants() and construct(), defined in build_model.c.
+Phase **phases;
+PhaseItem **phase_items;
+TestSet **test_sets;
+int num_phases=0;
+int num_phase_items=0;
+int num_test_sets=0;
+int num_ticks=0;
+long run_seed=0;
+Real run_weight_range=0;
+Real run_bias_value=0;
+void (*test_function)(char *fname, Net *n, ExampleSet *x, char **args)=NULL;
+//optional callback for average error reports. the in-process backend uses this
+//to collect errors directly instead of parsing them out of the log
+void (*error_hook)(char *item_name, int run_trial, int trial, Real error)=NULL;
 
-int phase_table[NUM_PHASES][NUM_PHASES];
+int **phase_table;
+//per-phase sampling tables for probabilistic interleaving, built once by makePhaseTable:
+//phase_cdf[i] holds the cumulative probabilities of the items in phase i (sorted by
+//probability) and phase_cdf_items[i] the matching phase item indices
+Real **phase_cdf;
+int **phase_cdf_items;
+int *phase_cdf_size;
+//the phase item whose parameters were last applied to its network
+PhaseItem *applied_item=NULL;
 int run_iter_counter=0;
+//run name is passed in on the command line so a cached binary can be shared between runs
+char run_name[512]="mikenet_master";
+
+//runtime parameter mode: the seed, weight range, bias and all phase item training
+//parameters and noise levels are read from a parameter file at startup, so one
+//binary can be shared by every run with the same network topology.
+typedef struct {
+	char *name;
+	size_t offset;
+	int is_real;
+} ItemField;
+
+ItemField item_fields[] = {
+	{"max_iterations",offsetof(PhaseItem,max_iterations),0},
+	{"stop_criterion",offsetof(PhaseItem,stop_criterion),0},
+	{"epsilon",offsetof(PhaseItem,epsilon),1},
+	{"tolerance",offsetof(PhaseItem,tolerance),1},
+	{"momentum",offsetof(PhaseItem,momentum),1},
+	{"error_radius",offsetof(PhaseItem,error_radius),1},
+	{"training_mode",offsetof(PhaseItem,training_mode),0},
+	{"training_algorithm",offsetof(PhaseItem,training_algorithm),0},
+	{"will_save_weights",offsetof(PhaseItem,will_save_weights),0},
+	{"save_weights_interval",offsetof(PhaseItem,save_weights_interval),0},
+	{"will_save_error",offsetof(PhaseItem,will_save_error),0},
+	{"save_error_interval",offsetof(PhaseItem,save_error_interval),0},
+	{"test_interval",offsetof(PhaseItem,test_interval),0},
+	{"will_save_activations",offsetof(PhaseItem,will_save_activations),0},
+	{"save_activations_interval",offsetof(PhaseItem,save_activations_interval),0},
+	{"readout_interval",offsetof(PhaseItem,readout_interval),0},
+	{"error_ramp",offsetof(PhaseItem,error_ramp),0},
+	{"tai",offsetof(PhaseItem,tai),0},
+	{"dbd",offsetof(PhaseItem,dbd),0},
+	{"reset_activation",offsetof(PhaseItem,reset_activation),0},
+	{"seconds",offsetof(PhaseItem,seconds),1},
+	{"tao",offsetof(PhaseItem,tao),1},
+	{"tao_decay",offsetof(PhaseItem,tao_decay),1},
+	{"tao_max_mult",offsetof(PhaseItem,tao_max_mult),1},
+	{"tao_min_mult",offsetof(PhaseItem,tao_min_mult),1},
+	{"tao_epsilon",offsetof(PhaseItem,tao_epsilon),1},
+	{NULL,0,0}
+};
+
+int setItemField(PhaseItem *item,char *name,double value) {
+	int i;
+	for(i=0;item_fields[i].name!=NULL;i++) {
+		if(strcmp(item_fields[i].name,name)==0) {
+			if(item_fields[i].is_real)
+				*(Real *)((char *)item+item_fields[i].offset)=(Real)value;
+			else
+				*(int *)((char *)item+item_fields[i].offset)=(int)value;
+			return 1;
+		}
+	}
+	return 0;
+}
+
+void badParameter(char *line) {
+	fprintf(stderr,"ERROR: bad line in parameter file: %s\n",line);
+	exit(1);
+}
+
+//stage 0 reads the run level values, which are needed before construct().
+//stage 1 reads the phase item values, which can only be set after construct().
+void loadRunParameters(char *fname,int stage) {
+	FILE *f;
+	char line[512],key[128],name[128];
+	int item,index;
+	long seed;
+	double value;
+	
+	f=fopen(fname,"r");
+	if(f==NULL) {
+		fprintf(stderr,"ERROR: cannot open parameter file %s\n",fname);
+		exit(1);
+	}
+	while(fgets(line,sizeof(line),f)!=NULL) {
+		if(sscanf(line,"%127s",key)!=1)
+			continue;
+		if(stage==0) {
+			if(strcmp(key,"seed")==0) {
+				if(sscanf(line,"%*s %ld",&seed)!=1)
+					badParameter(line);
+				run_seed=seed;
+			}
+			else if(strcmp(key,"weight_range")==0) {
+				if(sscanf(line,"%*s %lf",&value)!=1)
+					badParameter(line);
+				run_weight_range=(Real)value;
+			}
+			else if(strcmp(key,"bias_value")==0) {
+				if(sscanf(line,"%*s %lf",&value)!=1)
+					badParameter(line);
+				run_bias_value=(Real)value;
+			}
+		}
+		else if(strcmp(key,"item")==0) {
+			if(sscanf(line,"%*s %d %127s %lf",&item,name,&value)!=3 ||
+			   item<0 || item>=num_phase_items ||
+			   !setItemField(phase_items[item],name,value))
+				badParameter(line);
+		}
+		else if(strcmp(key,"activation_noise")==0) {
+			if(sscanf(line,"%*s %d %d %lf",&item,&index,&value)!=3 ||
+			   item<0 || item>=num_phase_items ||
+			   index<0 || index>=phase_items[item]->total_activation_noise)
+				badParameter(line);
+			phase_items[item]->activation_noise_values[index]=(Real)value;
+		}
+		else if(strcmp(key,"input_noise")==0) {
+			if(sscanf(line,"%*s %d %d %lf",&item,&index,&value)!=3 ||
+			   item<0 || item>=num_phase_items ||
+			   index<0 || index>=phase_items[item]->total_input_noise)
+				badParameter(line);
+			phase_items[item]->input_noise_values[index]=(Real)value;
+		}
+		else if(strcmp(key,"weight_noise")==0) {
+			if(sscanf(line,"%*s %d %d %lf",&item,&index,&value)!=3 ||
+			   item<0 || item>=num_phase_items ||
+			   index<0 || index>=phase_items[item]->total_weight_noise)
+				badParameter(line);
+			phase_items[item]->weight_noise_values[index]=(Real)value;
+		}
+	}
+	fclose(f);
+}
+
 Real error;
 Net *run_net;
 
 void makePhaseTable(PhaseItem *phArray[]) {
-	int i,j;
+	int i,j,n,holePos;
 	int seq_count;
 	//create a 2D array where rows are phases, and cols are phase items
 	//in all positions, a nonzero value indicates phase item j is in phase i.
-	for(i=0;i<NUM_PHASES;i++) {
+	phase_table=(int **)mh_calloc(num_phases,sizeof(int *));
+	phase_cdf=(Real **)mh_calloc(num_phases,sizeof(Real *));
+	phase_cdf_items=(int **)mh_calloc(num_phases,sizeof(int *));
+	phase_cdf_size=(int *)mh_calloc(num_phases,sizeof(int));
+	for(i=0;i<num_phases;i++) {
+		phase_table[i]=(int *)mh_calloc(num_phase_items,sizeof(int));
+		phase_cdf[i]=(Real *)mh_calloc(num_phase_items,sizeof(Real));
+		phase_cdf_items[i]=(int *)mh_calloc(num_phase_items,sizeof(int));
 		seq_count=0;
-		for(j=0;j<NUM_PHASE_ITEMS;j++) {
+		n=0;
+		for(j=0;j<num_phase_items;j++) {
 			if(phArray[j]->which_phase == i) {
 				seq_count++;
 				phase_table[i][j] = seq_count;
@@ -32,63 +192,83 @@ void makePhaseTable(PhaseItem *phArray[]) {
 				//let it define sequential order for items within a phase.
 				//for probabilistic interleaved blocks, all that matters is the value
 				// is nonzero!
+
+				//insertion sort this item's probability into the phase's sampling table.
+				//the sort is stable, so items with equal probabilities keep their order
+				if(phArray[j]->probability > 0) {
+					holePos = n;
+					while (holePos > 0 && phArray[j]->probability < phase_cdf[i][holePos - 1]) {
+						phase_cdf[i][holePos] = phase_cdf[i][holePos - 1];
+						phase_cdf_items[i][holePos] = phase_cdf_items[i][holePos - 1];
+						holePos--;
+					}
+					phase_cdf[i][holePos] = phArray[j]->probability;
+					phase_cdf_items[i][holePos] = j;
+					n++;
+				}
 			} else {
 				phase_table[i][j] = 0;
 			}
 		}
+		//to convert this to a CDF, need to make each value equal
+		//the sum of itself and all previous values...
+		for(j=1;j<n;j++) {
+			phase_cdf[i][j] += phase_cdf[i][j - 1];
+		}
+		phase_cdf_size[i]=n;
 	}
 }
 
-int probabilisticChooseItem(float propArray[]) {
-	//prepare insertion sort of both the probabilities AND their corresponding
-	//phase indices...
-	int i,ans;
-	Real sortArray[2][NUM_PHASE_ITEMS]; //first row: probabilities, second: indices
-	for(i=0;i<NUM_PHASE_ITEMS;i++) {
-		sortArray[0][i] = propArray[i];
-		sortArray[1][i] = (Real) i;
-	}
-	//insertion sort
-	Real valueToInsert_0, valueToInsert_1;
-	int holePos;
-	for (i=1;i<NUM_PHASE_ITEMS;i++) {
-		valueToInsert_0 = sortArray[0][ i ];
-		valueToInsert_1 = sortArray[1][ i ];
-		holePos = i;
-		
-		while (holePos > 0 && valueToInsert_0 < sortArray[0][holePos - 1]) {
-			sortArray[0][holePos] = sortArray[0][holePos - 1];
-			sortArray[1][holePos] = sortArray[1][holePos - 1];
-			holePos--;
-		}
-		sortArray[0][holePos] = valueToInsert_0;
-		sortArray[1][holePos] = valueToInsert_1;
-	}
-	
-	//sortArray now contains sorted probabilities (row 0) 
-	//and corresponding phase array indices (row 1)...
-	//to convert this to a CDF, need to make each row 0 value equal
-	//the sum of itself and all previous values...
-	for (i=1;i<NUM_PHASE_ITEMS;i++) {
-		sortArray[0][ i ] += sortArray[0][ i - 1 ];
+void freePhaseTable() {
+	//runPhases can be called again in the same process (the shared library build),
+	//and makes new tables each time
+	int i;
+	for(i=0;i<num_phases;i++) {
+		free(phase_table[i]);
+		free(phase_cdf[i]);
+		free(phase_cdf_items[i]);
 	}
-	//finally compare random number, u, on [0,1] to each row 0 value and return the
-	//phase index (row 1) at the first spot for which row 0 is larger than u
+	free(phase_table);
+	free(phase_cdf);
+	free(phase_cdf_items);
+	free(phase_cdf_size);
+	phase_table=NULL;
+	phase_cdf=NULL;
+	phase_cdf_items=NULL;
+	phase_cdf_size=NULL;
+}
+
+int probabilisticChooseItem(int this_phase) {
+	//compare random number, u, on [0,1] to the phase's CDF and return the
+	//phase item index at the first spot for which the CDF is larger than u
+	Real *cdf=phase_cdf[this_phase];
+	int lo=0,hi=phase_cdf_size[this_phase],mid;
 	Real u;
 	u = mikenet_random();
-	ans=0;
-	for (i=0;i<NUM_PHASE_ITEMS;i++) {
-		if(u < sortArray[0][i]) {
-			ans = (int)sortArray[1][i];
-			break;
+	while (lo < hi) {
+		mid = (lo + hi) / 2;
+		if (u < cdf[mid]) {
+			hi = mid;
+		} else {
+			lo = mid + 1;
 		}
 	}
-	return ans;
+	if (lo == phase_cdf_size[this_phase]) {
+		//probabilities summing to less than 1 leave the rest of the mass to item 0
+		return 0;
+	}
+	return phase_cdf_items[this_phase][lo];
+}
+
+void reportError(PhaseItem *ph, int trial) {
+	printf("avgError:\t%s\t%d\t%d\t%f\n",ph->item_name,run_iter_counter,trial,ph->error);
+	if (error_hook != NULL)
+		error_hook(ph->item_name,run_iter_counter,trial,ph->error);
 }
 
 void setPhaseItemParameters(PhaseItem *ph) {
 	ph->net->tai=ph->tai;
-	ph->net->integrationConstant=(float)ph->seconds/(float)TIME;
+	ph->net->integrationConstant=(float)ph->seconds/(float)num_ticks;
 	int c,g,u,ng,nc;
 	for (g=0;g<ph->net->numGroups;g++) {
 		ph->net->groups[g]->errorRamp=ph->error_ramp;
@@ -160,7 +340,7 @@ void printReadouts(PhaseItem *ph, ExampleSet *trainOrTest) {
 		//not printing activations
 	} else {
 		printf("saving unit activation values...\n");
-		char fileNames[128];
+		char fileNames[640];
 		sprintf(fileNames,"%s_%d.activations",run_name,run_iter_counter);
 		FILE *fp;
 		fp=fopen(fileNames, "w");
@@ -222,9 +402,9 @@ void test(PhaseItem *ph) {
 		//are required to be strings. see Help for more info!
 		
 		//required format: myTestFunction(char *filename, Net *n, ExampleSet *x, char **optionalargs)
-		#ifdef USE_TESTING
-		myTestFunction(fileNames, ph->net, test_sets[t]->test_examples, test_sets[t]->args);
-		#endif
+		//(build_model.c points test_function at it when the test file defines USE_TESTING)
+		if (test_function != NULL)
+			test_function(fileNames, ph->net, test_sets[t]->test_examples, test_sets[t]->args);
 	}
 }
 
@@ -302,7 +482,12 @@ void train(PhaseItem *ph, int interleaving) {
 	int i,j;
 	
 	Net *net=ph->net;
-	setPhaseItemParameters(ph);
+	//interleaved phases call train() once per trial, so only reapply the item's
+	//parameters when a different item gets the network
+	if (ph != applied_item) {
+		setPhaseItemParameters(ph);
+		applied_item=ph;
+	}
 	
 	while(1) {
 		run_iter_counter++; //a global counter for the whole run (across all individual phase items)
@@ -317,14 +502,14 @@ void train(PhaseItem *ph, int interleaving) {
 			run_iter_counter--;
 			//did we already save the final weights?
 			if (ph->max_iterations % ph->save_weights_interval != 0) {
-				char fileNames[128];
+				char fileNames[640];
 				sprintf(fileNames,"%s_%d.weights",run_name,run_iter_counter);
 				save_state(net,fileNames);
 			}
 			//did we already save the final error?
 			if (ph->max_iterations % ph->save_error_interval != 0) {
 				/* save average error to error file*/
-				printf("avgError:\t%s\t%d\t%d\t%f\n",ph->item_name,run_iter_counter,i-1,ph->error);
+				reportError(ph,i-1);
 			}
 			printf("end of training...maximum iterations reached\n");
             /* pop out of loop */
@@ -355,12 +540,12 @@ void train(PhaseItem *ph, int interleaving) {
 			ph->error = ph->error/(float)ph->ecount;
 			ph->ecount=0;
 			/* save average error to error file*/
-			printf("avgError:\t%s\t%d\t%d\t%f\n",ph->item_name,run_iter_counter,i,ph->error);
+			reportError(ph,i);
 			
 			/* has error dipped below tolerance? */
 			if (ph->error < ph->tolerance && ph->stop_criterion >= 1 && interleaving == 0) {
 				//save weights at this moment
-				char fileNames[128];
+				char fileNames[640];
 				sprintf(fileNames,"%s_%d.weights",run_name,run_iter_counter);
 				save_state(net,fileNames);
 				/* pop out of loop */
@@ -373,7 +558,7 @@ void train(PhaseItem *ph, int interleaving) {
 		/* is it time to save weights? */
 		if (ph->wcount==ph->save_weights_interval)	{
 			if (ph->will_save_weights == 1) {
-				char fileNames[128];
+				char fileNames[640];
 				sprintf(fileNames,"%s_%d.weights",run_name,run_iter_counter);
 				save_state(net,fileNames);
 				ph->wcount=0;
@@ -403,21 +588,12 @@ void doInterleavingPhase(int this_phase, Phase **phArray, PhaseItem **itemArray)
 	//, FILE *error_file) {
 	PhaseItem *ph;
 	int i,pi;
-	Real proportions[NUM_PHASE_ITEMS];
-	//only consider probabilities for phases in the current block
-	for(i=0;i<NUM_PHASE_ITEMS;i++) {
-		if(phase_table[this_phase][i] > 0) {
-			proportions[i] = itemArray[i]->probability;
-		} else {
-			proportions[i] = 0.0;
-		}
-	}
 	//begin interleaving procedure
 	i=0;
     while(i < phArray[this_phase]->max_iterations) {
 		i++;
 	    //first, probabilistically choose phase item.
-		pi = probabilisticChooseItem(proportions);
+		pi = probabilisticChooseItem(this_phase);
 		ph = phase_items[pi];
 		if (ph->training_mode == 0) {
 			printf("training %s in batch mode...\n",ph->item_name);
@@ -428,43 +604,39 @@ void doInterleavingPhase(int this_phase, Phase **phArray, PhaseItem **itemArray)
 		//train(ph,1,error_file);
 	}
 	//save weights at this moment
-	char fileNames[128];
+	char fileNames[640];
 	sprintf(fileNames,"%s_%d.weights",run_name,run_iter_counter);
 	printf("end of interleaving phase...maximum iterations reached\n");
 }
 
-int main(int argc,char *argv[]) {
+void runPhases() {
 	int ph,nz;
-	mikenet_set_seed(SEED);
-	setbuf(stdout,NULL);
-	//announce_version();
-	
-	//build the model -- creates structs for each phase, and also for each phase item.
-	//defined in build_model.c. Note: "phases" and "phase_items" are visible from here.
-	construct(run_net);
+	run_iter_counter=0;
+	applied_item=NULL;
 	
 	//now lay out the phase item table: the purpose of this table is to handle multiple
 	//phase items within each phase. phase items can be presented in just simple sequential 
 	//order (default), or they could be nondeterministically interleaved.
 	//the data structure to organize this is an int[][] array, which is created by calling
-	//makePhaseTable(). phases are rows, and individual phase items correspond to columns.
+	//makePhaseTable(), which also builds the sampling table for each phase. phases are
+	//rows, and individual phase items correspond to columns.
 	makePhaseTable(phase_items);
 	
 	/* open an error file to output error
 	FILE *error_file;
-	char e_filename[128];
+	char e_filename[640];
 	sprintf(e_filename,"%s.error",run_name);
 	error_file = fopen(e_filename,"a");
 	*/
 	
 	//start at the first phase, row 0 of phase_table
-	for(ph=0;ph<NUM_PHASES;ph++) {
+	for(ph=0;ph<num_phases;ph++) {
         int i;
         //print noise data to the log file. this includes noise type, which group/connection
         //to apply the noise to, and the noise amount.
         //note this might change for each phase item, so we do it here
 
-        for(i=0;i<NUM_PHASE_ITEMS;i++) {
+        for(i=0;i<num_phase_items;i++) {
             if(phase_table[ph][i] ==0) {
                 //skip
             } else {
@@ -498,7 +670,7 @@ int main(int argc,char *argv[]) {
 			//sequential block, default
 			printf("starting phase %s\nusing sequential order...\n",phases[ph]->phase_name);
 
-			for(i=0;i<NUM_PHASE_ITEMS;i++) {
+			for(i=0;i<num_phase_items;i++) {
 				if(phase_table[ph][i] ==0) {
 					//skip
 				} else {
@@ -526,6 +698,39 @@ int main(int argc,char *argv[]) {
 			//doInterleavingPhase(ph,phases,phase_items,error_file);
 		}
 	}
+	freePhaseTable();
+}
+
+#ifdef MIKENET_SHARED
+//the shared library build (libmikenet.so) has no main(). models are built from
+//python instead and trained by calling runPhases(), see lib/mikenet_binding.py
+void setGroupTypes(Group *g, int activation_type, int error_computation) {
+	g->activationType=activation_type;
+	g->errorComputation=error_computation;
+}
+#else
+int main(int argc,char *argv[]) {
+	if(argc > 1) {
+		strncpy(run_name,argv[1],sizeof(run_name)-1);
+	}
+	//array sizes, tick count and (unless they come from a parameter file) the seed
+	//and weight range are defined in build_model.c
+	define_constants();
+	if(argc > 2) {
+		loadRunParameters(argv[2],0);
+	}
+	mikenet_set_seed(run_seed);
+	setbuf(stdout,NULL);
+	//announce_version();
+	
+	//build the model -- creates structs for each phase, and also for each phase item.
+	//defined in build_model.c. Note: "phases" and "phase_items" are visible from here.
+	construct(run_net);
+	if(argc > 2) {
+		loadRunParameters(argv[2],1);
+	}
+	
+	runPhases();
 	printf("simulation complete. exiting now.\n");
 	FILE *f;
     f = fopen("db_flag","w");
@@ -533,3 +738,4 @@ int main(int argc,char *argv[]) {
 	/*fclose(error_file)*/
   return 0;
 }
+#endif